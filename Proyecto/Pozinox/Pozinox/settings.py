@@ -3,6 +3,7 @@ Django settings for Pozinox project.
 """
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 import dj_database_url
 
@@ -79,11 +80,19 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.usuarios.roles.RolMiddleware',  # request.rol (tipo de usuario resuelto una vez por petición)
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'apps.usuarios.middleware.VisitorTrackingMiddleware',  # Rastreo de visitantes
 ]
 
+# PerfilModelBackend carga el perfil con select_related. ModelBackend se mantiene
+# para que las sesiones iniciadas antes del cambio sigan siendo válidas.
+AUTHENTICATION_BACKENDS = [
+    'apps.usuarios.backends.PerfilModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 ROOT_URLCONF = 'Pozinox.urls'
 
 TEMPLATES = [
@@ -97,6 +106,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'apps.usuarios.context_processors.visitor_info',  # Info del visitante
+                'apps.usuarios.context_processors.notificaciones',  # Badge de notificaciones
             ],
         },
     },
@@ -172,6 +182,10 @@ STATICFILES_DIRS = [
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 # Media files
+# Uploads sobre este tamaño se escriben en un archivo temporal en vez de memoria
+# (S3StreamingStorage y SupabaseStorage suben los archivos grandes desde ahí)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+
 # Configuración de almacenamiento (Supabase Storage con S3)
 USE_S3_STORAGE = os.getenv('AWS_ACCESS_KEY_ID') is not None
 
@@ -216,14 +230,23 @@ else:
     MEDIA_URL = '/media/'
     MEDIA_ROOT = BASE_DIR / 'media'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_HOST_USER = 'pozinox.empresa@gmail.com'
-EMAIL_HOST_PASSWORD = 'btdibdpvszuiyklg'  # App Password de Django
-EMAIL_USE_TLS = True
+# Para probar en local sin Gmail: EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False
+# (por ejemplo Mailpit, o `pip install aiosmtpd && python -m aiosmtpd -n -l localhost:1025`)
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', 'pozinox.empresa@gmail.com')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', 'btdibdpvszuiyklg')  # App Password de Django
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
+EMAIL_TIMEOUT = 30
 DEFAULT_FROM_EMAIL = 'pozinox.empresa@gmail.com'
 
+# Bandeja de salida: con True los correos los envía `python manage.py enviar_correos`;
+# con False se envían al confirmar la transacción que los generó
+CORREOS_ASINCRONOS = os.getenv('CORREOS_ASINCRONOS', 'False') == 'True'
+CORREOS_POR_MINUTO = int(os.getenv('CORREOS_POR_MINUTO', '60'))  # 0 = sin límite
+CORREOS_MAX_INTENTOS = 5
+
 # Configuración de verificación de email
 EMAIL_VERIFICATION_REQUIRED = False  # NO requerir verificación para login
 
@@ -240,6 +263,22 @@ if SUPABASE_URL and SUPABASE_KEY:
 
 MERCADOPAGO_ACCESS_TOKEN = os.getenv('MERCADOPAGO_ACCESS_TOKEN', '')
 
+# Token para integraciones externas (feed de cambios): Authorization: Bearer <token>
+API_INTEGRACIONES_TOKEN = os.getenv('API_INTEGRACIONES_TOKEN', '')
+
+# Reportes: con True se generan en segundo plano (requiere `python manage.py procesar_reportes`)
+REPORTES_ASINCRONOS = os.getenv('REPORTES_ASINCRONOS', 'False') == 'True'
+
+# Miniaturas de productos: con True las genera `python manage.py generar_miniaturas`;
+# con False se generan al guardar la imagen, en IMAGENES_HILOS hilos del proceso
+IMAGENES_ASINCRONAS = os.getenv('IMAGENES_ASINCRONAS', 'False') == 'True'
+IMAGENES_HILOS = int(os.getenv('IMAGENES_HILOS', '2'))
+
+# Visitas: se insertan en lotes de VISITAS_LOTE (ver apps/usuarios/middleware.py). En las
+# pruebas cada visita se inserta en su petición: un lote en memoria sobreviviría al
+# rollback de cada prueba
+VISITAS_LOTE = 1 if sys.argv[1:2] == ['test'] else int(os.getenv('VISITAS_LOTE', '20'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,125 @@
+"""
+Exportación de listados y reportes a CSV o XLSX.
+
+Las vistas construyen su queryset filtrado como siempre y lo pasan a
+``exportar_queryset`` junto con las columnas a exportar. Las filas se leen con
+``values_list(...).iterator(chunk_size=...)`` de modo que la memoria usada no
+depende de la cantidad de registros.
+
+Los textos que empiezan con =, +, - o @ (o tabulación / retorno) se exportan
+con un apóstrofo delante: Excel y LibreOffice los interpretarían como fórmula
+y un dato ingresado por un cliente (nombre, razón social) podría ejecutarse
+al abrir el archivo.
+"""
+import csv
+import datetime
+import tempfile
+
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils import timezone
+
+
+FORMATOS_EXPORTACION = ('csv', 'xlsx')
+TAMANO_CHUNK = 2000
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en vez de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def formato_solicitado(request):
+    """Retorna 'csv' o 'xlsx' si la petición pide exportar (?exportar=...), o None"""
+    formato = request.GET.get('exportar')
+    return formato if formato in FORMATOS_EXPORTACION else None
+
+
+def _valor_celda(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime.datetime):
+        if timezone.is_aware(valor):
+            valor = timezone.localtime(valor)
+        return valor.strftime('%Y-%m-%d %H:%M')
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    if isinstance(valor, bool):
+        return 'Sí' if valor else 'No'
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def _filas(queryset, columnas, chunk_size):
+    """Genera las filas ya formateadas a partir de la proyección values_list"""
+    campos = [columna[0] for columna in columnas]
+    formateadores = [columna[2] if len(columna) > 2 else None for columna in columnas]
+    # prefetch_related no aplica con values_list y obliga a cargar todo en memoria
+    filas = queryset.prefetch_related(None).values_list(*campos).iterator(chunk_size=chunk_size)
+    for fila in filas:
+        yield [
+            _valor_celda(formatear(valor) if formatear else valor)
+            for valor, formatear in zip(fila, formateadores)
+        ]
+
+
+def _nombre_con_fecha(nombre_archivo, extension):
+    return f"{nombre_archivo}_{timezone.localtime().strftime('%Y%m%d_%H%M')}.{extension}"
+
+
+def exportar_csv(filas, encabezados, nombre_archivo):
+    """StreamingHttpResponse con el CSV generado fila a fila"""
+    escritor = csv.writer(_Eco())
+
+    def generar():
+        # BOM para que Excel detecte UTF-8 (tildes y ñ)
+        yield '\ufeff'
+        yield escritor.writerow(encabezados)
+        for fila in filas:
+            yield escritor.writerow(fila)
+
+    response = StreamingHttpResponse(generar(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{_nombre_con_fecha(nombre_archivo, "csv")}"'
+    return response
+
+
+def exportar_xlsx(filas, encabezados, nombre_archivo):
+    """
+    Genera el XLSX con openpyxl en modo write_only (las filas no quedan en memoria)
+    sobre un archivo temporal y lo envía por partes.
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(title=nombre_archivo[:31])
+    hoja.append(encabezados)
+    for fila in filas:
+        hoja.append(fila)
+
+    temporal = tempfile.TemporaryFile(suffix='.xlsx')
+    libro.save(temporal)
+    temporal.seek(0)
+    return FileResponse(
+        temporal,
+        as_attachment=True,
+        filename=_nombre_con_fecha(nombre_archivo, 'xlsx'),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+def exportar_queryset(queryset, columnas, nombre_archivo, formato='csv', chunk_size=TAMANO_CHUNK):
+    """
+    Exporta un queryset filtrado.
+
+    ``columnas`` es una lista de tuplas ``(campo, encabezado)`` o
+    ``(campo, encabezado, formateador)`` donde ``campo`` es cualquier lookup
+    válido para values_list (ej: 'usuario__email') o una anotación del queryset.
+    """
+    encabezados = [columna[1] for columna in columnas]
+    filas = _filas(queryset, columnas, chunk_size)
+    if formato == 'xlsx':
+        return exportar_xlsx(filas, encabezados, nombre_archivo)
+    return exportar_csv(filas, encabezados, nombre_archivo)
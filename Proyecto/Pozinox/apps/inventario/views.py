@@ -1,8 +1,7 @@
 import random
-from django.core.mail import send_mail
-from django.conf import settings
 from django.shortcuts import render
 from apps.tienda.models import Producto, CategoriaAcero
+from apps.usuarios.correo import encolar_correo
 
 def home(request):
     # ...tu lógica actual...
@@ -55,12 +54,10 @@ Email: {email}
 Teléfono: {telefono}
 Mensaje: {mensaje}
 """
-            send_mail(
-                subject="Nuevo mensaje de contacto Pozinox",
-                message=cuerpo,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=["pozinox.empresa@gmail.com"],
-                fail_silently=False,
+            encolar_correo(
+                asunto="Nuevo mensaje de contacto Pozinox",
+                destinatarios=["pozinox.empresa@gmail.com"],
+                texto=cuerpo,
             )
             success = "¡Mensaje enviado correctamente! Nos contactaremos pronto."
 
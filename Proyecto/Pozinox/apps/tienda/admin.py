@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Producto, CategoriaAcero, Cliente, Pedido, DetallePedido, Cotizacion, DetalleCotizacion, TransferenciaBancaria, VentaN8n
+from .models import Producto, CategoriaAcero, Cliente, Pedido, DetallePedido, Cotizacion, DetalleCotizacion, TransferenciaBancaria, VentaN8n, HistorialPrecio, TrabajoReporte, VarianteProducto
 
 
 @admin.register(CategoriaAcero)
@@ -11,9 +11,17 @@ class CategoriaAceroAdmin(admin.ModelAdmin):
     ordering = ['nombre']
 
 
+class VarianteProductoInline(admin.TabularInline):
+    """Inline para variantes (medidas) del producto"""
+    model = VarianteProducto
+    extra = 0
+    fields = ['medida', 'codigo_variante', 'precio_por_unidad', 'stock_actual', 'peso_por_metro', 'activa']
+
+
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):
     """Administración de productos"""
+    inlines = [VarianteProductoInline]
     list_display = ['codigo_producto', 'nombre', 'categoria', 'tipo_acero', 'precio_por_unidad', 'stock_actual', 'activo', 'imagen_preview']
     list_filter = ['categoria', 'tipo_acero', 'activo']
     search_fields = ['nombre', 'codigo_producto', 'descripcion']
@@ -41,6 +49,12 @@ class ProductoAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_readonly_fields(self, request, obj=None):
+        # Con variantes, stock_actual es la suma de sus stocks: se edita en cada medida
+        if obj is not None and obj.tiene_variantes:
+            return [*super().get_readonly_fields(request, obj), 'stock_actual']
+        return super().get_readonly_fields(request, obj)
+    
     def imagen_preview(self, obj):
         """Mostrar preview de la imagen en el admin"""
         if obj.imagen:
@@ -179,3 +193,23 @@ class VentaN8nAdmin(admin.ModelAdmin):
             'fields': ('fecha_creacion', 'fecha_actualizacion', 'fecha_pago')
         }),
     )
+
+
+@admin.register(HistorialPrecio)
+class HistorialPrecioAdmin(admin.ModelAdmin):
+    """Historial de cambios de precio"""
+    list_display = ['producto', 'precio_anterior', 'precio_nuevo', 'regla', 'usuario', 'fecha']
+    list_filter = ['fecha']
+    search_fields = ['producto__codigo_producto', 'producto__nombre', 'regla']
+    ordering = ['-fecha']
+    raw_id_fields = ['producto']
+    readonly_fields = ['producto', 'precio_anterior', 'precio_nuevo', 'regla', 'usuario', 'fecha']
+
+
+@admin.register(TrabajoReporte)
+class TrabajoReporteAdmin(admin.ModelAdmin):
+    """Reportes generados en segundo plano"""
+    list_display = ['tipo', 'desde', 'hasta', 'estado', 'fecha_creacion', 'fecha_fin']
+    list_filter = ['estado', 'tipo']
+    ordering = ['-fecha_creacion']
+    readonly_fields = ['resultado', 'version_datos', 'error', 'fecha_creacion', 'fecha_inicio', 'fecha_fin']
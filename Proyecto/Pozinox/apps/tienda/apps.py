@@ -5,3 +5,7 @@ class TiendaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.tienda'
     verbose_name = 'Tienda de Aceros'
+
+    def ready(self):
+        # Conecta las señales (versión del catálogo)
+        from . import signals
@@ -0,0 +1,118 @@
+"""
+Autocompletado de productos por código o nombre con un índice en memoria.
+
+Cada proceso guarda dos listas ordenadas de (clave, producto_id): los
+códigos normalizados y, por nombre, el texto desde el inicio de cada palabra
+("tubo redondo 1/2" genera "tubo redondo 1/2", "redondo 1/2" y "1/2"). Un
+prefijo se busca con bisect y se recorre solo el tramo que empieza con él:
+las coincidencias por código van primero y luego las por nombre, sin
+consultar la base de datos. Los códigos solo se buscan para el staff (a los
+clientes no se les muestran).
+
+El índice se marca con la versión de contenido del catálogo
+(catalogo.version_contenido, en caché; no cambia con el stock) y se
+reconstruye en la primera búsqueda después de un cambio.
+Mientras un hilo lo reconstruye, los demás siguen respondiendo con el
+anterior.
+"""
+import bisect
+import threading
+
+from apps.usuarios.busqueda import normalizar_texto
+
+from . import catalogo
+from .models import Producto
+
+LIMITE = 10
+MIN_CARACTERES = 2
+
+_lock = threading.Lock()
+_indice = None
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes y con los espacios colapsados"""
+    texto = texto or ''
+    # La mayoría de códigos y nombres no tienen tildes: se evita la descomposición Unicode
+    texto = texto.lower() if texto.isascii() else normalizar_texto(texto)
+    return ' '.join(texto.split())
+
+
+class IndicePrefijos:
+    """Listas ordenadas de claves para buscar productos por prefijo"""
+
+    def __init__(self, version, productos):
+        self.version = version
+        self.productos = {}
+        codigos = []
+        nombres = []
+        for producto_id, codigo, nombre, precio, precio_minimo, precio_maximo, unidad in productos:
+            self.productos[producto_id] = (codigo, nombre, precio_minimo if precio_minimo is not None else precio,
+                                           precio_minimo != precio_maximo, unidad)
+            codigos.append((normalizar(codigo), producto_id))
+            palabras = normalizar(nombre).split(' ')
+            for inicio in range(len(palabras)):
+                nombres.append((' '.join(palabras[inicio:]), producto_id))
+        codigos.sort()
+        nombres.sort()
+        self.codigos = codigos
+        self.nombres = nombres
+
+    @staticmethod
+    def _con_prefijo(claves, prefijo):
+        """ids de las claves que empiezan con ``prefijo``, en orden"""
+        for posicion in range(bisect.bisect_left(claves, (prefijo,)), len(claves)):
+            clave, producto_id = claves[posicion]
+            if not clave.startswith(prefijo):
+                return
+            yield producto_id
+
+    def buscar(self, texto, limite=LIMITE, por_codigo=True):
+        """Hasta ``limite`` productos: primero por código (si ``por_codigo``), luego por nombre"""
+        prefijo = normalizar(texto)
+        if len(prefijo) < MIN_CARACTERES:
+            return []
+        encontrados = []
+        vistos = set()
+        for claves in ((self.codigos, self.nombres) if por_codigo else (self.nombres,)):
+            for producto_id in self._con_prefijo(claves, prefijo):
+                if producto_id not in vistos:
+                    vistos.add(producto_id)
+                    encontrados.append((producto_id, *self.productos[producto_id]))
+                    if len(encontrados) >= limite:
+                        return encontrados
+        return encontrados
+
+
+def _construir(version):
+    productos = Producto.objects.filter(activo=True).order_by().values_list(
+        'id', 'codigo_producto', 'nombre', 'precio_por_unidad', 'precio_minimo', 'precio_maximo', 'unidad_medida'
+    )
+    return IndicePrefijos(version, productos.iterator(chunk_size=5000))
+
+
+def obtener_indice():
+    """Índice del proceso para la versión vigente del catálogo"""
+    global _indice
+    version = catalogo.version_contenido()
+    indice = _indice
+    if indice is not None and indice.version == version:
+        return indice
+    # Si otro hilo ya lo está reconstruyendo, se responde con el anterior
+    if not _lock.acquire(blocking=indice is None):
+        return indice
+    try:
+        if _indice is None or _indice.version != version:
+            _indice = _construir(version)
+        return _indice
+    finally:
+        _lock.release()
+
+
+def buscar(texto, limite=LIMITE, por_codigo=True):
+    """
+    Productos activos cuyo código (si ``por_codigo``) o alguna palabra del
+    nombre empieza con ``texto``: lista de (id, código, nombre, precio desde,
+    tiene rango, unidad).
+    """
+    return obtener_indice().buscar(texto, limite, por_codigo)
@@ -0,0 +1,303 @@
+"""
+Versión del catálogo y API de catálogo/stock para n8n.
+
+VersionCatalogo guarda un contador que aumenta con cada cambio de Producto o
+CategoriaAcero: las señales de signals.py cubren save()/delete() y las
+escrituras masivas (update, bulk_create) llaman a ``incrementar_version``. El
+aumento se hace al confirmar la transacción que escribió, en su propia
+sentencia: la fila del contador no queda bloqueada mientras dura esa
+transacción (cada facturación escribe stock). Si el proceso muere entre el
+commit y el aumento, las entradas en caché vencen igual en DURACION_PAGINA.
+La versión se lee de la caché de Django, así que responder un 304 no
+consulta la base de datos; con varios procesos y caché local (LocMem) cada
+proceso la relee a lo más cada DURACION_VERSION segundos.
+
+Hay dos contadores: la versión del catálogo cambia con todo, y la versión de
+contenido no cambia con las escrituras que solo tocan el stock
+(``incrementar_version(solo_stock=True)``). La usan los fragmentos que no
+muestran stock (destacados, relacionados, categorías) y el índice de
+autocompletado. Un tercer contador, la versión de reportes, aumenta al
+eliminar cotizaciones (ver reportes.version_datos).
+
+Las respuestas de la API se guardan en caché con clave versión + parámetros:
+cuando cambia la versión las entradas anteriores simplemente dejan de usarse.
+
+Las páginas públicas (home, productos, detalle) usan la misma versión:
+``cache_pagina_anonima`` guarda el HTML completo para visitantes sin sesión
+(clave: versión + ruta + filtros del listado) y lo sirve sin consultas; para
+usuarios con sesión, las plantillas guardan fragmentos ({% cache %}) con la
+versión, el tipo de vista y los filtros como clave (``contexto_cache``).
+"""
+import hashlib
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .models import Producto, VersionCatalogo
+
+NOMBRE_VERSION = 'catalogo'
+CLAVE_VERSION = 'catalogo:version'
+NOMBRE_VERSION_CONTENIDO = 'catalogo_contenido'
+CLAVE_VERSION_CONTENIDO = 'catalogo:version_contenido'
+NOMBRE_VERSION_REPORTES = 'reportes'
+CLAVE_VERSION_REPORTES = 'catalogo:version_reportes'
+DURACION_VERSION = 30  # segundos
+DURACION_RESPUESTA = 600  # segundos
+DURACION_PAGINA = 600  # segundos
+
+MAX_SKUS = 500
+POR_PAGINA = 200
+MAX_POR_PAGINA = 1000
+
+# Campo público -> campo del ORM. El orden es el de la respuesta por defecto
+CAMPOS_API = {
+    'id': 'id',
+    'sku': 'codigo_producto',
+    'nombre': 'nombre',
+    'categoria': 'categoria__nombre',
+    'categoria_id': 'categoria_id',
+    'tipo_acero': 'tipo_acero',
+    'precio': 'precio_por_unidad',
+    'stock': 'stock_actual',
+    'unidad_medida': 'unidad_medida',
+    'medidas': 'medidas',
+    'peso_por_metro': 'peso_por_metro',
+    'descripcion': 'descripcion',
+    'fecha_actualizacion': 'fecha_actualizacion',
+}
+CAMPOS_POR_DEFECTO = ['id', 'sku', 'nombre', 'categoria', 'tipo_acero', 'precio', 'stock', 'unidad_medida']
+
+
+class ParametroInvalido(ValueError):
+    """Parámetro de la API de catálogo fuera de rango o desconocido"""
+
+
+# ============================================
+# VERSIÓN
+# ============================================
+
+def _version(nombre, clave):
+    version = cache.get(clave)
+    if version is None:
+        version = VersionCatalogo.objects.filter(nombre=nombre).values_list('version', flat=True).first() or 0
+        cache.add(clave, version, DURACION_VERSION)
+    return version
+
+
+def version_catalogo():
+    """Versión actual del catálogo (sin consultas si está en caché)"""
+    return _version(NOMBRE_VERSION, CLAVE_VERSION)
+
+
+def version_contenido():
+    """Versión de lo que no es stock: nombres, precios, imágenes, categorías"""
+    return _version(NOMBRE_VERSION_CONTENIDO, CLAVE_VERSION_CONTENIDO)
+
+
+def version_reportes():
+    """Versión de los datos de reportes que no deja rastro en fecha_actualizacion (cotizaciones eliminadas)"""
+    return _version(NOMBRE_VERSION_REPORTES, CLAVE_VERSION_REPORTES)
+
+
+def _aumentar(nombres_claves):
+    """Aumenta los contadores (fuera de la transacción que los pidió) y borra su caché"""
+    for nombre, _ in nombres_claves:
+        if not VersionCatalogo.objects.filter(nombre=nombre).update(version=F('version') + 1):
+            marca, creada = VersionCatalogo.objects.get_or_create(nombre=nombre, defaults={'version': 1})
+            if not creada:
+                VersionCatalogo.objects.filter(pk=marca.pk).update(version=F('version') + 1)
+    cache.delete_many([clave for _, clave in nombres_claves])
+
+
+def incrementar_version(solo_stock=False):
+    """
+    Aumenta la versión al confirmar la transacción actual (de inmediato si no
+    hay una). Con ``solo_stock`` no cambia la versión de contenido.
+    """
+    nombres_claves = [(NOMBRE_VERSION, CLAVE_VERSION)]
+    if not solo_stock:
+        nombres_claves.append((NOMBRE_VERSION_CONTENIDO, CLAVE_VERSION_CONTENIDO))
+    # robust: un error al aumentar se registra y no afecta a la escritura ya confirmada
+    transaction.on_commit(lambda: _aumentar(nombres_claves), robust=True)
+
+
+def incrementar_version_reportes():
+    """Aumenta la versión de reportes al confirmar la transacción actual"""
+    transaction.on_commit(lambda: _aumentar([(NOMBRE_VERSION_REPORTES, CLAVE_VERSION_REPORTES)]), robust=True)
+
+
+# ============================================
+# API
+# ============================================
+
+def _lista(valor):
+    return [v.strip() for v in (valor or '').split(',') if v.strip()]
+
+
+def parametros_consulta(get):
+    """
+    Normaliza los parámetros GET de la API. Retorna un diccionario ordenado
+    (sirve como clave de caché) o lanza ParametroInvalido.
+    """
+    campos = _lista(get.get('campos')) or CAMPOS_POR_DEFECTO
+    desconocidos = [c for c in campos if c not in CAMPOS_API]
+    if desconocidos:
+        raise ParametroInvalido(f'Campos desconocidos: {", ".join(desconocidos)}')
+
+    skus = sorted(set(_lista(get.get('skus'))))
+    if len(skus) > MAX_SKUS:
+        raise ParametroInvalido(f'Máximo {MAX_SKUS} SKUs por consulta')
+
+    try:
+        pagina = int(get.get('pagina', 1))
+        por_pagina = int(get.get('por_pagina', POR_PAGINA))
+    except ValueError:
+        raise ParametroInvalido('pagina y por_pagina deben ser números')
+    if pagina < 1 or not 1 <= por_pagina <= MAX_POR_PAGINA:
+        raise ParametroInvalido(f'pagina debe ser >= 1 y por_pagina entre 1 y {MAX_POR_PAGINA}')
+
+    return {
+        'campos': campos,
+        'categoria': (get.get('categoria') or '').strip(),
+        'tipo_acero': (get.get('tipo_acero') or '').strip(),
+        'skus': skus,
+        'pagina': pagina,
+        'por_pagina': por_pagina,
+    }
+
+
+def etag(version, parametros):
+    """ETag fuerte: versión del catálogo + huella de los parámetros"""
+    huella = hashlib.sha1(repr(sorted(parametros.items())).encode('utf-8')).hexdigest()[:16]
+    return f'"{version}-{huella}"'
+
+
+def consultar_productos(parametros):
+    """
+    Respuesta compacta {"columnas", "filas"} armada desde filas de values_list.
+    Una búsqueda por SKUs devuelve todas las coincidencias (sin paginar) y
+    lista los SKUs que no se encontraron.
+    """
+    productos = Producto.objects.filter(activo=True)
+    categoria = parametros['categoria']
+    if categoria:
+        if categoria.isdigit():
+            productos = productos.filter(categoria_id=int(categoria))
+        else:
+            productos = productos.filter(categoria__nombre__iexact=categoria)
+    if parametros['tipo_acero']:
+        productos = productos.filter(tipo_acero=parametros['tipo_acero'])
+
+    campos = parametros['campos']
+    columnas = [CAMPOS_API[c] for c in campos]
+
+    if parametros['skus']:
+        filas = list(
+            productos.filter(codigo_producto__in=parametros['skus'])
+            .order_by('id').values_list('codigo_producto', *columnas)
+        )
+        encontrados = {fila[0] for fila in filas}
+        return {
+            'columnas': campos,
+            'filas': [list(fila[1:]) for fila in filas],
+            'no_encontrados': [sku for sku in parametros['skus'] if sku not in encontrados],
+        }
+
+    por_pagina = parametros['por_pagina']
+    inicio = (parametros['pagina'] - 1) * por_pagina
+    # Se pide una fila extra para saber si hay página siguiente sin hacer COUNT
+    filas = list(productos.order_by('id').values_list(*columnas)[inicio:inicio + por_pagina + 1])
+    return {
+        'columnas': campos,
+        'filas': [list(fila) for fila in filas[:por_pagina]],
+        'pagina': parametros['pagina'],
+        'siguiente': parametros['pagina'] + 1 if len(filas) > por_pagina else None,
+    }
+
+
+def clave_respuesta(etiqueta):
+    return f'catalogo:respuesta:{etiqueta}'
+
+
+# ============================================
+# PÁGINAS PÚBLICAS
+# ============================================
+
+_RE_CSRF = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+# Únicos parámetros GET que leen las páginas públicas: cualquier otro (?x=...)
+# no debe crear entradas nuevas en la caché
+PARAMETROS_PAGINA = ('categoria', 'q', 'page', 'medida_min', 'medida_max')
+
+
+def contexto_cache(request):
+    """
+    Variables para las claves de {% cache %} en las plantillas públicas: las
+    versiones del catálogo y el tipo de vista (los botones cambian según si el
+    usuario inició sesión o es staff).
+    """
+    user = request.user
+    if not user.is_authenticated:
+        vista = 'anonimo'
+    elif user.is_staff:
+        vista = 'staff'
+    else:
+        vista = 'cliente'
+    return {
+        'version_catalogo': version_catalogo(),
+        'version_contenido': version_contenido(),
+        'vista_catalogo': vista,
+        'duracion_cache_catalogo': DURACION_PAGINA,
+    }
+
+
+def _sin_sesion(request):
+    """Visitante sin sesión ni mensajes pendientes: su página es igual para todos"""
+    return (
+        settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and CookieStorage.cookie_name not in request.COOKIES
+    )
+
+
+def parametros_pagina(request):
+    """Filtros del listado presentes en la URL, en orden fijo"""
+    return [(nombre, request.GET.getlist(nombre)) for nombre in PARAMETROS_PAGINA if nombre in request.GET]
+
+
+def clave_pagina(request):
+    parametros = parametros_pagina(request)
+    huella = hashlib.sha1(repr((request.path, parametros)).encode('utf-8')).hexdigest()
+    return f'catalogo:pagina:{version_catalogo()}:{huella}'
+
+
+def cache_pagina_anonima(vista):
+    """
+    Sirve desde caché los GET de visitantes sin sesión. El token CSRF de los
+    formularios se reemplaza por uno del visitante actual.
+    """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if request.method != 'GET' or not _sin_sesion(request):
+            return vista(request, *args, **kwargs)
+
+        clave = clave_pagina(request)
+        contenido = cache.get(clave)
+        if contenido is not None:
+            if _RE_CSRF.search(contenido):
+                token = get_token(request).encode('ascii')
+                contenido = _RE_CSRF.sub(lambda m: m.group(1) + token + m.group(2), contenido)
+            return HttpResponse(contenido)
+
+        response = vista(request, *args, **kwargs)
+        # No se guarda si la vista escribió en la sesión
+        if response.status_code == 200 and not response.streaming and not request.session.modified:
+            cache.set(clave, response.content, DURACION_PAGINA)
+        return response
+    return envoltura
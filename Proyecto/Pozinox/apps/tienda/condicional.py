@@ -0,0 +1,172 @@
+"""
+GET condicionales (ETag / Last-Modified) para el catálogo y las descargas.
+
+``condicional(validadores)`` envuelve una vista con ``condition`` de Django:
+``validadores(request, *args, **kwargs)`` retorna (etag, última modificación)
+con a lo más una consulta indexada y, si el navegador envía el mismo ETag en
+If-None-Match (o una fecha igual o posterior en If-Modified-Since), se
+responde 304 sin ejecutar la vista: no se arma la plantilla ni el PDF. Si
+retorna None (objeto inexistente o sin permiso) la vista responde como
+siempre (404, redirección).
+
+Validadores:
+- listado de productos: versión del catálogo (en caché, sin consultas)
+- detalle de producto: Producto.fecha_actualizacion + versión del catálogo
+  (los productos relacionados cambian sin tocar el producto)
+- PDF de cotización: Cotizacion.fecha_actualizacion, resumen de sus líneas
+  (id más alto y cantidad: eliminar una línea no siempre toca la cotización),
+  datos del cliente que se imprimen y versión de contenido del catálogo
+  (nombres y códigos de los productos), todo en una consulta
+- documento tributario: nombre del PDF guardado (el storage nunca sobrescribe,
+  un PDF nuevo tiene otro nombre) o, si se genera al vuelo, lo mismo que el
+  PDF de cotización
+
+Las páginas cambian según quién las ve (encabezado, badge de notificaciones,
+token CSRF), así que su ETag incluye una huella del visitante y las
+respuestas llevan Cache-Control: private, no-cache (el navegador revalida
+siempre y los proxies no las guardan).
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from apps.usuarios.notificaciones import no_leidas
+
+from . import catalogo
+from .models import Cotizacion, Producto
+
+
+def _huella(*partes):
+    return hashlib.sha1(repr(partes).encode('utf-8')).hexdigest()[:16]
+
+
+def condicional(validadores):
+    """Decorador: 304 si el navegador ya tiene la versión vigente"""
+    def calcular(request, *args, **kwargs):
+        # condition() pide el ETag y la fecha por separado: se calculan una vez
+        if not hasattr(request, '_validadores_condicionales'):
+            request._validadores_condicionales = validadores(request, *args, **kwargs) or (None, None)
+        return request._validadores_condicionales
+
+    def decorador(vista):
+        con_condicion = condition(
+            etag_func=lambda request, *args, **kwargs: calcular(request, *args, **kwargs)[0],
+            last_modified_func=lambda request, *args, **kwargs: calcular(request, *args, **kwargs)[1],
+        )(vista)
+
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            response = con_condicion(request, *args, **kwargs)
+            if response.has_header('ETag'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return envoltura
+    return decorador
+
+
+def _visitante(request):
+    """
+    Huella de lo que cambia la página según el visitante: sesión, token CSRF,
+    rol y notificaciones sin leer. None si hay mensajes pendientes (un 304 no
+    los mostraría).
+    """
+    if CookieStorage.cookie_name in request.COOKIES:
+        return None
+    user = request.user
+    extra = (user.pk, user.is_staff, no_leidas(user)) if user.is_authenticated else ()
+    return _huella(
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        *extra,
+    )
+
+
+# ============================================
+# PÁGINAS DEL CATÁLOGO
+# ============================================
+
+def validadores_catalogo(request, *args, **kwargs):
+    """Listados: versión del catálogo + filtros del listado (sin consultas)"""
+    visitante = _visitante(request)
+    if visitante is None:
+        return None
+    parametros = _huella(request.path, catalogo.parametros_pagina(request))
+    return f'W/"{catalogo.version_catalogo()}-{parametros}-{visitante}"', None
+
+
+def validadores_producto(request, producto_id):
+    """Detalle: Producto.fecha_actualizacion (una consulta por la PK)"""
+    visitante = _visitante(request)
+    if visitante is None:
+        return None
+    # order_by('pk'): el orden por defecto de Producto agrega un JOIN a la categoría
+    modificado = Producto.objects.filter(pk=producto_id, activo=True).order_by('pk').values_list(
+        'fecha_actualizacion', flat=True
+    ).first()
+    if modificado is None:
+        return None
+    etiqueta = f'W/"p{producto_id}-{modificado.timestamp()}-{catalogo.version_catalogo()}-{visitante}"'
+    return etiqueta, modificado
+
+
+# ============================================
+# DESCARGAS
+# ============================================
+
+def _cotizaciones_visibles(request):
+    """Staff ve todas las cotizaciones; los clientes, solo las suyas"""
+    if request.user.is_staff or request.rol.es_staff:
+        return Cotizacion.objects.all()
+    return Cotizacion.objects.filter(usuario=request.user)
+
+
+# Datos del cliente que imprimen los PDF (User no tiene fecha de modificación)
+CAMPOS_CLIENTE_PDF = (
+    'usuario__username', 'usuario__first_name', 'usuario__last_name', 'usuario__email',
+    'usuario__perfil__fecha_actualizacion',
+)
+
+
+def _fila_pdf(request, cotizacion_id, documentos=None):
+    """Todo lo que cambia el PDF de la cotización, en una consulta; None si no es visible"""
+    cotizaciones = _cotizaciones_visibles(request).filter(pk=cotizacion_id)
+    if documentos:
+        cotizaciones = cotizaciones.filter(facturada=True).exclude(tipo_documento__isnull=True).exclude(tipo_documento='')
+    return (
+        cotizaciones.values('fecha_actualizacion', 'pdf_documento', *CAMPOS_CLIENTE_PDF)
+        .annotate(ultimo_detalle=Max('detalles__id'), lineas=Count('detalles'))
+        .order_by('pk')
+        .first()
+    )
+
+
+def _validadores_pdf(prefijo, cotizacion_id, fila):
+    modificado = max(
+        fecha for fecha in (fila['fecha_actualizacion'], fila['usuario__perfil__fecha_actualizacion']) if fecha
+    )
+    huella = _huella(sorted(fila.items()), catalogo.version_contenido())
+    return f'W/"{prefijo}{cotizacion_id}-{huella}"', modificado
+
+
+def validadores_cotizacion_pdf(request, cotizacion_id):
+    """PDF de la cotización: la cotización, sus líneas y el cliente"""
+    fila = _fila_pdf(request, cotizacion_id)
+    if fila is None:
+        return None
+    return _validadores_pdf('c', cotizacion_id, fila)
+
+
+def validadores_documento_tributario(request, cotizacion_id):
+    """Documento tributario: el PDF guardado o, si se genera al vuelo, como el PDF de cotización"""
+    fila = _fila_pdf(request, cotizacion_id, documentos=True)
+    if fila is None:
+        return None
+    if fila['pdf_documento']:
+        # Mismo archivo, mismos bytes: ETag fuerte
+        return f'"d{cotizacion_id}-{_huella(fila["pdf_documento"])}"', fila['fecha_actualizacion']
+    return _validadores_pdf('d', cotizacion_id, fila)
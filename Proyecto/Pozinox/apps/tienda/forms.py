@@ -1,5 +1,6 @@
 from django import forms
 from .models import Producto, CategoriaAcero
+from .precios import TIPOS_CAMBIO, REDONDEOS
 
 
 class CategoriaForm(forms.ModelForm):
@@ -82,6 +83,11 @@ class ProductoForm(forms.ModelForm):
             self.fields[field].required = True
         
         self.fields['categoria'].queryset = CategoriaAcero.objects.filter(activa=True)
+        
+        # Con variantes, stock_actual es la suma de sus stocks (ver variantes.py)
+        if self.instance.pk and self.instance.tiene_variantes:
+            self.fields['stock_actual'].disabled = True
+            self.fields['stock_actual'].help_text = 'Suma del stock de las medidas: se modifica en cada medida.'
     
     def clean_codigo_producto(self):
         codigo = self.cleaned_data.get('codigo_producto')
@@ -104,3 +110,45 @@ class ProductoForm(forms.ModelForm):
         if precio is not None and precio <= 0:
             raise forms.ValidationError('El precio debe ser mayor a 0.')
         return precio
+
+
+class ReglaPrecioForm(forms.Form):
+    """Formulario para actualizar precios de forma masiva"""
+    
+    categoria = forms.ModelChoiceField(
+        queryset=CategoriaAcero.objects.all(), required=False, empty_label='Todas las categorías',
+        label='Categoría', widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    tipo_acero = forms.ChoiceField(
+        choices=[('', 'Todos los tipos')] + Producto.TIPOS_ACERO, required=False,
+        label='Tipo de Acero', widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    prefijo_codigo = forms.CharField(
+        max_length=50, required=False, label='Prefijo de Código',
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Ej: TUB-'})
+    )
+    tipo_cambio = forms.ChoiceField(
+        choices=TIPOS_CAMBIO, label='Tipo de Cambio',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    valor = forms.DecimalField(
+        max_digits=12, decimal_places=2, label='Valor',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'placeholder': 'Ej: 5 para +5%, -1000 para -$1.000'})
+    )
+    redondeo = forms.ChoiceField(
+        choices=REDONDEOS, initial='entero', label='Redondeo',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    def clean_valor(self):
+        valor = self.cleaned_data.get('valor')
+        if valor == 0:
+            raise forms.ValidationError('El valor no puede ser 0.')
+        return valor
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('tipo_cambio') == 'porcentaje' and cleaned_data.get('valor') is not None:
+            if cleaned_data['valor'] <= -100:
+                raise forms.ValidationError('Una rebaja porcentual debe ser mayor a -100%.')
+        return cleaned_data
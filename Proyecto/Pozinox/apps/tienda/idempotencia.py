@@ -0,0 +1,78 @@
+"""
+Encabezado Idempotency-Key para las APIs que usa n8n.
+
+La primera petición con una clave reserva la fila ClaveIdempotencia (única por
+clave y ruta) y, al terminar, guarda el código y el cuerpo JSON de la
+respuesta. Las repeticiones con la misma clave reciben esa respuesta sin
+volver a ejecutar la vista. Si la clave se reutiliza con otro cuerpo se
+responde 422, y si la primera petición aún no termina, 409.
+
+Las respuestas 5xx no se guardan (la clave se libera para reintentar). Las
+claves se conservan VIGENCIA_CLAVES y se eliminan al registrar claves nuevas.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import ClaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+ENCABEZADO = 'Idempotency-Key'
+VIGENCIA_CLAVES = timedelta(hours=24)
+
+
+def _limpiar_vencidas():
+    ClaveIdempotencia.objects.filter(fecha_creacion__lt=timezone.now() - VIGENCIA_CLAVES).delete()
+
+
+def idempotente(vista):
+    """Decorador para vistas POST que responden JsonResponse"""
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        clave = request.headers.get(ENCABEZADO, '').strip()
+        if not clave:
+            return vista(request, *args, **kwargs)
+        if len(clave) > 255:
+            return JsonResponse({'error': f'{ENCABEZADO} demasiado largo'}, status=400)
+
+        ruta = request.path[:200]
+        firma = hashlib.sha256(request.body).hexdigest()
+        try:
+            with transaction.atomic():
+                registro = ClaveIdempotencia.objects.create(clave=clave, ruta=ruta, firma=firma)
+        except IntegrityError:
+            previo = ClaveIdempotencia.objects.filter(clave=clave, ruta=ruta).first()
+            if previo is None:
+                return JsonResponse({'error': 'Petición en curso, reintente'}, status=409)
+            if previo.firma != firma:
+                return JsonResponse({'error': f'{ENCABEZADO} ya usado con otro contenido'}, status=422)
+            if not previo.completada:
+                return JsonResponse({'error': 'Petición en curso, reintente'}, status=409)
+            respuesta = JsonResponse(previo.respuesta, status=previo.codigo_respuesta, safe=False)
+            respuesta['Idempotent-Replayed'] = 'true'
+            return respuesta
+
+        _limpiar_vencidas()
+        try:
+            respuesta = vista(request, *args, **kwargs)
+        except Exception:
+            registro.delete()
+            raise
+
+        if respuesta.status_code >= 500 or not isinstance(respuesta, JsonResponse):
+            registro.delete()
+            return respuesta
+        registro.completada = True
+        registro.codigo_respuesta = respuesta.status_code
+        registro.respuesta = json.loads(respuesta.content)
+        registro.save(update_fields=['completada', 'codigo_respuesta', 'respuesta'])
+        return respuesta
+
+    return envoltura
@@ -0,0 +1,188 @@
+"""
+Miniaturas y variantes WebP de las imágenes de productos.
+
+Por cada imagen se generan versiones de ANCHOS píxeles (sin agrandar la
+original) en WebP y JPEG, en el mismo storage de Producto.imagen bajo
+productos/derivados/. Las claves quedan en Producto.imagen_derivados y
+Producto.imagen_derivados_de guarda el nombre de la imagen de origen: un
+producto está pendiente mientras ese nombre no coincida con el de su imagen.
+
+Al subir una imagen, la señal post_save llama a ``encolar`` al confirmar la
+transacción: con IMAGENES_ASINCRONAS=False se genera en un pool de hilos del
+proceso; con True queda pendiente para ``python manage.py generar_miniaturas``,
+que también sirve para poblar las imágenes existentes (se puede interrumpir y
+volver a ejecutar: retoma desde los pendientes).
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from PIL import Image, ImageOps
+
+from . import catalogo
+from .models import Producto
+
+logger = logging.getLogger(__name__)
+
+ANCHOS = (200, 400, 800)
+CALIDAD_WEBP = 80
+CALIDAD_JPEG = 82
+CARPETA = 'productos/derivados'
+
+_lock = threading.Lock()
+_pool = None
+
+
+def pendientes(forzar=False):
+    """Productos con imagen cuyas miniaturas faltan o son de otra imagen"""
+    productos = Producto.objects.exclude(Q(imagen='') | Q(imagen__isnull=True))
+    if not forzar:
+        productos = productos.exclude(imagen_derivados_de=F('imagen'))
+    return productos
+
+
+def _codificar(imagen, formato, calidad):
+    buffer = io.BytesIO()
+    if formato == 'JPEG' and imagen.mode != 'RGB':
+        # JPEG no admite transparencia: se compone sobre fondo blanco
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A') if 'A' in imagen.getbands() else None)
+        imagen = fondo
+    opciones = {'optimize': True, 'progressive': True} if formato == 'JPEG' else {'method': 4}
+    imagen.save(buffer, formato, quality=calidad, **opciones)
+    return buffer.getvalue()
+
+
+def _redimensionar(archivo):
+    """Abre la imagen y la reduce a cada ancho de ANCHOS. Retorna [(ancho, Image)]"""
+    imagen = Image.open(archivo)
+    # En JPEG, draft decodifica directamente a una escala menor (menos memoria y CPU)
+    imagen.draft('RGB', (max(ANCHOS), max(ANCHOS)))
+    imagen = ImageOps.exif_transpose(imagen)
+    if imagen.mode not in ('RGB', 'RGBA'):
+        imagen = imagen.convert('RGBA' if 'transparency' in imagen.info or imagen.mode in ('LA', 'PA') else 'RGB')
+
+    versiones = []
+    for ancho in ANCHOS:
+        # No se agranda la original: el último tamaño queda en su ancho real
+        copia = imagen.copy()
+        copia.thumbnail((min(ancho, imagen.width), ancho * 4), Image.LANCZOS)
+        versiones.append((copia.width, copia))
+        if ancho >= imagen.width:
+            break
+    return versiones
+
+
+def generar_derivados(producto_id, forzar=False):
+    """
+    Genera y guarda las miniaturas de un producto.
+    Retorna 'generado', 'al_dia', 'sin_imagen' o 'reemplazada' (la imagen
+    cambió mientras se procesaba; se descartan las miniaturas recién subidas).
+    """
+    producto = Producto.objects.only('id', 'imagen', 'imagen_derivados', 'imagen_derivados_de').get(pk=producto_id)
+    if not producto.imagen:
+        return 'sin_imagen'
+    origen = producto.imagen.name
+    if origen == producto.imagen_derivados_de and not forzar:
+        return 'al_dia'
+
+    storage = producto.imagen.storage
+    with producto.imagen.open('rb') as archivo:
+        versiones = _redimensionar(archivo)
+
+    base = os.path.splitext(os.path.basename(origen))[0]
+    derivados = []
+    for ancho, imagen in versiones:
+        derivados.append({
+            'ancho': ancho,
+            'webp': storage.save(f'{CARPETA}/{base}_{ancho}.webp', ContentFile(_codificar(imagen, 'WEBP', CALIDAD_WEBP))),
+            'jpeg': storage.save(f'{CARPETA}/{base}_{ancho}.jpg', ContentFile(_codificar(imagen, 'JPEG', CALIDAD_JPEG))),
+        })
+
+    # update() condicionado a la imagen: no dispara post_save y no pisa una imagen nueva
+    actualizados = Producto.objects.filter(pk=producto_id, imagen=origen).update(
+        imagen_derivados=derivados, imagen_derivados_de=origen
+    )
+    if actualizados:
+        _eliminar(storage, producto.imagen_derivados, excepto=derivados)
+        return 'generado'
+    _eliminar(storage, derivados)
+    return 'reemplazada'
+
+
+def _eliminar(storage, derivados, excepto=()):
+    """Borra del storage las miniaturas anteriores (errores solo se registran)"""
+    conservar = {clave for d in excepto for clave in (d['webp'], d['jpeg'])}
+    for derivado in derivados or []:
+        for clave in (derivado.get('webp'), derivado.get('jpeg')):
+            if clave and clave not in conservar:
+                try:
+                    storage.delete(clave)
+                except Exception as e:
+                    logger.warning(f'No se pudo eliminar la miniatura {clave}: {e}')
+
+
+def generar_en_hilo(producto_id, forzar=False, versionar=True):
+    """
+    generar_derivados para un hilo del pool: registra el error y libera la
+    conexión. Con ``versionar`` aumenta la versión del catálogo (las páginas
+    en caché muestran las miniaturas nuevas).
+    """
+    close_old_connections()
+    try:
+        estado = generar_derivados(producto_id, forzar)
+        if versionar and estado == 'generado':
+            catalogo.incrementar_version()
+        return estado
+    except Producto.DoesNotExist:
+        return 'sin_imagen'
+    except Exception:
+        logger.exception(f'Error al generar miniaturas del producto {producto_id}')
+        return 'error'
+    finally:
+        connection.close()
+
+
+def _obtener_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGENES_HILOS', 2), thread_name_prefix='miniaturas'
+            )
+        return _pool
+
+
+def encolar(producto_id):
+    """Programa las miniaturas de un producto recién guardado"""
+    if getattr(settings, 'IMAGENES_ASINCRONAS', False):
+        return  # las genera el comando generar_miniaturas
+    _obtener_pool().submit(generar_en_hilo, producto_id)
+
+
+# ============================================
+# URLS PARA PLANTILLAS
+# ============================================
+
+def srcset(producto, formato='webp'):
+    """'url 200w, url 400w, ...' de las miniaturas vigentes, o '' si no hay"""
+    if not producto.imagen or producto.imagen_derivados_de != producto.imagen.name:
+        return ''
+    storage = producto.imagen.storage
+    return ', '.join(f"{storage.url(d[formato])} {d['ancho']}w" for d in producto.imagen_derivados)
+
+
+def url_imagen(producto, ancho=400):
+    """URL del JPEG más pequeño de al menos ``ancho`` px (o el mayor); la original si no hay miniaturas"""
+    if not producto.imagen:
+        return ''
+    if producto.imagen_derivados_de != producto.imagen.name or not producto.imagen_derivados:
+        return producto.imagen.url
+    elegido = next((d for d in producto.imagen_derivados if d['ancho'] >= ancho), producto.imagen_derivados[-1])
+    return producto.imagen.storage.url(elegido['jpeg'])
@@ -0,0 +1,417 @@
+"""
+Importación masiva de productos desde CSV o XLSX.
+
+El archivo se lee fila a fila (sin cargarlo completo en memoria) y los productos
+se insertan/actualizan por ``codigo_producto`` en lotes usando
+``bulk_create(update_conflicts=True)``. Las categorías se resuelven contra un
+mapa en memoria cargado una sola vez.
+"""
+import csv
+import io
+import json
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Producto, CategoriaAcero
+from .catalogo import incrementar_version
+from .medidas import sincronizar as sincronizar_medidas
+
+
+COLUMNAS_REQUERIDAS = ['codigo_producto', 'nombre', 'categoria', 'tipo_acero', 'precio_por_unidad']
+
+# Campos que se sobrescriben cuando el código ya existe (imagen y fecha_creacion se conservan)
+CAMPOS_ACTUALIZABLES = [
+    'nombre', 'descripcion', 'categoria', 'tipo_acero', 'peso_por_metro', 'medidas',
+    'precio_por_unidad', 'stock_actual', 'stock_minimo', 'unidad_medida', 'activo',
+    'fecha_actualizacion',
+]
+
+# Campos comparados en el modo de simulación (dry-run)
+CAMPOS_COMPARABLES = [c for c in CAMPOS_ACTUALIZABLES if c != 'fecha_actualizacion']
+
+TIPOS_ACERO_VALIDOS = {valor for valor, _ in Producto.TIPOS_ACERO}
+VALORES_VERDADEROS = {'1', 'si', 'sí', 'true', 'verdadero', 'x', 's', 'yes'}
+VALORES_FALSOS = {'0', 'no', 'false', 'falso', 'n'}
+
+# "12.345" o "1.234.567": punto como separador de miles (formato chileno)
+RE_MILES = re.compile(r'-?[1-9]\d{0,2}(?:\.\d{3})+')
+
+MAX_ERRORES_DETALLE = 200
+MAX_CAMBIOS_DETALLE = 500
+
+
+class ErrorImportacion(Exception):
+    """Error que impide procesar el archivo completo (formato, columnas, etc.)"""
+
+
+def leer_filas(archivo, nombre_archivo):
+    """
+    Genera diccionarios {columna: valor} a partir de un archivo CSV o XLSX.
+    ``archivo`` debe ser un objeto binario (archivo abierto o UploadedFile).
+    """
+    extension = nombre_archivo.rsplit('.', 1)[-1].lower() if '.' in nombre_archivo else ''
+    if extension == 'csv':
+        return _leer_csv(archivo)
+    if extension in ('xlsx', 'xlsm'):
+        return _leer_xlsx(archivo)
+    raise ErrorImportacion(f'Formato no soportado: "{nombre_archivo}". Use CSV o XLSX.')
+
+
+def _normalizar_encabezados(encabezados):
+    return [str(e or '').strip().lower().replace(' ', '_') for e in encabezados]
+
+
+def _validar_encabezados(encabezados):
+    faltantes = [c for c in COLUMNAS_REQUERIDAS if c not in encabezados]
+    if faltantes:
+        raise ErrorImportacion(f'Faltan columnas obligatorias: {", ".join(faltantes)}')
+
+
+def _leer_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    try:
+        muestra = texto.read(4096)
+        texto.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        lector = csv.reader(texto, dialecto)
+        encabezados = _normalizar_encabezados(next(lector, []))
+        _validar_encabezados(encabezados)
+        for valores in lector:
+            if not any(v.strip() for v in valores):
+                continue
+            yield dict(zip(encabezados, valores))
+    finally:
+        # No cerrar el archivo subyacente junto con el wrapper
+        texto.detach()
+
+
+def _leer_xlsx(archivo):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ErrorImportacion('Para importar XLSX se requiere instalar openpyxl.')
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja = libro.active
+        filas = hoja.iter_rows(values_only=True)
+        encabezados = _normalizar_encabezados(next(filas, []))
+        _validar_encabezados(encabezados)
+        for valores in filas:
+            if not any(v not in (None, '') for v in valores):
+                continue
+            yield dict(zip(encabezados, valores))
+    finally:
+        libro.close()
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    return str(valor).strip()
+
+
+def _numero_chileno(valor, texto):
+    """
+    Texto numérico con punto decimal. En las celdas de texto se acepta el
+    formato chileno: "12.345,67" y "12.345" (doce mil trescientos cuarenta y
+    cinco). Las celdas numéricas de XLSX no llevan separadores.
+    """
+    if not isinstance(valor, str):
+        return texto
+    if ',' in texto:
+        return texto.replace('.', '').replace(',', '.')
+    if RE_MILES.fullmatch(texto):
+        return texto.replace('.', '')
+    return texto
+
+
+def _decimal(valor, campo, requerido=False):
+    texto = _texto(valor).replace('$', '').replace(' ', '')
+    if not texto:
+        if requerido:
+            raise ValueError(f'{campo} es obligatorio')
+        return None
+    texto = _numero_chileno(valor, texto)
+    try:
+        numero = Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f'{campo} no es un número válido: "{valor}"')
+    # Se valida contra la columna: un valor fuera de rango haría fallar bulk_create a mitad de la importación
+    field = Producto._meta.get_field(campo)
+    limite = Decimal(10) ** (field.max_digits - field.decimal_places)
+    if not numero.is_finite() or abs(numero) >= limite:
+        raise ValueError(f'{campo} fuera de rango: "{valor}"')
+    # Más decimales de los que guarda la columna: no se redondea en silencio
+    if numero.as_tuple().exponent < -field.decimal_places:
+        raise ValueError(f'{campo} tiene más de {field.decimal_places} decimales: "{valor}"')
+    return numero.quantize(Decimal(1).scaleb(-field.decimal_places))
+
+
+def _entero(valor, campo, defecto):
+    texto = _texto(valor)
+    if not texto:
+        return defecto
+    try:
+        numero = Decimal(_numero_chileno(valor, texto))
+    except InvalidOperation:
+        raise ValueError(f'{campo} no es un entero válido: "{valor}"')
+    if not numero.is_finite() or numero != numero.to_integral_value():
+        raise ValueError(f'{campo} no es un entero válido: "{valor}"')
+    if numero < 0:
+        raise ValueError(f'{campo} no puede ser negativo')
+    _, maximo = connection.ops.integer_field_range(Producto._meta.get_field(campo).get_internal_type())
+    if numero > maximo:
+        raise ValueError(f'{campo} fuera de rango: "{valor}"')
+    return int(numero)
+
+
+def _booleano(valor, defecto=True):
+    if isinstance(valor, bool):
+        return valor
+    texto = _texto(valor).lower()
+    if not texto:
+        return defecto
+    if texto in VALORES_VERDADEROS:
+        return True
+    if texto in VALORES_FALSOS:
+        return False
+    raise ValueError(f'activo no es un valor válido: "{valor}"')
+
+
+def validar_medidas(valor):
+    """
+    Valida que las medidas sean un JSON array de strings y devuelve el JSON
+    normalizado. También acepta una lista separada por "|" (ej: 1/2"|3/4").
+    """
+    texto = _texto(valor)
+    if not texto:
+        return '[]'
+    if texto[0] in '[{':
+        try:
+            medidas = json.loads(texto)
+        except json.JSONDecodeError:
+            raise ValueError(f'medidas no es un JSON válido: {texto[:50]}')
+        if not isinstance(medidas, list):
+            raise ValueError('medidas debe ser una lista')
+    else:
+        medidas = texto.split('|')
+    limpias = []
+    for medida in medidas:
+        if not isinstance(medida, (str, int, float)):
+            raise ValueError('cada medida debe ser un texto')
+        medida = str(medida).strip()
+        if medida and medida not in limpias:
+            limpias.append(medida)
+    return json.dumps(limpias, ensure_ascii=False)
+
+
+def construir_producto(fila, categorias):
+    """
+    Convierte una fila en una instancia de Producto sin guardar.
+    ``categorias`` es el mapa {nombre_en_minusculas: id}.
+    Lanza ValueError con el motivo si la fila no es válida.
+    """
+    codigo = _texto(fila.get('codigo_producto'))
+    if not codigo:
+        raise ValueError('codigo_producto es obligatorio')
+    if len(codigo) > 50:
+        raise ValueError('codigo_producto supera los 50 caracteres')
+
+    nombre = _texto(fila.get('nombre'))
+    if not nombre:
+        raise ValueError('nombre es obligatorio')
+
+    nombre_categoria = _texto(fila.get('categoria'))
+    categoria_id = categorias.get(nombre_categoria.lower())
+    if categoria_id is None:
+        raise ValueError(f'categoría desconocida: "{nombre_categoria}"')
+
+    tipo_acero = _texto(fila.get('tipo_acero'))
+    if tipo_acero not in TIPOS_ACERO_VALIDOS:
+        raise ValueError(f'tipo_acero inválido: "{tipo_acero}"')
+
+    precio = _decimal(fila.get('precio_por_unidad'), 'precio_por_unidad', requerido=True)
+    if precio <= 0:
+        raise ValueError('El precio debe ser mayor a 0')
+
+    return Producto(
+        codigo_producto=codigo,
+        nombre=nombre[:200],
+        descripcion=_texto(fila.get('descripcion')),
+        categoria_id=categoria_id,
+        tipo_acero=tipo_acero,
+        peso_por_metro=_decimal(fila.get('peso_por_metro'), 'peso_por_metro'),
+        medidas=validar_medidas(fila.get('medidas')),
+        precio_por_unidad=precio,
+        # Vacío: 0 en un producto nuevo o sin variantes; en uno con variantes se conserva
+        stock_actual=_entero(fila.get('stock_actual'), 'stock_actual', None),
+        stock_minimo=_entero(fila.get('stock_minimo'), 'stock_minimo', 5),
+        unidad_medida=_texto(fila.get('unidad_medida'))[:20] or 'unidad',
+        activo=_booleano(fila.get('activo')),
+    )
+
+
+def _diferencias(actual, nuevo):
+    """Devuelve {campo: (antes, despues)} para los campos que cambian"""
+    cambios = {}
+    for campo in CAMPOS_COMPARABLES:
+        atributo = 'categoria_id' if campo == 'categoria' else campo
+        antes = getattr(actual, atributo)
+        despues = getattr(nuevo, atributo)
+        if antes != despues:
+            cambios[campo] = (antes, despues)
+    return cambios
+
+
+def importar_productos(filas, dry_run=False, tamano_lote=1000, crear_categorias=False):
+    """
+    Procesa las filas en lotes y hace upsert por codigo_producto.
+
+    Con ``dry_run=True`` no escribe nada y devuelve el detalle de los cambios
+    (productos nuevos y campos modificados) para revisarlos antes de aplicar.
+    """
+    inicio = time.monotonic()
+    categorias = {nombre.lower(): pk for pk, nombre in CategoriaAcero.objects.values_list('id', 'nombre')}
+    resultado = {
+        'filas': 0,
+        'creados': 0,
+        'actualizados': 0,
+        'sin_cambios': 0,
+        'errores': 0,
+        'detalle_errores': [],
+        'cambios': [],
+        'categorias_creadas': [],
+        'dry_run': dry_run,
+    }
+
+    lote = {}
+    for numero_fila, fila in enumerate(filas, start=2):  # la fila 1 es el encabezado
+        resultado['filas'] += 1
+        if crear_categorias:
+            _asegurar_categoria(fila.get('categoria'), categorias, resultado, dry_run)
+        try:
+            producto = construir_producto(fila, categorias)
+        except ValueError as e:
+            _registrar_error(resultado, numero_fila, e)
+            continue
+        producto.fila_importacion = numero_fila
+
+        # Si el código se repite en el archivo, gana la última fila
+        lote[producto.codigo_producto] = producto
+        if len(lote) >= tamano_lote:
+            _procesar_lote(lote, resultado, dry_run)
+            lote = {}
+
+    if lote:
+        _procesar_lote(lote, resultado, dry_run)
+
+    resultado['segundos'] = round(time.monotonic() - inicio, 3)
+    resultado['filas_por_segundo'] = int(resultado['filas'] / resultado['segundos']) if resultado['segundos'] else resultado['filas']
+    return resultado
+
+
+def _registrar_error(resultado, numero_fila, error):
+    resultado['errores'] += 1
+    if len(resultado['detalle_errores']) < MAX_ERRORES_DETALLE:
+        resultado['detalle_errores'].append({'fila': numero_fila, 'error': str(error)})
+
+
+def _stock_de_variantes(lote, existentes, resultado):
+    """
+    En un producto con variantes stock_actual es la suma de sus stocks y lo
+    recalcula variantes.actualizar_resumen: la fila no puede cambiarlo. Se
+    conserva si viene vacío y la fila se rechaza si trae otro valor.
+    """
+    for codigo, nuevo in list(lote.items()):
+        actual = existentes.get(codigo)
+        if actual is None or not actual.tiene_variantes:
+            if nuevo.stock_actual is None:
+                nuevo.stock_actual = 0
+        elif nuevo.stock_actual is None:
+            nuevo.stock_actual = actual.stock_actual
+        elif nuevo.stock_actual != actual.stock_actual:
+            del lote[codigo]
+            _registrar_error(
+                resultado, nuevo.fila_importacion,
+                f'{codigo} tiene variantes: su stock_actual se modifica en cada medida (dejar la columna vacía)',
+            )
+
+
+def _asegurar_categoria(nombre, categorias, resultado, dry_run):
+    nombre = _texto(nombre)
+    if not nombre or nombre.lower() in categorias:
+        return
+    if dry_run:
+        # En simulación se usa un id ficticio para poder validar el resto de la fila
+        categorias[nombre.lower()] = -1
+    else:
+        categoria, _ = CategoriaAcero.objects.get_or_create(nombre=nombre[:100])
+        categorias[nombre.lower()] = categoria.id
+    resultado['categorias_creadas'].append(nombre)
+
+
+def _procesar_lote(lote, resultado, dry_run):
+    existentes = Producto.objects.in_bulk(list(lote.keys()), field_name='codigo_producto')
+    _stock_de_variantes(lote, existentes, resultado)
+
+    if dry_run:
+        for codigo, nuevo in lote.items():
+            actual = existentes.get(codigo)
+            if actual is None:
+                resultado['creados'] += 1
+                cambio = {'codigo': codigo, 'accion': 'crear', 'campos': {}}
+            else:
+                campos = _diferencias(actual, nuevo)
+                if not campos:
+                    resultado['sin_cambios'] += 1
+                    continue
+                resultado['actualizados'] += 1
+                cambio = {'codigo': codigo, 'accion': 'actualizar', 'campos': campos}
+            if len(resultado['cambios']) < MAX_CAMBIOS_DETALLE:
+                resultado['cambios'].append(cambio)
+        return
+
+    # Solo se escriben los productos nuevos o con cambios reales
+    pendientes = []
+    con_medidas_nuevas = []
+    for codigo, nuevo in lote.items():
+        actual = existentes.get(codigo)
+        if actual is None:
+            resultado['creados'] += 1
+        elif _diferencias(actual, nuevo):
+            resultado['actualizados'] += 1
+        else:
+            resultado['sin_cambios'] += 1
+            continue
+        pendientes.append(nuevo)
+        if actual is None or actual.medidas != nuevo.medidas:
+            con_medidas_nuevas.append(codigo)
+
+    if not pendientes:
+        return
+
+    ahora = timezone.now()
+    for producto in pendientes:
+        producto.fecha_actualizacion = ahora
+
+    with transaction.atomic():
+        Producto.objects.bulk_create(
+            pendientes,
+            update_conflicts=True,
+            unique_fields=['codigo_producto'],
+            update_fields=CAMPOS_ACTUALIZABLES,
+        )
+        # bulk_create no envía post_save: las medidas normalizadas se copian aquí
+        if con_medidas_nuevas:
+            sincronizar_medidas(
+                Producto.objects.filter(codigo_producto__in=con_medidas_nuevas).values_list('id', 'medidas')
+            )
+        incrementar_version()
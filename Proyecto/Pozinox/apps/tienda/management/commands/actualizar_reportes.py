@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.tienda.reportes import actualizar_resumenes, recalcular_todo
+
+
+class Command(BaseCommand):
+    help = 'Actualiza las tablas resumen de ventas diarias usadas por los reportes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true', help='Reconstruye las tablas desde cero (ignora la marca de agua)')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        if options['completo']:
+            dias = recalcular_todo()
+        else:
+            dias = actualizar_resumenes()
+        self.stdout.write(self.style.SUCCESS(f'Días recalculados: {dias} ({time.monotonic() - inicio:.2f}s)'))
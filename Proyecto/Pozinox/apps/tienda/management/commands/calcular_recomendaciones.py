@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.tienda.recomendaciones import (
+    MIN_VECES, ErrorRecomendaciones, actualizar_recomendaciones, recalcular_todo,
+)
+
+
+class Command(BaseCommand):
+    help = 'Calcula los productos que se compran juntos (Productos Relacionados del detalle)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true', help='Recalcula todos los productos (ignora la marca de agua)')
+        parser.add_argument('--minimo', type=int, default=MIN_VECES, help=f'Pedidos en común mínimos (default: {MIN_VECES})')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        try:
+            if options['completo']:
+                productos = recalcular_todo(options['minimo'])
+            else:
+                productos = actualizar_recomendaciones(options['minimo'])
+        except ErrorRecomendaciones as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Productos recalculados: {productos} ({time.monotonic() - inicio:.2f}s)'))
@@ -0,0 +1,45 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from apps.tienda.catalogo import incrementar_version
+from apps.tienda.imagenes import generar_en_hilo, pendientes
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas y variantes WebP de las imágenes de productos pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=4, help='Imágenes procesadas en paralelo (default: 4)')
+        parser.add_argument('--lote', type=int, default=200, help='Productos leídos por consulta (default: 200)')
+        parser.add_argument('--forzar', action='store_true', help='Regenera también las que están al día')
+        parser.add_argument('--desde-id', type=int, default=0, help='Retoma desde este id (útil con --forzar)')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        forzar = options['forzar']
+        ultimo_id = options['desde_id']
+        resultados = Counter()
+
+        # Cada producto queda guardado al terminar: si el comando se interrumpe,
+        # la siguiente ejecución solo toma los que siguen pendientes
+        with ThreadPoolExecutor(max_workers=options['hilos'], thread_name_prefix='miniaturas') as pool:
+            while True:
+                ids = list(
+                    pendientes(forzar).filter(id__gt=ultimo_id).order_by('id').values_list('id', flat=True)[:options['lote']]
+                )
+                if not ids:
+                    break
+                generados = 0
+                for estado in pool.map(lambda producto_id: generar_en_hilo(producto_id, forzar, versionar=False), ids):
+                    resultados[estado] += 1
+                    generados += estado == 'generado'
+                if generados:
+                    incrementar_version()  # una vez por lote
+                ultimo_id = ids[-1]
+                self.stdout.write(f'Hasta id {ultimo_id}: {dict(resultados)}')
+
+        mensaje = f'Miniaturas: {dict(resultados) or "nada pendiente"} ({time.monotonic() - inicio:.2f}s)'
+        self.stdout.write(self.style.ERROR(mensaje) if resultados['error'] else self.style.SUCCESS(mensaje))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.tienda.importacion import importar_productos, leer_filas, ErrorImportacion
+
+
+class Command(BaseCommand):
+    help = 'Importa productos desde un archivo CSV o XLSX (upsert por codigo_producto)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta al archivo .csv o .xlsx')
+        parser.add_argument('--dry-run', action='store_true', help='Muestra los cambios sin guardar nada')
+        parser.add_argument('--lote', type=int, default=1000, help='Cantidad de filas por lote (default: 1000)')
+        parser.add_argument('--crear-categorias', action='store_true', help='Crea las categorías que no existan')
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        inicio = time.monotonic()
+        try:
+            with open(ruta, 'rb') as archivo:
+                resultado = importar_productos(
+                    leer_filas(archivo, ruta),
+                    dry_run=options['dry_run'],
+                    tamano_lote=max(options['lote'], 1),
+                    crear_categorias=options['crear_categorias'],
+                )
+        except FileNotFoundError:
+            raise CommandError(f'No existe el archivo: {ruta}')
+        except ErrorImportacion as e:
+            raise CommandError(str(e))
+        segundos = time.monotonic() - inicio
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Modo simulación: no se guardó ningún cambio'))
+            for cambio in resultado['cambios']:
+                if cambio['accion'] == 'crear':
+                    self.stdout.write(f"  + {cambio['codigo']}")
+                else:
+                    detalle = ', '.join(f'{campo}: {antes} -> {despues}' for campo, (antes, despues) in cambio['campos'].items())
+                    self.stdout.write(f"  ~ {cambio['codigo']} ({detalle})")
+
+        for error in resultado['detalle_errores']:
+            self.stdout.write(self.style.ERROR(f"  Fila {error['fila']}: {error['error']}"))
+        if resultado['categorias_creadas']:
+            self.stdout.write(f"Categorías nuevas: {', '.join(resultado['categorias_creadas'])}")
+
+        filas_por_segundo = int(resultado['filas'] / segundos) if segundos else resultado['filas']
+        self.stdout.write(self.style.SUCCESS(
+            f"Filas: {resultado['filas']} | Creados: {resultado['creados']} | "
+            f"Actualizados: {resultado['actualizados']} | Sin cambios: {resultado['sin_cambios']} | "
+            f"Errores: {resultado['errores']} | {segundos:.2f}s ({filas_por_segundo} filas/s)"
+        ))
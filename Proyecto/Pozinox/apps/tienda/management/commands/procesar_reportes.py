@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.tienda.reportes import reclamar_siguiente_trabajo, procesar_trabajo
+
+
+class Command(BaseCommand):
+    help = 'Procesa los reportes pendientes (worker en segundo plano)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa los pendientes y termina')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos de espera cuando no hay trabajos (default: 2)')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Worker de reportes iniciado')
+        while True:
+            close_old_connections()
+            trabajo = reclamar_siguiente_trabajo()
+            if trabajo is None:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            inicio = time.monotonic()
+            trabajo = procesar_trabajo(trabajo)
+            mensaje = f'{trabajo} en {time.monotonic() - inicio:.2f}s'
+            if trabajo.estado == 'error':
+                self.stdout.write(self.style.ERROR(f'{mensaje}: {trabajo.error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(mensaje))
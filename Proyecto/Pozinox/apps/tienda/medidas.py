@@ -0,0 +1,152 @@
+"""
+Medidas de productos en milímetros.
+
+Producto.medidas sigue siendo la lista editable (JSON de textos como 1/2",
+1 1/2" o 25,4 mm) que usan el formulario, la importación y la API. Al
+guardar, cada texto se copia a MedidaProducto con su valor en milímetros
+(índice por milimetros + producto), así el detalle no vuelve a parsear el
+JSON y el catálogo filtra por rango con una subconsulta sobre ese índice.
+
+``a_milimetros`` toma la primera medida con unidad del texto (pulgadas
+fraccionarias o decimales, mm, cm, m): en 1/2" x 1,5 mm el valor es el
+diámetro, 12,7. En una serie como 10 x 20 mm la unidad final vale para
+todas y se toma la primera, 10. Un número pegado a letras (DN25, 1e5) no es
+una medida; un texto sin unidad reconocible (DN25, Sch 40) se guarda sin
+valor numérico y solo se muestra.
+"""
+import json
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import MedidaProducto
+
+PULGADA = Decimal('25.4')
+UNIDADES = {
+    'mm': Decimal('1'),
+    'cm': Decimal('10'),
+    'm': Decimal('1000'),
+    '"': PULGADA,
+    '”': PULGADA,
+    "''": PULGADA,
+    'in': PULGADA,
+    'pulg': PULGADA,
+}
+PRECISION = Decimal('0.001')
+MAXIMO = Decimal('9999999.999')  # max_digits=10, decimal_places=3
+TAMANO_LOTE = 1000
+
+_RE_MEDIDA = re.compile(
+    r"""
+    (?<![\d.,/])(?<![a-wyz])
+    (?:
+        # 1/2, 1 1/2, 1-1/2, 10-3/4 (con espacio, solo un dígito: en "Sch 40 1/2" el 40 no es parte)
+        (?:(?P<entero>\d)\s+|(?P<entero_guion>\d{1,2})-)?(?P<numerador>\d+)/(?P<denominador>\d+)
+        | (?P<numero>\d+(?:[.,]\d+)?)                                        # 25, 25,4, 1.5
+    )
+    \s*
+    (?P<unidad>mm|cm|m(?![a-z])|"|”|''|pulg(?:adas?|\.)?|in(?:ch|\.)?(?![a-z]))?
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+_RE_SEPARADOR = re.compile(r'\s*[x×*]\s*', re.IGNORECASE)
+
+
+def _valor(match):
+    if match.group('numerador'):
+        denominador = int(match.group('denominador'))
+        if not denominador:
+            return None
+        return Decimal(int(match.group('entero') or match.group('entero_guion') or 0)) + Decimal(int(match.group('numerador'))) / denominador
+    try:
+        return Decimal(match.group('numero').replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+
+def _unidad(texto):
+    texto = texto.lower().rstrip('.')
+    if texto.startswith('pulg'):
+        return 'pulg'
+    if texto.startswith('in'):
+        return 'in'
+    return texto
+
+
+def _elegir(texto, coincidencias):
+    """(medida, unidad) de la primera medida con unidad; en 10 x 20 mm, el 10 con mm"""
+    serie = None  # primera medida sin unidad de la serie A x B x ... en curso
+    fin = None
+    for coincidencia in coincidencias:
+        if serie is not None and not _RE_SEPARADOR.fullmatch(texto, fin, coincidencia.start()):
+            serie = None
+        if coincidencia.group('unidad'):
+            return serie or coincidencia, coincidencia.group('unidad')
+        if serie is None:
+            serie = coincidencia
+        fin = coincidencia.end()
+    return None, None
+
+
+def a_milimetros(texto, unidad_por_defecto=None):
+    """
+    Valor en milímetros de la primera medida con unidad del texto, o None.
+    Con ``unidad_por_defecto`` (p. ej. 'mm' en los filtros) se acepta un
+    número sin unidad.
+    """
+    texto = str(texto or '')
+    coincidencias = list(_RE_MEDIDA.finditer(texto))
+    elegida, unidad = _elegir(texto, coincidencias)
+    if elegida is None and unidad_por_defecto and coincidencias:
+        elegida, unidad = coincidencias[0], unidad_por_defecto
+    if elegida is None:
+        return None
+    valor = _valor(elegida)
+    if valor is None:
+        return None
+    unidad = _unidad(unidad)
+    milimetros = (valor * UNIDADES[unidad]).quantize(PRECISION)
+    return milimetros if milimetros <= MAXIMO else None
+
+
+def lista(medidas):
+    """Textos de Producto.medidas (JSON); [] si no es una lista válida"""
+    try:
+        valores = json.loads(medidas or '[]')
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(valores, list):
+        return []
+    return [str(v).strip() for v in valores if str(v).strip()]
+
+
+def filas(producto_id, medidas):
+    """MedidaProducto (sin guardar) de un producto a partir de su JSON de medidas"""
+    return [
+        MedidaProducto(producto_id=producto_id, posicion=posicion, texto=texto[:50], milimetros=a_milimetros(texto))
+        for posicion, texto in enumerate(lista(medidas), start=1)
+    ]
+
+
+def sincronizar(productos):
+    """Reemplaza las medidas normalizadas de ``productos``: iterable de (id, medidas)"""
+    productos = list(productos)
+    for inicio in range(0, len(productos), TAMANO_LOTE):
+        lote = productos[inicio:inicio + TAMANO_LOTE]
+        nuevas = [fila for producto_id, medidas in lote for fila in filas(producto_id, medidas)]
+        with transaction.atomic():
+            MedidaProducto.objects.filter(producto_id__in=[producto_id for producto_id, _ in lote]).delete()
+            MedidaProducto.objects.bulk_create(nuevas, batch_size=TAMANO_LOTE)
+
+
+def filtrar_por_rango(queryset, desde=None, hasta=None):
+    """Productos con alguna medida entre ``desde`` y ``hasta`` mm (incluidos)"""
+    if desde is None and hasta is None:
+        return queryset
+    medidas = MedidaProducto.objects.all()
+    if desde is not None:
+        medidas = medidas.filter(milimetros__gte=desde)
+    if hasta is not None:
+        medidas = medidas.filter(milimetros__lte=hasta)
+    return queryset.filter(id__in=medidas.values('producto_id'))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0017_cotizacion_creado_por_nombre_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistorialPrecio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precio_anterior', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('precio_nuevo', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('regla', models.CharField(help_text='Descripción de la regla que generó el cambio', max_length=255)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historial_precios', to='tienda.producto')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cambios_precio', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Historial de Precio',
+                'verbose_name_plural': 'Historial de Precios',
+                'ordering': ['-fecha'],
+                'indexes': [models.Index(fields=['producto', '-fecha'], name='tienda_hist_product_77249d_idx')],
+            },
+        ),
+    ]
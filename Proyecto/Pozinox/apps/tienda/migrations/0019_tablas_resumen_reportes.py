@@ -0,0 +1,91 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0018_historialprecio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaActualizacionReporte',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('procesado_hasta', models.DateTimeField(blank=True, null=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Marca de Actualización de Reporte',
+                'verbose_name_plural': 'Marcas de Actualización de Reportes',
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaClienteDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pedidos', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Venta Diaria por Cliente',
+                'verbose_name_plural': 'Ventas Diarias por Cliente',
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField(unique=True)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cantidad_ventas', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Venta Diaria',
+                'verbose_name_plural': 'Ventas Diarias',
+                'ordering': ['dia'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaProductoDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Venta Diaria por Producto',
+                'verbose_name_plural': 'Ventas Diarias por Producto',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='cotizacion',
+            index=models.Index(fields=['fecha_actualizacion'], name='tienda_coti_fecha_a_e71aa5_idx'),
+        ),
+        migrations.AddField(
+            model_name='ventaclientediaria',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='compras_diarias', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='ventaproductodiaria',
+            name='producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ventas_diarias', to='tienda.producto'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ventaclientediaria',
+            unique_together={('dia', 'usuario')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='ventaproductodiaria',
+            unique_together={('dia', 'producto')},
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0019_tablas_resumen_reportes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoReporte',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('desde', models.DateField()),
+                ('hasta', models.DateField()),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('version_datos', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Reporte',
+                'verbose_name_plural': 'Trabajos de Reportes',
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='tienda_trab_estado_919798_idx')],
+                'unique_together': {('tipo', 'desde', 'hasta')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0020_trabajoreporte'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=255)),
+                ('ruta', models.CharField(max_length=200)),
+                ('firma', models.CharField(help_text='SHA-256 del cuerpo de la petición', max_length=64)),
+                ('completada', models.BooleanField(default=False)),
+                ('codigo_respuesta', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('respuesta', models.JSONField(blank=True, null=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Clave de Idempotencia',
+                'verbose_name_plural': 'Claves de Idempotencia',
+                'unique_together': {('clave', 'ruta')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0022_version_catalogo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cotizacion',
+            name='tienda_coti_fecha_a_e71aa5_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cotizacion',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='tienda_coti_fecha_a_ca82b9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='tienda_prod_fecha_a_40ac22_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transferenciabancaria',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='tienda_tran_fecha_a_dce3d5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ventan8n',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='tienda_vent_fecha_a_4e63b3_idx'),
+        ),
+    ]
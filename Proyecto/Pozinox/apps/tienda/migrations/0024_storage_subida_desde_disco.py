@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:32
+
+import apps.tienda.models
+import apps.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0023_indices_feed_cambios'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cotizacion',
+            name='comprobante_pago',
+            field=models.FileField(blank=True, help_text='Comprobante de transferencia bancaria', null=True, storage=apps.utils.S3StreamingStorage(), upload_to='comprobantes/'),
+        ),
+        migrations.AlterField(
+            model_name='cotizacion',
+            name='pdf_documento',
+            field=models.FileField(blank=True, help_text='PDF del documento tributario', null=True, storage=apps.utils.S3StreamingStorage(), upload_to='documentos_tributarios/'),
+        ),
+        migrations.AlterField(
+            model_name='producto',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=apps.utils.S3StreamingStorage(), upload_to=apps.tienda.models.producto_imagen_path),
+        ),
+        migrations.AlterField(
+            model_name='transferenciabancaria',
+            name='comprobante',
+            field=models.FileField(blank=True, null=True, storage=apps.utils.S3StreamingStorage(), upload_to='comprobantes/'),
+        ),
+    ]
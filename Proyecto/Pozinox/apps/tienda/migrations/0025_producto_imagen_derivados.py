@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0024_storage_subida_desde_disco'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_derivados',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_derivados_de',
+            field=models.CharField(blank=True, default='', help_text='Imagen desde la que se generaron las miniaturas', max_length=100),
+        ),
+    ]
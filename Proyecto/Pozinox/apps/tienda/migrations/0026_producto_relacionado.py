@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0025_producto_imagen_derivados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoRelacionado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicion', models.PositiveSmallIntegerField()),
+                ('puntaje', models.FloatField(help_text='Similitud coseno entre los pedidos de ambos productos')),
+                ('veces', models.PositiveIntegerField(help_text='Pedidos pagados que incluyen ambos productos')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recomendaciones', to='tienda.producto')),
+                ('relacionado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Producto Relacionado',
+                'verbose_name_plural': 'Productos Relacionados',
+                'ordering': ['producto', 'posicion'],
+                'unique_together': {('producto', 'posicion')},
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:55
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def lista(medidas):
+    """Copia de medidas.lista al escribir esta migración (no importa el código actual)"""
+    try:
+        valores = json.loads(medidas or '[]')
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(valores, list):
+        return []
+    return [str(v).strip() for v in valores if str(v).strip()]
+
+
+def poblar_medidas(apps, schema_editor):
+    """
+    Copia Producto.medidas a MedidaProducto en lotes de 1000 productos. Los
+    milímetros los calcula 0030_recalcular_milimetros con su copia del parser.
+    """
+    Producto = apps.get_model('tienda', 'Producto')
+    MedidaProducto = apps.get_model('tienda', 'MedidaProducto')
+    productos = Producto.objects.exclude(medidas__in=['', '[]']).order_by('id').values_list('id', 'medidas')
+    ultimo_id = 0
+    while True:
+        lote = list(productos.filter(id__gt=ultimo_id)[:1000])
+        if not lote:
+            break
+        MedidaProducto.objects.bulk_create([
+            MedidaProducto(producto_id=producto_id, posicion=posicion, texto=texto[:50])
+            for producto_id, medidas in lote
+            for posicion, texto in enumerate(lista(medidas), start=1)
+        ], batch_size=1000)
+        ultimo_id = lote[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0026_producto_relacionado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedidaProducto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicion', models.PositiveSmallIntegerField()),
+                ('texto', models.CharField(help_text='Medida tal como se muestra, ej: 1/2"', max_length=50)),
+                ('milimetros', models.DecimalField(blank=True, decimal_places=3, help_text='Vacío si el texto no tiene una unidad reconocible', max_digits=10, null=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='medidas_normalizadas', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Medida de Producto',
+                'verbose_name_plural': 'Medidas de Productos',
+                'ordering': ['producto', 'posicion'],
+                'indexes': [models.Index(fields=['milimetros', 'producto'], name='tienda_medi_milimet_0fc3ca_idx')],
+                'unique_together': {('producto', 'posicion')},
+            },
+        ),
+        migrations.RunPython(poblar_medidas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0027_medida_producto'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='detallecotizacion',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='precio_maximo',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='precio_minimo',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='VarianteProducto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('medida', models.CharField(help_text='Ej: 1/2"', max_length=50)),
+                ('codigo_variante', models.CharField(max_length=50, unique=True)),
+                ('precio_por_unidad', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock_actual', models.PositiveIntegerField(default=0)),
+                ('peso_por_metro', models.DecimalField(blank=True, decimal_places=2, help_text='En kg/m', max_digits=8, null=True)),
+                ('activa', models.BooleanField(default=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variantes', to='tienda.producto')),
+            ],
+            options={
+                'verbose_name': 'Variante de Producto',
+                'verbose_name_plural': 'Variantes de Productos',
+                'ordering': ['producto', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='detallecotizacion',
+            name='variante',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='detalles_cotizacion', to='tienda.varianteproducto'),
+        ),
+        migrations.AddConstraint(
+            model_name='detallecotizacion',
+            constraint=models.UniqueConstraint(condition=models.Q(('variante__isnull', True)), fields=('cotizacion', 'producto'), name='detalle_cotizacion_producto_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='detallecotizacion',
+            constraint=models.UniqueConstraint(condition=models.Q(('variante__isnull', False)), fields=('cotizacion', 'variante'), name='detalle_cotizacion_variante_unica'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='varianteproducto',
+            unique_together={('producto', 'medida')},
+        ),
+    ]
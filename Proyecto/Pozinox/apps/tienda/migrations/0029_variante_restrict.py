@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0028_variante_producto'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='detallecotizacion',
+            name='variante',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='detalles_cotizacion', to='tienda.varianteproducto'),
+        ),
+        migrations.AlterField(
+            model_name='varianteproducto',
+            name='activa',
+            field=models.BooleanField(default=True, help_text='Desmarcar para retirar la medida del catálogo'),
+        ),
+    ]
@@ -0,0 +1,115 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+
+# Copia del parser de medidas.py al escribir esta migración: las migraciones no
+# importan el código actual, que puede cambiar después
+PULGADA = Decimal('25.4')
+UNIDADES = {
+    'mm': Decimal('1'),
+    'cm': Decimal('10'),
+    'm': Decimal('1000'),
+    '"': PULGADA,
+    '”': PULGADA,
+    "''": PULGADA,
+    'in': PULGADA,
+    'pulg': PULGADA,
+}
+PRECISION = Decimal('0.001')
+MAXIMO = Decimal('9999999.999')
+
+_RE_MEDIDA = re.compile(
+    r"""
+    (?<![\d.,/])(?<![a-wyz])
+    (?:
+        (?:(?P<entero>\d)\s+|(?P<entero_guion>\d{1,2})-)?(?P<numerador>\d+)/(?P<denominador>\d+)
+        | (?P<numero>\d+(?:[.,]\d+)?)
+    )
+    \s*
+    (?P<unidad>mm|cm|m(?![a-z])|"|”|''|pulg(?:adas?|\.)?|in(?:ch|\.)?(?![a-z]))?
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+_RE_SEPARADOR = re.compile(r'\s*[x×*]\s*', re.IGNORECASE)
+
+
+def _valor(match):
+    if match.group('numerador'):
+        denominador = int(match.group('denominador'))
+        if not denominador:
+            return None
+        return Decimal(int(match.group('entero') or match.group('entero_guion') or 0)) + Decimal(int(match.group('numerador'))) / denominador
+    try:
+        return Decimal(match.group('numero').replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+
+def _unidad(texto):
+    texto = texto.lower().rstrip('.')
+    if texto.startswith('pulg'):
+        return 'pulg'
+    if texto.startswith('in'):
+        return 'in'
+    return texto
+
+
+def _elegir(texto, coincidencias):
+    serie = None
+    fin = None
+    for coincidencia in coincidencias:
+        if serie is not None and not _RE_SEPARADOR.fullmatch(texto, fin, coincidencia.start()):
+            serie = None
+        if coincidencia.group('unidad'):
+            return serie or coincidencia, coincidencia.group('unidad')
+        if serie is None:
+            serie = coincidencia
+        fin = coincidencia.end()
+    return None, None
+
+
+def a_milimetros(texto):
+    texto = str(texto or '')
+    elegida, unidad = _elegir(texto, _RE_MEDIDA.finditer(texto))
+    if elegida is None:
+        return None
+    valor = _valor(elegida)
+    if valor is None:
+        return None
+    milimetros = (valor * UNIDADES[_unidad(unidad)]).quantize(PRECISION)
+    return milimetros if milimetros <= MAXIMO else None
+
+
+def recalcular_milimetros(apps, schema_editor):
+    """
+    Calcula MedidaProducto.milimetros: las series como 10 x 20 mm toman la
+    primera medida y los números pegados a letras (1e5 mm) no se leen como
+    medida. Solo se escriben las filas que cambian.
+    """
+    MedidaProducto = apps.get_model('tienda', 'MedidaProducto')
+    medidas = MedidaProducto.objects.order_by('id').only('id', 'texto', 'milimetros')
+    ultimo_id = 0
+    while True:
+        lote = list(medidas.filter(id__gt=ultimo_id)[:1000])
+        if not lote:
+            break
+        cambiadas = []
+        for medida in lote:
+            milimetros = a_milimetros(medida.texto)
+            if milimetros != medida.milimetros:
+                medida.milimetros = milimetros
+                cambiadas.append(medida)
+        MedidaProducto.objects.bulk_update(cambiadas, ['milimetros'], batch_size=1000)
+        ultimo_id = lote[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0029_variante_restrict'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalcular_milimetros, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0030_recalcular_milimetros'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detallerecepcioncompra',
+            name='variante',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='detalles_recepcion', to='tienda.varianteproducto'),
+        ),
+    ]
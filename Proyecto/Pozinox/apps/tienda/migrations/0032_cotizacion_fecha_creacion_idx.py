@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 11:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tienda', '0031_detalle_recepcion_variante'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cotizacion',
+            index=models.Index(fields=['fecha_creacion'], name='tienda_coti_fecha_c_c800ff_idx'),
+        ),
+    ]
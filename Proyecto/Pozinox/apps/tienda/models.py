@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.conf import settings
-from storages.backends.s3boto3 import S3Boto3Storage
+from apps.utils import S3StreamingStorage
 from decimal import Decimal
 from django.utils import timezone
 from datetime import timedelta
@@ -55,19 +55,28 @@ class Producto(models.Model):
     # ancho eliminado
     # largo eliminado
     peso_por_metro = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True, help_text="En kg/m")
-    # Medidas dinámicas: almacenadas como JSON string de lista, e.g. ['1/2"', '3/4"']
+    # Medidas dinámicas: almacenadas como JSON string de lista, e.g. ['1/2"', '3/4"'].
+    # Se copian a MedidaProducto (en mm) al guardar para mostrarlas y filtrar por rango
     medidas = models.TextField(blank=True, default='[]', help_text='JSON array de medidas disponibles para el producto')
     
     # Precios
     precio_por_unidad = models.DecimalField(max_digits=10, decimal_places=2)
     
+    # Con variantes, precio_minimo/precio_maximo son el rango de precios y
+    # stock_actual la suma del stock de las variantes activas (ver variantes.py)
+    precio_minimo = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    precio_maximo = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    
     # Stock y disponibilidad
     stock_actual = models.PositiveIntegerField(default=0)
     stock_minimo = models.PositiveIntegerField(default=5)
     unidad_medida = models.CharField(max_length=20, default='unidad')
     
     # Metadatos
-    imagen = models.ImageField(upload_to=producto_imagen_path, null=True, blank=True, storage=S3Boto3Storage())
+    imagen = models.ImageField(upload_to=producto_imagen_path, null=True, blank=True, storage=S3StreamingStorage())
+    # Miniaturas generadas por apps/tienda/imagenes.py: [{'ancho', 'webp', 'jpeg'}, ...]
+    imagen_derivados = models.JSONField(default=list, blank=True)
+    imagen_derivados_de = models.CharField(max_length=100, blank=True, default='', help_text="Imagen desde la que se generaron las miniaturas")
     activo = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
@@ -76,6 +85,9 @@ class Producto(models.Model):
         verbose_name = 'Producto'
         verbose_name_plural = 'Productos'
         ordering = ['categoria', 'nombre']
+        indexes = [
+            models.Index(fields=['fecha_actualizacion', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.codigo_producto} - {self.nombre}"
@@ -83,6 +95,61 @@ class Producto(models.Model):
     @property
     def stock_bajo(self):
         return self.stock_actual <= self.stock_minimo
+    
+    @property
+    def precio_desde(self):
+        """Precio a mostrar en el catálogo: el menor de las variantes, si tiene"""
+        return self.precio_minimo if self.precio_minimo is not None else self.precio_por_unidad
+    
+    @property
+    def tiene_rango_precios(self):
+        return self.precio_minimo is not None and self.precio_minimo != self.precio_maximo
+    
+    @property
+    def tiene_variantes(self):
+        """Con variantes activas se cotiza una medida; precio_minimo queda en NULL sin ellas"""
+        return self.precio_minimo is not None
+
+
+class VarianteProducto(models.Model):
+    """Medida de un producto con su propio SKU, precio, stock y peso"""
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='variantes')
+    medida = models.CharField(max_length=50, help_text='Ej: 1/2"')
+    codigo_variante = models.CharField(max_length=50, unique=True)
+    precio_por_unidad = models.DecimalField(max_digits=10, decimal_places=2)
+    stock_actual = models.PositiveIntegerField(default=0)
+    peso_por_metro = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True, help_text="En kg/m")
+    # Una variante ya cotizada no se elimina (las líneas la referencian): se desactiva
+    activa = models.BooleanField(default=True, help_text='Desmarcar para retirar la medida del catálogo')
+    
+    class Meta:
+        verbose_name = 'Variante de Producto'
+        verbose_name_plural = 'Variantes de Productos'
+        unique_together = ['producto', 'medida']
+        ordering = ['producto', 'id']
+    
+    def __str__(self):
+        return f"{self.codigo_variante} - {self.medida}"
+
+
+class MedidaProducto(models.Model):
+    """Cada medida de Producto.medidas con su valor en milímetros (ver medidas.py)"""
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='medidas_normalizadas')
+    posicion = models.PositiveSmallIntegerField()
+    texto = models.CharField(max_length=50, help_text='Medida tal como se muestra, ej: 1/2"')
+    milimetros = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True, help_text="Vacío si el texto no tiene una unidad reconocible")
+    
+    class Meta:
+        verbose_name = 'Medida de Producto'
+        verbose_name_plural = 'Medidas de Productos'
+        unique_together = ['producto', 'posicion']
+        ordering = ['producto', 'posicion']
+        indexes = [
+            models.Index(fields=['milimetros', 'producto']),
+        ]
+    
+    def __str__(self):
+        return f"{self.producto_id}: {self.texto}"
 
 
 class Cliente(models.Model):
@@ -268,7 +335,7 @@ class Cotizacion(models.Model):
     mercadopago_payment_id = models.CharField(max_length=100, blank=True, null=True)
     
     # Comprobante de pago (para transferencia)
-    comprobante_pago = models.FileField(upload_to='comprobantes/', null=True, blank=True, storage=S3Boto3Storage(), help_text="Comprobante de transferencia bancaria")
+    comprobante_pago = models.FileField(upload_to='comprobantes/', null=True, blank=True, storage=S3StreamingStorage(), help_text="Comprobante de transferencia bancaria")
     comentarios_pago = models.TextField(blank=True, help_text="Comentarios adicionales sobre el pago")
     
     # Facturación Electrónica
@@ -288,7 +355,7 @@ class Cotizacion(models.Model):
     track_id_sii = models.CharField(max_length=100, null=True, blank=True, help_text="Track ID del envío al SII")
     estado_sii = models.CharField(max_length=50, null=True, blank=True, help_text="Estado del documento en el SII")
     xml_dte = models.TextField(null=True, blank=True, help_text="XML del DTE generado")
-    pdf_documento = models.FileField(upload_to='documentos_tributarios/', null=True, blank=True, storage=S3Boto3Storage(), help_text="PDF del documento tributario")
+    pdf_documento = models.FileField(upload_to='documentos_tributarios/', null=True, blank=True, storage=S3StreamingStorage(), help_text="PDF del documento tributario")
     
     # Observaciones
     observaciones = models.TextField(blank=True)
@@ -297,6 +364,12 @@ class Cotizacion(models.Model):
         verbose_name = 'Cotización'
         verbose_name_plural = 'Cotizaciones'
         ordering = ['-fecha_creacion']
+        indexes = [
+            # Usado por la actualización incremental de reportes y el feed de cambios
+            models.Index(fields=['fecha_actualizacion', 'id']),
+            # Rangos de días de las tablas resumen (reportes.rangos_dias)
+            models.Index(fields=['fecha_creacion']),
+        ]
     
     def __str__(self):
         nombre_usuario = self.get_nombre_usuario()
@@ -422,6 +495,7 @@ class DetalleCotizacion(models.Model):
     """Detalles de cada producto en una cotización"""
     cotizacion = models.ForeignKey(Cotizacion, on_delete=models.CASCADE, related_name='detalles')
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    variante = models.ForeignKey(VarianteProducto, on_delete=models.RESTRICT, null=True, blank=True, related_name='detalles_cotizacion')
     cantidad = models.PositiveIntegerField(default=1)
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -429,10 +503,31 @@ class DetalleCotizacion(models.Model):
     class Meta:
         verbose_name = 'Detalle de Cotización'
         verbose_name_plural = 'Detalles de Cotización'
-        unique_together = ['cotizacion', 'producto']
+        # Un producto aparece una vez por cotización, o una vez por cada variante
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cotizacion', 'producto'], condition=models.Q(variante__isnull=True),
+                name='detalle_cotizacion_producto_unico',
+            ),
+            models.UniqueConstraint(
+                fields=['cotizacion', 'variante'], condition=models.Q(variante__isnull=False),
+                name='detalle_cotizacion_variante_unica',
+            ),
+        ]
     
     def __str__(self):
-        return f"{self.cotizacion.numero_cotizacion} - {self.producto} x {self.cantidad}"
+        return f"{self.cotizacion.numero_cotizacion} - {self.nombre_producto} x {self.cantidad}"
+    
+    @property
+    def nombre_producto(self):
+        """Nombre del producto con la medida de la variante, si tiene"""
+        if self.variante_id:
+            return f"{self.producto.nombre} ({self.variante.medida})"
+        return self.producto.nombre
+    
+    @property
+    def codigo(self):
+        return self.variante.codigo_variante if self.variante_id else self.producto.codigo_producto
     
     def save(self, *args, **kwargs):
         # Calcular subtotal
@@ -467,7 +562,7 @@ class TransferenciaBancaria(models.Model):
     numero_transaccion = models.CharField(max_length=50, blank=True, help_text="Número de transacción bancaria")
     
     # Comprobante
-    comprobante = models.FileField(upload_to='comprobantes/', storage=S3Boto3Storage(), null=True, blank=True)
+    comprobante = models.FileField(upload_to='comprobantes/', storage=S3StreamingStorage(), null=True, blank=True)
     observaciones_cliente = models.TextField(blank=True, help_text="Observaciones del cliente")
     
     # Verificación
@@ -484,6 +579,9 @@ class TransferenciaBancaria(models.Model):
         verbose_name = 'Transferencia Bancaria'
         verbose_name_plural = 'Transferencias Bancarias'
         ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['fecha_actualizacion', 'id']),
+        ]
     
     def __str__(self):
         return f"Transferencia {self.cotizacion.numero_cotizacion} - {self.get_estado_display()}"
@@ -578,20 +676,22 @@ class RecepcionCompra(models.Model):
         super().save(*args, **kwargs)
     
     def confirmar(self, usuario):
-        """Confirmar la recepción y actualizar stock"""
+        """
+        Confirmar la recepción y actualizar stock (de la variante si la línea
+        tiene una). Lanza variantes.MedidaRequerida si una línea sin medida es
+        de un producto con variantes.
+        """
+        from . import variantes
+        
         if self.estado == 'confirmada':
             return False
         
-        # Actualizar stock de todos los productos
-        for detalle in self.detalles.all():
-            producto = detalle.producto
-            producto.stock_actual += detalle.cantidad
-            producto.save()
-        
-        self.estado = 'confirmada'
-        self.confirmado_por = usuario
-        self.fecha_confirmacion = timezone.now()
-        self.save()
+        with transaction.atomic():
+            variantes.sumar_stock(self.detalles.all().select_related('producto'))
+            self.estado = 'confirmada'
+            self.confirmado_por = usuario
+            self.fecha_confirmacion = timezone.now()
+            self.save()
         return True
     
     @property
@@ -607,6 +707,8 @@ class DetalleRecepcionCompra(models.Model):
     """Detalle de productos recibidos en una recepción"""
     recepcion = models.ForeignKey(RecepcionCompra, on_delete=models.CASCADE, related_name='detalles')
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    # Obligatoria si el producto tiene variantes: el stock recibido se suma a la medida
+    variante = models.ForeignKey(VarianteProducto, on_delete=models.RESTRICT, null=True, blank=True, related_name='detalles_recepcion')
     cantidad = models.PositiveIntegerField(help_text="Cantidad recibida")
     precio_compra = models.DecimalField(max_digits=10, decimal_places=2, help_text="Precio de compra unitario", null=True, blank=True)
     lote = models.CharField(max_length=50, blank=True, help_text="Número de lote del proveedor")
@@ -619,6 +721,11 @@ class DetalleRecepcionCompra(models.Model):
     def __str__(self):
         return f"{self.producto.nombre} - {self.cantidad} unidades"
     
+    @property
+    def stock_destino(self):
+        """Stock actual de la variante o del producto que recibe las unidades"""
+        return self.variante.stock_actual if self.variante_id else self.producto.stock_actual
+    
     @property
     def subtotal(self):
         if self.precio_compra:
@@ -670,6 +777,7 @@ class VentaN8n(models.Model):
             models.Index(fields=['mercadopago_preference_id']),
             models.Index(fields=['mercadopago_payment_id']),
             models.Index(fields=['email_comprador']),
+            models.Index(fields=['fecha_actualizacion', 'id']),
         ]
     
     def __str__(self):
@@ -681,7 +789,192 @@ class VentaN8n(models.Model):
             try:
                 usuario = User.objects.get(email=self.email_comprador)
                 self.usuario = usuario
-                self.save(update_fields=['usuario'])
+                self.save(update_fields=['usuario', 'fecha_actualizacion'])
             except User.DoesNotExist:
                 pass
-        return self.usuario
\ No newline at end of file
+        return self.usuario
+
+
+class ClaveIdempotencia(models.Model):
+    """Respuesta guardada de una petición con encabezado Idempotency-Key (ver idempotencia.py)"""
+    clave = models.CharField(max_length=255)
+    ruta = models.CharField(max_length=200)
+    firma = models.CharField(max_length=64, help_text="SHA-256 del cuerpo de la petición")
+    completada = models.BooleanField(default=False)
+    codigo_respuesta = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.JSONField(null=True, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'Clave de Idempotencia'
+        verbose_name_plural = 'Claves de Idempotencia'
+        unique_together = ['clave', 'ruta']
+    
+    def __str__(self):
+        return f"{self.ruta} {self.clave}"
+
+
+class VersionCatalogo(models.Model):
+    """Contador que aumenta con cada cambio de productos o categorías (ver catalogo.py)"""
+    nombre = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Versión del Catálogo'
+        verbose_name_plural = 'Versiones del Catálogo'
+    
+    def __str__(self):
+        return f"{self.nombre}: {self.version}"
+
+
+class HistorialPrecio(models.Model):
+    """Registro de cada cambio de precio aplicado por una regla masiva"""
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='historial_precios')
+    precio_anterior = models.DecimalField(max_digits=10, decimal_places=2)
+    precio_nuevo = models.DecimalField(max_digits=10, decimal_places=2)
+    regla = models.CharField(max_length=255, help_text="Descripción de la regla que generó el cambio")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='cambios_precio')
+    fecha = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Historial de Precio'
+        verbose_name_plural = 'Historial de Precios'
+        ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['producto', '-fecha']),
+        ]
+    
+    def __str__(self):
+        return f"{self.producto.codigo_producto}: ${self.precio_anterior} → ${self.precio_nuevo}"
+
+
+# ============================================
+# TABLAS RESUMEN PARA REPORTES
+# ============================================
+# Se recalculan por día (hora de Chile) desde apps/tienda/reportes.py
+
+class VentaDiaria(models.Model):
+    """Total vendido por día"""
+    dia = models.DateField(unique=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cantidad_ventas = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Venta Diaria'
+        verbose_name_plural = 'Ventas Diarias'
+        ordering = ['dia']
+    
+    def __str__(self):
+        return f"{self.dia}: ${self.total}"
+
+
+class VentaProductoDiaria(models.Model):
+    """Unidades vendidas por producto y día"""
+    dia = models.DateField()
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='ventas_diarias')
+    unidades = models.PositiveIntegerField(default=0)
+    monto = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name = 'Venta Diaria por Producto'
+        verbose_name_plural = 'Ventas Diarias por Producto'
+        unique_together = ['dia', 'producto']
+    
+    def __str__(self):
+        return f"{self.dia} - {self.producto_id}: {self.unidades}"
+
+
+class VentaClienteDiaria(models.Model):
+    """Gasto por cliente y día"""
+    dia = models.DateField()
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='compras_diarias')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pedidos = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Venta Diaria por Cliente'
+        verbose_name_plural = 'Ventas Diarias por Cliente'
+        unique_together = ['dia', 'usuario']
+    
+    def __str__(self):
+        return f"{self.dia} - {self.usuario_id}: ${self.total}"
+
+
+class MarcaActualizacionReporte(models.Model):
+    """Marca de agua: hasta qué fecha_actualizacion de Cotizacion están al día las tablas resumen"""
+    nombre = models.CharField(max_length=50, unique=True)
+    procesado_hasta = models.DateTimeField(null=True, blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Marca de Actualización de Reporte'
+        verbose_name_plural = 'Marcas de Actualización de Reportes'
+    
+    def __str__(self):
+        return f"{self.nombre}: {self.procesado_hasta}"
+
+
+class TrabajoReporte(models.Model):
+    """Reporte generado en segundo plano (comando procesar_reportes)"""
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+    
+    tipo = models.CharField(max_length=30)
+    desde = models.DateField()
+    hasta = models.DateField()
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    
+    # Resultado compacto: {"columnas": [...], "filas": [[...], ...]}
+    resultado = models.JSONField(null=True, blank=True)
+    # Firma de los datos con que se generó; si cambia, el resultado deja de ser válido
+    version_datos = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Trabajo de Reporte'
+        verbose_name_plural = 'Trabajos de Reportes'
+        unique_together = ['tipo', 'desde', 'hasta']
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion']),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} {self.desde} - {self.hasta} ({self.estado})"
+    
+    def filas_como_dict(self):
+        """Reconstruye la lista de diccionarios que usa la plantilla"""
+        if not self.resultado:
+            return []
+        columnas = self.resultado['columnas']
+        return [dict(zip(columnas, fila)) for fila in self.resultado['filas']]
+
+
+# ============================================
+# RECOMENDACIONES
+# ============================================
+# Se calculan con el comando calcular_recomendaciones (apps/tienda/recomendaciones.py)
+
+class ProductoRelacionado(models.Model):
+    """Productos que se compran junto a otro, ordenados por puntaje (los K mejores)"""
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='recomendaciones')
+    relacionado = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    posicion = models.PositiveSmallIntegerField()
+    puntaje = models.FloatField(help_text="Similitud coseno entre los pedidos de ambos productos")
+    veces = models.PositiveIntegerField(help_text="Pedidos pagados que incluyen ambos productos")
+    
+    class Meta:
+        verbose_name = 'Producto Relacionado'
+        verbose_name_plural = 'Productos Relacionados'
+        unique_together = ['producto', 'posicion']
+        ordering = ['producto', 'posicion']
+    
+    def __str__(self):
+        return f"{self.producto_id} -> {self.relacionado_id} ({self.puntaje:.3f})"
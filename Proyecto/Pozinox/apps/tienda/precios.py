@@ -0,0 +1,156 @@
+"""
+Motor de reglas de precios masivas.
+
+Una regla filtra productos por categoría, tipo de acero y/o prefijo de código y
+aplica un cambio porcentual o en monto fijo con una regla de redondeo. El nuevo
+precio se calcula en la base de datos con expresiones ``F()``, de modo que la
+actualización es un único ``UPDATE`` sin importar la cantidad de productos.
+"""
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import F, Q, Value, ExpressionWrapper
+from django.db.models.functions import Now, Round
+
+from .models import Producto, HistorialPrecio
+from .catalogo import incrementar_version
+
+
+TIPOS_CAMBIO = [
+    ('porcentaje', 'Porcentaje (%)'),
+    ('monto', 'Monto fijo ($)'),
+]
+
+REDONDEOS = [
+    ('centavos', 'Sin redondeo (2 decimales)'),
+    ('entero', 'Al peso'),
+    ('decena', 'A la decena'),
+    ('centena', 'A la centena'),
+    ('mil', 'Al millar'),
+]
+
+# Múltiplo al que se redondea cada opción
+FACTORES_REDONDEO = {
+    'entero': Decimal('1'),
+    'decena': Decimal('10'),
+    'centena': Decimal('100'),
+    'mil': Decimal('1000'),
+}
+
+PRECIO_MAXIMO = Decimal('99999999.99')  # límite de DecimalField(max_digits=10, decimal_places=2)
+TAMANO_LOTE_HISTORIAL = 5000
+
+
+def filtrar_productos(categoria=None, tipo_acero=None, prefijo_codigo=''):
+    """Productos afectados por la regla"""
+    productos = Producto.objects.all()
+    if categoria:
+        productos = productos.filter(categoria=categoria)
+    if tipo_acero:
+        productos = productos.filter(tipo_acero=tipo_acero)
+    if prefijo_codigo:
+        productos = productos.filter(codigo_producto__istartswith=prefijo_codigo)
+    return productos
+
+
+def expresion_precio(tipo_cambio, valor, redondeo='centavos'):
+    """Expresión SQL que calcula el nuevo precio a partir de precio_por_unidad"""
+    campo_precio = Producto._meta.get_field('precio_por_unidad')
+    salida = models.DecimalField(max_digits=campo_precio.max_digits, decimal_places=campo_precio.decimal_places)
+
+    if tipo_cambio == 'porcentaje':
+        factor = Decimal('1') + Decimal(valor) / Decimal('100')
+        expresion = F('precio_por_unidad') * Value(factor, output_field=salida)
+    elif tipo_cambio == 'monto':
+        expresion = F('precio_por_unidad') + Value(Decimal(valor), output_field=salida)
+    else:
+        raise ValueError(f'Tipo de cambio desconocido: {tipo_cambio}')
+
+    multiplo = FACTORES_REDONDEO.get(redondeo)
+    if multiplo is None:
+        expresion = Round(expresion, 2)
+    elif multiplo == 1:
+        expresion = Round(expresion)
+    else:
+        expresion = Round(expresion / Value(multiplo, output_field=salida)) * Value(multiplo, output_field=salida)
+
+    return ExpressionWrapper(expresion, output_field=salida)
+
+
+def describir_regla(tipo_cambio, valor, redondeo, categoria=None, tipo_acero=None, prefijo_codigo=''):
+    """Texto legible de la regla (se guarda en el historial)"""
+    cambio = f'{valor:+}%' if tipo_cambio == 'porcentaje' else f'{valor:+} $'
+    filtros = []
+    if categoria:
+        filtros.append(f'categoría={categoria}')
+    if tipo_acero:
+        filtros.append(f'acero={tipo_acero}')
+    if prefijo_codigo:
+        filtros.append(f'código={prefijo_codigo}*')
+    alcance = ', '.join(filtros) or 'todos los productos'
+    return f'{cambio} ({dict(REDONDEOS).get(redondeo, redondeo)}) - {alcance}'[:255]
+
+
+def previsualizar(productos, expresion, limite=50):
+    """
+    Devuelve el resumen de la regla sin aplicarla: cantidad afectada, filas
+    con cambio, precios inválidos y una muestra de los primeros productos.
+    """
+    anotados = productos.annotate(precio_nuevo=expresion)
+    invalidos = Q(precio_nuevo__lte=0) | Q(precio_nuevo__gt=PRECIO_MAXIMO)
+    resumen = anotados.aggregate(
+        total=models.Count('id'),
+        con_cambio=models.Count('id', filter=~Q(precio_nuevo=F('precio_por_unidad'))),
+        invalidos=models.Count('id', filter=invalidos),
+    )
+    resumen['muestra'] = list(
+        anotados.order_by('codigo_producto').values(
+            'id', 'codigo_producto', 'nombre', 'precio_por_unidad', 'precio_nuevo'
+        )[:limite]
+    )
+    return resumen
+
+
+def aplicar(productos, expresion, regla, usuario=None):
+    """
+    Aplica la regla con un único UPDATE y registra el historial con bulk_create.
+    Retorna la cantidad de productos cuyo precio cambió.
+    Lanza ValueError si algún precio resultante queda fuera de rango.
+    """
+    anotados = productos.annotate(precio_nuevo=expresion)
+    with transaction.atomic():
+        if anotados.filter(Q(precio_nuevo__lte=0) | Q(precio_nuevo__gt=PRECIO_MAXIMO)).exists():
+            raise ValueError('La regla deja productos con precio menor o igual a 0 o fuera de rango.')
+
+        # Leer precios antes del UPDATE (bloqueando las filas) para armar el historial
+        cambios = (
+            anotados.select_for_update(of=('self',))
+            .exclude(precio_nuevo=F('precio_por_unidad'))
+            .order_by()
+            .values_list('id', 'precio_por_unidad', 'precio_nuevo')
+        )
+        lote = []
+        cambiados = 0
+        for producto_id, anterior, nuevo in cambios.iterator(chunk_size=TAMANO_LOTE_HISTORIAL):
+            lote.append(HistorialPrecio(
+                producto_id=producto_id,
+                precio_anterior=anterior,
+                precio_nuevo=Decimal(nuevo).quantize(Decimal('0.01')),
+                regla=regla,
+                usuario=usuario,
+            ))
+            if len(lote) >= TAMANO_LOTE_HISTORIAL:
+                HistorialPrecio.objects.bulk_create(lote)
+                cambiados += len(lote)
+                lote = []
+        if lote:
+            HistorialPrecio.objects.bulk_create(lote)
+            cambiados += len(lote)
+
+        if cambiados:
+            productos.exclude(precio_por_unidad=expresion).update(
+                precio_por_unidad=expresion,
+                fecha_actualizacion=Now(),
+            )
+            incrementar_version()
+    return cambiados
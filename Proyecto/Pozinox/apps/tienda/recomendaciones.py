@@ -0,0 +1,213 @@
+"""
+Recomendaciones "se compran juntos" para el detalle de producto.
+
+Cada producto guarda en ProductoRelacionado sus TOP_K vecinos según la
+similitud coseno entre los pedidos pagados que lo incluyen:
+
+    puntaje(a, b) = pedidos con a y b / raíz(pedidos con a * pedidos con b)
+
+El cálculo arma una matriz dispersa pedidos × productos (SciPy) y obtiene la
+coocurrencia de un grupo de productos con X[:, grupo].T @ X. numpy y scipy
+se importan solo al calcular: el sitio lee la tabla sin necesitarlos.
+
+La actualización es incremental, con una marca de agua como en reportes.py:
+se recalculan los productos de las cotizaciones modificadas desde la última
+ejecución, leyendo solo los pedidos que contienen alguno de ellos (los
+totales por producto salen de un COUNT agrupado). Un producto cuyo puntaje
+cambia solo porque un vecino ganó pedidos se actualiza cuando él mismo se
+vuelve a vender o con ``recalcular_todo`` (comando ``--completo``), que
+también cubre las cotizaciones eliminadas.
+"""
+import datetime
+import itertools
+
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import catalogo
+from .models import DetalleCotizacion, MarcaActualizacionReporte, Producto, ProductoRelacionado
+
+ESTADOS_PAGADOS = ['pagada', 'finalizada']
+NOMBRE_MARCA = 'recomendaciones'
+MARGEN_MARCA = datetime.timedelta(minutes=5)
+
+TOP_K = 8
+MIN_VECES = 1  # pedidos en común para considerar a dos productos relacionados
+TAMANO_GRUPO = 2000  # productos por multiplicación de matrices
+TAMANO_LECTURA = 20000
+
+
+class ErrorRecomendaciones(Exception):
+    """Falta una dependencia para calcular las recomendaciones"""
+
+
+def _numpy():
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError:
+        raise ErrorRecomendaciones('Para calcular recomendaciones se requiere instalar numpy y scipy.')
+    return np, sparse
+
+
+def _lineas_pagadas():
+    return DetalleCotizacion.objects.filter(cotizacion__estado__in=ESTADOS_PAGADOS)
+
+
+def _detalles_modificados(desde, hasta):
+    """Líneas de las cotizaciones modificadas en (desde, hasta]; todas si desde es None"""
+    detalles = DetalleCotizacion.objects.filter(cotizacion__fecha_actualizacion__lte=hasta)
+    if desde is not None:
+        detalles = detalles.filter(cotizacion__fecha_actualizacion__gt=desde)
+    return detalles
+
+
+def _matriz(lineas):
+    """
+    Matriz dispersa binaria pedidos × productos (CSR) y los ids de producto
+    de cada columna (ordenados).
+    """
+    np, sparse = _numpy()
+    filas = lineas.order_by().values_list('cotizacion_id', 'producto_id').iterator(chunk_size=TAMANO_LECTURA)
+    pares = np.fromiter(itertools.chain.from_iterable(filas), dtype=np.int64).reshape(-1, 2)
+    pedidos, fila = np.unique(pares[:, 0], return_inverse=True)
+    productos, columna = np.unique(pares[:, 1], return_inverse=True)
+    matriz = sparse.csr_matrix(
+        (np.ones(len(pares), dtype=np.float32), (fila, columna)),
+        shape=(len(pedidos), len(productos)),
+    )
+    # Con variantes un producto puede repetirse en un pedido: se suma al
+    # construir la matriz y cada celda vuelve a valer 1
+    matriz.sum_duplicates()
+    matriz.data[:] = 1
+    return matriz, productos
+
+
+def recalcular(productos_ids, lineas, minimo=MIN_VECES):
+    """
+    Reemplaza las recomendaciones de ``productos_ids`` a partir de ``lineas``
+    (DetalleCotizacion pagados; deben incluir todos los pedidos de esos
+    productos). Retorna cuántas filas se guardaron.
+    """
+    np, _ = _numpy()
+    matriz, productos = _matriz(lineas)
+    por_columnas = matriz.tocsc()
+
+    totales_db = dict(
+        _lineas_pagadas().order_by().values('producto_id').annotate(pedidos=Count('cotizacion_id', distinct=True)).values_list('producto_id', 'pedidos')
+    )
+    totales = np.array([totales_db.get(p, 0) for p in productos.tolist()], dtype=np.float64)
+    activos = np.fromiter(Producto.objects.filter(activo=True).values_list('id', flat=True).iterator(), dtype=np.int64)
+    # Solo se recomiendan productos activos
+    validos = np.isin(productos, activos)
+
+    guardadas = 0
+    productos_ids = sorted(productos_ids)
+    for inicio in range(0, len(productos_ids), TAMANO_GRUPO):
+        grupo = np.array(productos_ids[inicio:inicio + TAMANO_GRUPO], dtype=np.int64)
+        posiciones = np.searchsorted(productos, grupo)
+        presentes = posiciones < len(productos)
+        presentes[presentes] = productos[posiciones[presentes]] == grupo[presentes]
+        indices = posiciones[presentes]
+
+        nuevas = []
+        if len(indices):
+            # Pedidos en común de cada producto del grupo con todos los demás
+            coocurrencia = (por_columnas[:, indices].T @ matriz).tocsr()
+            for fila, indice in enumerate(indices.tolist()):
+                desde, hasta = coocurrencia.indptr[fila], coocurrencia.indptr[fila + 1]
+                columnas = coocurrencia.indices[desde:hasta]
+                veces = coocurrencia.data[desde:hasta]
+                filtro = validos[columnas] & (veces >= minimo) & (columnas != indice)
+                columnas, veces = columnas[filtro], veces[filtro]
+                if not len(columnas):
+                    continue
+                puntajes = veces / np.sqrt(totales[indice] * totales[columnas])
+                if len(columnas) > TOP_K:
+                    mejores = np.argpartition(-puntajes, TOP_K)[:TOP_K]
+                    columnas, veces, puntajes = columnas[mejores], veces[mejores], puntajes[mejores]
+                # Puntaje descendente; en empate, más pedidos en común y luego id menor
+                orden = np.lexsort((productos[columnas], -veces, -puntajes))
+                nuevas.extend(zip(
+                    itertools.repeat(int(productos[indice])),
+                    productos[columnas[orden]].tolist(),
+                    range(1, len(orden) + 1),
+                    puntajes[orden].tolist(),
+                    veces[orden].astype(np.int64).tolist(),
+                ))
+
+        with transaction.atomic():
+            ProductoRelacionado.objects.filter(producto_id__in=grupo.tolist()).delete()
+            _insertar(nuevas)
+        guardadas += len(nuevas)
+    return guardadas
+
+
+def _insertar(filas):
+    """
+    INSERT directo de (producto_id, relacionado_id, posicion, puntaje, veces):
+    con cientos de miles de filas, crear instancias para bulk_create toma más
+    que el cálculo completo.
+    """
+    sql = 'INSERT INTO {} (producto_id, relacionado_id, posicion, puntaje, veces) VALUES (%s, %s, %s, %s, %s)'.format(
+        connection.ops.quote_name(ProductoRelacionado._meta.db_table)
+    )
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(filas), TAMANO_LECTURA):
+            cursor.executemany(sql, filas[inicio:inicio + TAMANO_LECTURA])
+
+
+def actualizar_recomendaciones(minimo=MIN_VECES):
+    """
+    Actualización incremental desde la marca de agua.
+    Retorna la cantidad de productos recalculados.
+    """
+    corte = timezone.now()
+    with transaction.atomic():
+        marca, _ = MarcaActualizacionReporte.objects.select_for_update().get_or_create(nombre=NOMBRE_MARCA)
+        desde = marca.procesado_hasta - MARGEN_MARCA if marca.procesado_hasta else None
+        modificados = _detalles_modificados(desde, corte)
+        productos_ids = set(modificados.order_by().values_list('producto_id', flat=True).distinct())
+        if productos_ids:
+            lineas = _lineas_pagadas()
+            if desde is not None:
+                # Solo los pedidos que contienen algún producto afectado
+                lineas = lineas.filter(
+                    cotizacion_id__in=_lineas_pagadas().filter(
+                        producto_id__in=modificados.values('producto_id')
+                    ).values('cotizacion_id')
+                )
+            recalcular(productos_ids, lineas, minimo)
+            # Las páginas en caché muestran los relacionados nuevos
+            catalogo.incrementar_version()
+        marca.procesado_hasta = corte
+        marca.save(update_fields=['procesado_hasta', 'fecha_actualizacion'])
+    return len(productos_ids)
+
+
+def recalcular_todo(minimo=MIN_VECES):
+    """Reconstruye las recomendaciones desde cero"""
+    with transaction.atomic():
+        MarcaActualizacionReporte.objects.filter(nombre=NOMBRE_MARCA).delete()
+        ProductoRelacionado.objects.all().delete()
+    return actualizar_recomendaciones(minimo)
+
+
+def relacionados(producto, cantidad=4):
+    """
+    Productos para "Productos Relacionados": los recomendados (una consulta
+    por el índice producto + posición) y, si faltan, otros de la categoría.
+    """
+    recomendados = [
+        r.relacionado for r in
+        ProductoRelacionado.objects.filter(producto=producto, relacionado__activo=True)
+        .select_related('relacionado')[:cantidad]
+    ]
+    if len(recomendados) < cantidad:
+        excluir = [producto.id] + [p.id for p in recomendados]
+        recomendados += list(
+            Producto.objects.filter(categoria_id=producto.categoria_id, activo=True)
+            .exclude(id__in=excluir)[:cantidad - len(recomendados)]
+        )
+    return recomendados
@@ -0,0 +1,333 @@
+"""
+Tablas resumen (ventas por día, por producto y por cliente) para reportes_generales.
+
+Los días se calculan en la zona horaria del proyecto (America/Santiago). La
+actualización es incremental: se buscan las cotizaciones modificadas desde la
+última marca de agua, se obtienen los días (de creación) a los que pertenecen y
+solo esos días se recalculan por completo.
+
+Las cotizaciones eliminadas no dejan rastro en fecha_actualizacion; para esos
+casos está ``recalcular_todo`` (comando ``actualizar_reportes --completo``).
+
+Los reportes se generan como trabajos (TrabajoReporte) identificados por
+(tipo, desde, hasta) que procesa el comando ``procesar_reportes`` (o la misma
+petición, tras reclamarlo con ``reclamar_trabajo``, si no hay worker). El resultado
+se guarda y se reutiliza mientras los datos de origen no cambien. Un trabajo
+con error se reintenta en la siguiente petición pasados REINTENTO_ERROR, y
+uno que lleva más de LIMITE_PROCESANDO en 'procesando' (el worker se cayó) lo
+vuelve a tomar otro worker.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, Count, F, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import catalogo
+from .models import (
+    Cotizacion, DetalleCotizacion, Producto, VentaDiaria, VentaProductoDiaria,
+    VentaClienteDiaria, MarcaActualizacionReporte, TrabajoReporte,
+)
+
+
+# Estados de cotización que consideramos para ventas/ingresos/productos vendidos
+ESTADOS_VENTAS = ['pagada', 'finalizada', 'en_revision']
+
+NOMBRE_MARCA = 'ventas_diarias'
+
+# Margen para no perder cotizaciones cuya transacción terminó después de tomar la marca
+MARGEN_MARCA = datetime.timedelta(minutes=5)
+
+TAMANO_LOTE_DIAS = 200
+
+REINTENTO_ERROR = datetime.timedelta(minutes=1)
+LIMITE_PROCESANDO = datetime.timedelta(minutes=15)
+
+
+def dias_modificados(desde, hasta):
+    """Días locales (de creación) de las cotizaciones modificadas en (desde, hasta]"""
+    cotizaciones = Cotizacion.objects.filter(fecha_actualizacion__lte=hasta)
+    if desde is not None:
+        cotizaciones = cotizaciones.filter(fecha_actualizacion__gt=desde)
+    return set(
+        cotizaciones.annotate(dia=TruncDate('fecha_creacion'))
+        .order_by().values_list('dia', flat=True).distinct()
+    )
+
+
+def recalcular_dias(dias):
+    """Reemplaza las filas de las tablas resumen para los días indicados"""
+    dias = sorted(dias)
+    for inicio in range(0, len(dias), TAMANO_LOTE_DIAS):
+        lote = dias[inicio:inicio + TAMANO_LOTE_DIAS]
+        with transaction.atomic():
+            _recalcular_lote(lote)
+
+
+def rangos_dias(dias, campo):
+    """
+    Q con los rangos [inicio del día, inicio del día siguiente) en hora local:
+    a diferencia de __date, se resuelven con el índice de ``campo``.
+    """
+    filtro = Q()
+    for dia in dias:
+        inicio = timezone.make_aware(datetime.datetime.combine(dia, datetime.time.min))
+        fin = timezone.make_aware(datetime.datetime.combine(dia + datetime.timedelta(days=1), datetime.time.min))
+        filtro |= Q(**{f'{campo}__gte': inicio, f'{campo}__lt': fin})
+    return filtro
+
+
+def _recalcular_lote(dias):
+    # Días locales (America/Santiago), igual que TruncDate
+    ventas = Cotizacion.objects.filter(rangos_dias(dias, 'fecha_creacion'), estado__in=ESTADOS_VENTAS)
+    detalles = DetalleCotizacion.objects.filter(
+        rangos_dias(dias, 'cotizacion__fecha_creacion'), cotizacion__estado__in=ESTADOS_VENTAS
+    )
+
+    por_dia = (
+        ventas.annotate(dia=TruncDate('fecha_creacion')).order_by()
+        .values('dia').annotate(total=Sum('total'), cantidad=Count('id'))
+    )
+    por_producto = (
+        detalles.annotate(dia=TruncDate('cotizacion__fecha_creacion')).order_by()
+        .values('dia', 'producto_id').annotate(unidades=Sum('cantidad'), monto=Sum('subtotal'))
+    )
+    por_cliente = (
+        ventas.annotate(dia=TruncDate('fecha_creacion')).order_by()
+        .values('dia', 'usuario_id').annotate(total=Sum('total'), pedidos=Count('id'))
+    )
+
+    VentaDiaria.objects.filter(dia__in=dias).delete()
+    VentaProductoDiaria.objects.filter(dia__in=dias).delete()
+    VentaClienteDiaria.objects.filter(dia__in=dias).delete()
+
+    VentaDiaria.objects.bulk_create([
+        VentaDiaria(dia=f['dia'], total=f['total'] or Decimal('0'), cantidad_ventas=f['cantidad'])
+        for f in por_dia
+    ])
+    VentaProductoDiaria.objects.bulk_create([
+        VentaProductoDiaria(dia=f['dia'], producto_id=f['producto_id'], unidades=f['unidades'] or 0, monto=f['monto'] or Decimal('0'))
+        for f in por_producto
+    ], batch_size=1000)
+    VentaClienteDiaria.objects.bulk_create([
+        VentaClienteDiaria(dia=f['dia'], usuario_id=f['usuario_id'], total=f['total'] or Decimal('0'), pedidos=f['pedidos'])
+        for f in por_cliente
+    ], batch_size=1000)
+
+
+def actualizar_resumenes():
+    """
+    Actualización incremental desde la marca de agua.
+    Retorna la cantidad de días recalculados.
+    """
+    corte = timezone.now()
+    with transaction.atomic():
+        marca, _ = MarcaActualizacionReporte.objects.select_for_update().get_or_create(nombre=NOMBRE_MARCA)
+        desde = marca.procesado_hasta - MARGEN_MARCA if marca.procesado_hasta else None
+        dias = dias_modificados(desde, corte)
+        if dias:
+            recalcular_dias(dias)
+        marca.procesado_hasta = corte
+        marca.save(update_fields=['procesado_hasta', 'fecha_actualizacion'])
+    return len(dias)
+
+
+def recalcular_todo():
+    """Reconstruye las tablas resumen desde cero"""
+    with transaction.atomic():
+        catalogo.incrementar_version_reportes()
+        MarcaActualizacionReporte.objects.filter(nombre=NOMBRE_MARCA).delete()
+        VentaDiaria.objects.all().delete()
+        VentaProductoDiaria.objects.all().delete()
+        VentaClienteDiaria.objects.all().delete()
+    return actualizar_resumenes()
+
+
+# ============================================
+# CONSULTAS Y TRABAJOS DE REPORTES
+# ============================================
+
+TIPOS_REPORTE = ['ventas', 'ingresos', 'stock', 'cotizaciones', 'productos_mas_vendidos', 'clientes']
+TIPOS_CON_RESUMEN = ['ventas', 'ingresos', 'productos_mas_vendidos', 'clientes']
+LIMITE_FILAS_PANTALLA = 100
+
+
+def consulta_reporte(tipo, dia_desde, dia_hasta):
+    """
+    Queryset del reporte y columnas para exportarlo.
+    Retorna (None, []) si el tipo no existe.
+    """
+    if tipo in ('ventas', 'ingresos'):
+        qs = VentaDiaria.objects.filter(dia__range=(dia_desde, dia_hasta), cantidad_ventas__gt=0).order_by('dia')
+        return qs, [('dia', 'Día'), ('total', 'Total Ventas' if tipo == 'ventas' else 'Ingresos')]
+
+    if tipo == 'productos_mas_vendidos':
+        qs = (
+            VentaProductoDiaria.objects.filter(dia__range=(dia_desde, dia_hasta))
+            .values('producto__id', 'producto__nombre').annotate(total_vendido=Sum('unidades'))
+            .order_by('-total_vendido')
+        )
+        return qs, [('producto__id', 'ID'), ('producto__nombre', 'Producto'), ('total_vendido', 'Unidades Vendidas')]
+
+    if tipo == 'clientes':
+        qs = (
+            VentaClienteDiaria.objects.filter(dia__range=(dia_desde, dia_hasta))
+            .values('usuario__id', 'usuario__username', 'usuario__first_name', 'usuario__last_name')
+            .annotate(total_gastado=Sum('total'), pedidos=Sum('pedidos'))
+            .order_by('-total_gastado')
+        )
+        return qs, [
+            ('usuario__username', 'Usuario'), ('usuario__first_name', 'Nombre'), ('usuario__last_name', 'Apellido'),
+            ('pedidos', 'Pedidos'), ('total_gastado', 'Total Gastado'),
+        ]
+
+    if tipo == 'stock':
+        qs = Producto.objects.filter(stock_actual__lte=F('stock_minimo'))
+        return qs, [
+            ('codigo_producto', 'Código'), ('nombre', 'Producto'), ('categoria__nombre', 'Categoría'),
+            ('stock_actual', 'Stock Actual'), ('stock_minimo', 'Stock Mínimo'),
+        ]
+
+    if tipo == 'cotizaciones':
+        qs = Cotizacion.objects.filter(fecha_creacion__date__range=(dia_desde, dia_hasta))
+        return qs, [
+            ('numero_cotizacion', 'Número'), ('usuario__username', 'Usuario'), ('estado', 'Estado'),
+            ('total', 'Total'), ('fecha_creacion', 'Fecha'),
+        ]
+
+    return None, []
+
+
+def _valor_serializable(valor):
+    if isinstance(valor, datetime.datetime):
+        return timezone.localtime(valor).strftime('%Y-%m-%d %H:%M') if timezone.is_aware(valor) else valor.strftime('%Y-%m-%d %H:%M')
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def generar_reporte(tipo, dia_desde, dia_hasta):
+    """Calcula el reporte y lo devuelve en formato compacto {columnas, filas}"""
+    if tipo in TIPOS_CON_RESUMEN:
+        actualizar_resumenes()
+
+    qs, _ = consulta_reporte(tipo, dia_desde, dia_hasta)
+    if qs is None:
+        return {'columnas': [], 'filas': []}
+
+    if tipo in ('ventas', 'ingresos'):
+        columnas = ['label', 'value']
+        filas = qs.values_list('dia', 'total')
+    elif tipo == 'productos_mas_vendidos':
+        columnas = ['producto__id', 'producto__nombre', 'total_vendido']
+        filas = qs.values_list(*columnas)[:LIMITE_FILAS_PANTALLA]
+    elif tipo == 'clientes':
+        columnas = ['usuario__id', 'usuario__username', 'usuario__first_name', 'usuario__last_name', 'total_gastado', 'pedidos']
+        filas = qs.values_list(*columnas)[:LIMITE_FILAS_PANTALLA]
+    elif tipo == 'stock':
+        columnas = ['id', 'nombre', 'stock_actual', 'stock_minimo', 'categoria__nombre']
+        filas = qs.values_list(*columnas)
+    else:
+        columnas = ['numero_cotizacion', 'usuario__username', 'estado', 'total', 'fecha_creacion']
+        filas = qs.values_list(*columnas)[:LIMITE_FILAS_PANTALLA]
+
+    return {
+        'columnas': columnas,
+        'filas': [[_valor_serializable(v) for v in fila] for fila in filas],
+    }
+
+
+def version_datos(tipo):
+    """
+    Firma barata de los datos de origen: si cambia, el resultado guardado ya no
+    sirve. El stock usa la versión del catálogo (sin consultas si está en
+    caché); el resto, el Max de Cotizacion.fecha_actualizacion (resuelto con
+    su índice) más la versión de reportes, que cubre las eliminaciones.
+    """
+    if tipo == 'stock':
+        return f'catalogo:{catalogo.version_catalogo()}'
+    ultima = Cotizacion.objects.aggregate(ultima=Max('fecha_actualizacion'))['ultima']
+    return f"{catalogo.version_reportes()}:{ultima.isoformat() if ultima else '-'}"
+
+
+def obtener_trabajo(tipo, dia_desde, dia_hasta):
+    """
+    Devuelve el trabajo para (tipo, desde, hasta). Si el resultado guardado
+    quedó desactualizado, o falló hace más de REINTENTO_ERROR, lo vuelve a
+    dejar pendiente.
+    """
+    version = version_datos(tipo)
+    trabajo, creado = TrabajoReporte.objects.get_or_create(
+        tipo=tipo, desde=dia_desde, hasta=dia_hasta,
+        defaults={'version_datos': version},
+    )
+    # Un error puede ser transitorio (conexión, bloqueo): no se espera a que cambien los datos
+    reintentar = trabajo.estado == 'error' and (
+        trabajo.fecha_fin is None or trabajo.fecha_fin <= timezone.now() - REINTENTO_ERROR
+    )
+    if not creado and (reintentar or (trabajo.estado in ('completado', 'error') and trabajo.version_datos != version)):
+        # update() condicionado para no pisar a otra petición que ya lo re-encoló
+        TrabajoReporte.objects.filter(pk=trabajo.pk, estado=trabajo.estado).update(
+            estado='pendiente', version_datos=version, error='',
+        )
+        trabajo.refresh_from_db()
+    return trabajo
+
+
+def reclamar_trabajo(trabajo):
+    """
+    Marca como 'procesando' un trabajo pendiente para calcularlo en la misma
+    petición. update() condicionado: si otra petición o un worker ya lo tomó,
+    retorna False y el trabajo queda con su estado actual.
+    """
+    inicio = timezone.now()
+    reclamado = TrabajoReporte.objects.filter(pk=trabajo.pk, estado='pendiente').update(
+        estado='procesando', fecha_inicio=inicio,
+    )
+    if reclamado:
+        trabajo.estado = 'procesando'
+        trabajo.fecha_inicio = inicio
+    else:
+        trabajo.refresh_from_db()
+    return bool(reclamado)
+
+
+def procesar_trabajo(trabajo):
+    """Genera el resultado de un trabajo ya reclamado (estado 'procesando')"""
+    try:
+        # La versión se toma antes de calcular: si los datos cambian durante el
+        # cálculo, la próxima petición verá la diferencia y lo recalculará
+        version = version_datos(trabajo.tipo)
+        trabajo.resultado = generar_reporte(trabajo.tipo, trabajo.desde, trabajo.hasta)
+        trabajo.version_datos = version
+        trabajo.estado = 'completado'
+        trabajo.error = ''
+    except Exception as e:
+        trabajo.estado = 'error'
+        trabajo.error = str(e)
+    trabajo.fecha_fin = timezone.now()
+    trabajo.save(update_fields=['resultado', 'version_datos', 'estado', 'error', 'fecha_inicio', 'fecha_fin'])
+    return trabajo
+
+
+def reclamar_siguiente_trabajo():
+    """
+    Toma el trabajo pendiente más antiguo y lo marca como 'procesando'.
+    También retoma los que quedaron en 'procesando' más de LIMITE_PROCESANDO.
+    """
+    abandonado = Q(estado='procesando', fecha_inicio__lt=timezone.now() - LIMITE_PROCESANDO)
+    with transaction.atomic():
+        trabajo = (
+            TrabajoReporte.objects.select_for_update(skip_locked=True)
+            .filter(Q(estado='pendiente') | abandonado).order_by('fecha_creacion').first()
+        )
+        if trabajo is None:
+            return None
+        trabajo.estado = 'procesando'
+        trabajo.fecha_inicio = timezone.now()
+        trabajo.save(update_fields=['estado', 'fecha_inicio'])
+    return trabajo
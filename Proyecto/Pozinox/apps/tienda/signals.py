@@ -0,0 +1,59 @@
+"""
+Señales de la tienda. Se conectan en TiendaConfig.ready().
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalogo, imagenes, medidas, variantes
+from .models import CategoriaAcero, Cotizacion, Producto, VarianteProducto
+
+# Un guardado con update_fields dentro de estos campos solo cambia el stock
+CAMPOS_STOCK = {'stock_actual', 'fecha_actualizacion'}
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=CategoriaAcero)
+@receiver(post_delete, sender=CategoriaAcero)
+def cambio_catalogo(sender, update_fields=None, **kwargs):
+    """Cualquier cambio de productos o categorías invalida la versión del catálogo"""
+    if kwargs.get('raw'):
+        return
+    catalogo.incrementar_version(solo_stock=bool(update_fields) and set(update_fields) <= CAMPOS_STOCK)
+
+
+@receiver(post_delete, sender=Cotizacion)
+def cotizacion_eliminada(sender, **kwargs):
+    """Una cotización eliminada no deja rastro en fecha_actualizacion: invalida los reportes"""
+    catalogo.incrementar_version_reportes()
+
+
+@receiver(post_save, sender=Producto)
+def imagen_producto_guardada(sender, instance, raw=False, **kwargs):
+    """Si la imagen cambió, genera sus miniaturas al confirmar la transacción"""
+    if raw or not instance.imagen or instance.imagen.name == instance.imagen_derivados_de:
+        return
+    producto_id = instance.pk
+    transaction.on_commit(lambda: imagenes.encolar(producto_id))
+
+
+@receiver(post_save, sender=Producto)
+def medidas_producto_guardadas(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Copia Producto.medidas a MedidaProducto si cambiaron"""
+    if raw or (update_fields is not None and 'medidas' not in update_fields):
+        return
+    actuales = list(instance.medidas_normalizadas.values_list('texto', flat=True))
+    if actuales != [fila.texto for fila in medidas.filas(instance.pk, instance.medidas)]:
+        medidas.sincronizar([(instance.pk, instance.medidas)])
+
+
+@receiver(post_save, sender=VarianteProducto)
+@receiver(post_delete, sender=VarianteProducto)
+def cambio_variante(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Recalcula el rango de precios y el stock total del producto"""
+    if raw:
+        return
+    variantes.actualizar_resumen(
+        [instance.producto_id], solo_stock=bool(update_fields) and set(update_fields) <= CAMPOS_STOCK
+    )
@@ -0,0 +1,35 @@
+"""
+Imágenes de productos con miniaturas (apps/tienda/imagenes.py).
+
+    {% load imagenes_producto %}
+    {% imagen_producto producto sizes="250px" clase="card-img-top" %}
+    <img srcset="{{ producto|srcset:'jpeg' }}" ...>
+"""
+from django import template
+
+from apps.tienda import imagenes
+
+register = template.Library()
+
+
+@register.filter
+def srcset(producto, formato='webp'):
+    """Valor del atributo srcset con las miniaturas del producto ('' si aún no hay)"""
+    return imagenes.srcset(producto, formato)
+
+
+@register.inclusion_tag('components/imagen_producto.html')
+def imagen_producto(producto, sizes='100vw', ancho=400, clase='', estilo='', alt=None):
+    """
+    <picture> con las variantes WebP y JPEG; ``ancho`` elige la miniatura del
+    src de respaldo. Sin miniaturas usa la imagen original.
+    """
+    return {
+        'src': imagenes.url_imagen(producto, ancho),
+        'srcset_webp': imagenes.srcset(producto, 'webp'),
+        'srcset_jpeg': imagenes.srcset(producto, 'jpeg'),
+        'sizes': sizes,
+        'clase': clase,
+        'estilo': estilo,
+        'alt': producto.nombre if alt is None else alt,
+    }
@@ -1,3 +1,946 @@
-from django.test import TestCase
+import csv
+import datetime
+import hashlib
+import io
+import json
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.db.models import RestrictedError
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from apps.exportacion import exportar_queryset
+from apps.usuarios.models import PerfilUsuario
+
+from . import (
+    autocompletar, cambios, catalogo, idempotencia, imagenes, importacion, medidas, precios, reportes, variantes,
+)
+from .forms import ProductoForm
+from .models import (
+    CategoriaAcero, ClaveIdempotencia, Cotizacion, DetalleCotizacion, DetalleRecepcionCompra, HistorialPrecio,
+    Producto, RecepcionCompra, TrabajoReporte, VarianteProducto, VentaDiaria, VentaN8n,
+)
+from .views import crear_cotizacion_desde_venta_n8n
+
+
+class VariantesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Cañerías')
+        cls.producto = Producto.objects.create(
+            nombre='Cañería', descripcion='Cañería sanitaria', codigo_producto='CAN-01', categoria=categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('900'), stock_actual=0,
+        )
+        cls.media = VarianteProducto.objects.create(
+            producto=cls.producto, medida='1/2"', codigo_variante='CAN-01-12', precio_por_unidad=Decimal('1000'), stock_actual=5,
+        )
+        cls.una = VarianteProducto.objects.create(
+            producto=cls.producto, medida='1"', codigo_variante='CAN-01-1', precio_por_unidad=Decimal('2500'), stock_actual=3,
+        )
+        cls.cliente = User.objects.create_user('cliente', 'cliente@test.cl', 'clave-segura-123')
+
+    def crear_cotizacion(self, *lineas):
+        cotizacion = Cotizacion.objects.create(usuario=self.cliente)
+        for variante, cantidad in lineas:
+            DetalleCotizacion.objects.create(
+                cotizacion=cotizacion, producto=self.producto, variante=variante,
+                cantidad=cantidad, precio_unitario=variante.precio_por_unidad,
+            )
+        return cotizacion
+
+    def test_resumen_del_producto(self):
+        self.producto.refresh_from_db()
+        self.assertEqual((self.producto.precio_minimo, self.producto.precio_maximo), (Decimal('1000'), Decimal('2500')))
+        self.assertEqual(self.producto.stock_actual, 8)
+        self.assertTrue(self.producto.tiene_variantes)
+
+    def test_variante_cotizada_no_se_elimina(self):
+        cotizacion = self.crear_cotizacion((self.media, 1), (self.una, 1))
+        with self.assertRaises(RestrictedError):
+            self.media.delete()
+        with self.assertRaises(RestrictedError):
+            self.una.delete()
+        # Las líneas conservan su medida; para retirarla se desactiva
+        self.assertEqual(
+            sorted(cotizacion.detalles.values_list('variante_id', flat=True)), sorted([self.media.id, self.una.id])
+        )
+        self.media.activa = False
+        self.media.save()
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock_actual, 3)
+
+    def test_eliminar_producto_elimina_sus_lineas(self):
+        self.crear_cotizacion((self.media, 1))
+        self.producto.delete()
+        self.assertFalse(DetalleCotizacion.objects.exists())
+        self.assertFalse(VarianteProducto.objects.exists())
+
+    def test_descontar_stock(self):
+        cotizacion = self.crear_cotizacion((self.media, 2), (self.una, 4))
+        sin_stock = variantes.descontar_stock(cotizacion)
+        self.assertEqual(len(sin_stock), 1)
+        self.assertIn('1"', sin_stock[0])
+        self.media.refresh_from_db()
+        self.una.refresh_from_db()
+        self.producto.refresh_from_db()
+        # Solo se descuenta la línea con stock suficiente; el producto vuelve a sumar sus variantes
+        self.assertEqual((self.media.stock_actual, self.una.stock_actual), (3, 3))
+        self.assertEqual(self.producto.stock_actual, 6)
+
+    def test_cotizar_sin_medida_se_rechaza(self):
+        self.client.force_login(self.cliente)
+        response = self.client.get(reverse('crear_cotizacion'), {'producto_id': self.producto.id})
+        self.assertRedirects(response, reverse('detalle_producto', args=[self.producto.id]), fetch_redirect_response=False)
+        self.assertFalse(DetalleCotizacion.objects.exists())
+
+        cotizacion = Cotizacion.objects.get(usuario=self.cliente)
+        self.client.post(reverse('agregar_producto_cotizacion', args=[cotizacion.id]), {'producto_id': self.producto.id, 'cantidad': 1})
+        self.assertFalse(DetalleCotizacion.objects.exists())
+
+        self.client.post(
+            reverse('agregar_producto_cotizacion', args=[cotizacion.id]),
+            {'producto_id': self.producto.id, 'variante_id': self.una.id, 'cantidad': 1},
+        )
+        detalle = DetalleCotizacion.objects.get()
+        self.assertEqual((detalle.variante_id, detalle.precio_unitario), (self.una.id, Decimal('2500')))
+
+    def test_recepcion_suma_a_la_variante(self):
+        recepcion = RecepcionCompra.objects.create(proveedor='Proveedor')
+        DetalleRecepcionCompra.objects.create(recepcion=recepcion, producto=self.producto, variante=self.una, cantidad=7)
+        recepcion.confirmar(self.cliente)
+        self.una.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual(self.una.stock_actual, 10)
+        self.assertEqual(self.producto.stock_actual, 15)
+
+        # Otra escritura de las variantes recalcula el total sin perder lo recibido
+        self.media.precio_por_unidad = Decimal('1100')
+        self.media.save()
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock_actual, 15)
+
+    def test_recepcion_sin_medida_se_rechaza(self):
+        recepcion = RecepcionCompra.objects.create(proveedor='Proveedor')
+        DetalleRecepcionCompra.objects.create(recepcion=recepcion, producto=self.producto, cantidad=7)
+        with self.assertRaises(variantes.MedidaRequerida):
+            recepcion.confirmar(self.cliente)
+        recepcion.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual((recepcion.estado, self.producto.stock_actual), ('borrador', 8))
+
+    def test_stock_del_producto_no_se_edita(self):
+        self.producto.refresh_from_db()
+        self.assertTrue(ProductoForm(instance=self.producto).fields['stock_actual'].disabled)
+
+        fila = {
+            'codigo_producto': 'CAN-01', 'nombre': 'Cañería', 'categoria': 'Cañerías', 'tipo_acero': '304',
+            'precio_por_unidad': '900',
+        }
+        resultado = importacion.importar_productos([{**fila, 'stock_actual': '100'}])
+        self.assertEqual(resultado['errores'], 1)
+        resultado = importacion.importar_productos([{**fila, 'descripcion': 'Nueva', 'stock_actual': ''}])
+        self.assertEqual((resultado['errores'], resultado['actualizados']), (0, 1))
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock_actual, 8)
+
+
+class MedidasTests(SimpleTestCase):
+
+    def test_unidades_y_fracciones(self):
+        casos = {
+            '1/2"': '12.700',
+            '1 1/2"': '38.100',
+            '1-1/2"': '38.100',
+            '3/4 pulg.': '19.050',
+            '2 in': '50.800',
+            '25,4 mm': '25.400',
+            '2,5 cm': '25.000',
+            '1 m': '1000.000',
+            'Sch 40 1/2"': '12.700',
+        }
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                self.assertEqual(medidas.a_milimetros(texto), Decimal(esperado))
+
+    def test_primera_medida_de_una_serie(self):
+        self.assertEqual(medidas.a_milimetros('1/2" x 1,5 mm'), Decimal('12.7'))
+        self.assertEqual(medidas.a_milimetros('10 x 20 mm'), Decimal('10'))
+        self.assertEqual(medidas.a_milimetros('10x20x3mm'), Decimal('10'))
+
+    def test_textos_sin_medida(self):
+        for texto in ('DN25', 'Sch 40', '1e5 mm', '1/0"', '', None):
+            with self.subTest(texto=texto):
+                self.assertIsNone(medidas.a_milimetros(texto))
+        self.assertEqual(medidas.a_milimetros('25', 'mm'), Decimal('25'))
+        self.assertIsNone(medidas.a_milimetros('999999 m'))
+
+
+class IndicePrefijosTests(SimpleTestCase):
+
+    def setUp(self):
+        self.indice = autocompletar.IndicePrefijos(1, [
+            (1, 'TU-304', 'Tubo redondo 1/2"', Decimal('3000'), None, None, 'metro'),
+            (2, 'PL-316', 'Plancha tubular', Decimal('5000'), Decimal('4000'), Decimal('6000'), 'unidad'),
+            (3, 'CO-90', 'Codo de tubería', Decimal('1500'), None, None, 'unidad'),
+            (4, 'TUB-10', 'Ángulo laminado', Decimal('800'), None, None, 'metro'),
+        ])
+
+    def ids(self, texto, **kwargs):
+        return [fila[0] for fila in self.indice.buscar(texto, **kwargs)]
+
+    def test_codigo_antes_que_nombre(self):
+        # TU-304 y TUB-10 por código; después por nombre en orden de la palabra: tubería, tubular
+        self.assertEqual(self.ids('tu'), [1, 4, 3, 2])
+        self.assertEqual(self.ids('tu', por_codigo=False), [3, 1, 2])
+
+    def test_palabras_del_nombre(self):
+        self.assertEqual(self.ids('redondo'), [1])
+        self.assertEqual(self.ids('1/2'), [1])
+        self.assertEqual(self.ids('redondo 1'), [1])
+        # Solo desde el inicio de una palabra
+        self.assertEqual(self.ids('ondo'), [])
+
+    def test_sin_tildes_ni_mayusculas(self):
+        self.assertEqual(self.ids('ANGULO'), [4])
+        self.assertEqual(self.ids('tuberia'), [3])
+        self.assertEqual(self.ids('  Tubo   Redondo '), [1])
+
+    def test_minimo_de_caracteres_y_limite(self):
+        self.assertEqual(self.ids('t'), [])
+        self.assertEqual(self.ids(' t '), [])
+        self.assertEqual(self.ids('tu', limite=2), [1, 4])
+
+    def test_precio_desde_y_rango(self):
+        (_, codigo, _, precio, tiene_rango, unidad), = self.indice.buscar('plancha')
+        self.assertEqual((codigo, precio, tiene_rango, unidad), ('PL-316', Decimal('4000'), True, 'unidad'))
+
+
+class AutocompletarVistaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Tubos')
+        Producto.objects.create(
+            nombre='Codo soldable', descripcion='Codo 90°', codigo_producto='TU-99', categoria=categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('1500'), stock_actual=5,
+        )
+        cls.cliente = User.objects.create_user('cliente_auto', 'auto@test.cl', 'clave-segura-123')
+        cls.vendedor = User.objects.create_user('vendedor_auto', 'vendedor@test.cl', 'clave-segura-123')
+        PerfilUsuario.objects.filter(user=cls.vendedor).update(tipo_usuario='trabajador')
+
+    def setUp(self):
+        cache.delete_many([catalogo.CLAVE_VERSION, catalogo.CLAVE_VERSION_CONTENIDO])
+        autocompletar._indice = None
+
+    def buscar(self, user, texto):
+        self.client.force_login(user, backend='apps.usuarios.backends.PerfilModelBackend')
+        respuesta = self.client.get(reverse('autocompletar_productos'), {'q': texto})
+        return [(p['nombre'], p['codigo']) for p in respuesta.json()['productos']]
+
+    def test_solo_el_staff_busca_por_codigo(self):
+        self.assertEqual(self.buscar(self.cliente, 'tu-99'), [])
+        self.assertEqual(self.buscar(self.cliente, 'codo'), [('Codo soldable', None)])
+        self.assertEqual(self.buscar(self.vendedor, 'tu-99'), [('Codo soldable', 'TU-99')])
+
+
+class ExportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='-Ofertas')
+        Producto.objects.create(
+            nombre='=HYPERLINK("http://x.test","Tubo")', descripcion='@SUMA(A1)', codigo_producto='+56-01',
+            categoria=categoria, tipo_acero='304', precio_por_unidad=Decimal('1500'), stock_actual=3,
+        )
+        cls.columnas = [
+            ('nombre', 'Nombre'), ('descripcion', 'Descripción'), ('codigo_producto', 'Código'),
+            ('categoria__nombre', 'Categoría'), ('tipo_acero', 'Tipo'), ('stock_actual', 'Stock'),
+        ]
+        cls.esperado = ['\'=HYPERLINK("http://x.test","Tubo")', "'@SUMA(A1)", "'+56-01", "'-Ofertas", '304']
+
+    def exportar(self, formato):
+        respuesta = exportar_queryset(Producto.objects.all(), self.columnas, 'productos', formato)
+        return b''.join(respuesta.streaming_content)
+
+    def test_csv_no_exporta_formulas(self):
+        contenido = self.exportar('csv').decode('utf-8-sig')
+        encabezados, fila = csv.reader(io.StringIO(contenido))
+        self.assertEqual(encabezados[0], 'Nombre')
+        self.assertEqual(fila, self.esperado + ['3'])
+
+    def test_xlsx_no_exporta_formulas(self):
+        from openpyxl import load_workbook
+
+        hoja = load_workbook(io.BytesIO(self.exportar('xlsx'))).active
+        celdas = list(hoja.iter_rows(min_row=2))[0]
+        self.assertEqual([celda.value for celda in celdas], self.esperado + [3])
+        self.assertTrue(all(celda.data_type == 's' for celda in celdas[:5]))
+
+
+class ImagenesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Planchas')
+        cls.producto = Producto.objects.create(
+            nombre='Plancha', descripcion='Plancha 2B', codigo_producto='PL-IMG', categoria=categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('5000'), stock_actual=1,
+        )
+
+    def setUp(self):
+        # FileSystemStorage en un directorio temporal en vez del storage S3 del campo
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        campo = Producto._meta.get_field('imagen')
+        self.addCleanup(setattr, campo, 'storage', campo.storage)
+        campo.storage = self.storage = FileSystemStorage(location=directorio.name, base_url='/media/')
+
+    def png(self, ancho, alto, modo='RGB', color=(200, 30, 30)):
+        buffer = io.BytesIO()
+        Image.new(modo, (ancho, alto), color).save(buffer, 'PNG')
+        buffer.seek(0)
+        return buffer
+
+    def con_imagen(self, ancho=1000, alto=500):
+        nombre = self.storage.save('productos/plancha.png', ContentFile(self.png(ancho, alto).getvalue()))
+        Producto.objects.filter(pk=self.producto.pk).update(imagen=nombre)
+        return nombre
+
+    def derivados(self):
+        return sorted(self.storage.listdir(imagenes.CARPETA)[1]) if self.storage.exists(imagenes.CARPETA) else []
+
+    def test_no_agranda_la_original(self):
+        self.assertEqual([ancho for ancho, _ in imagenes._redimensionar(self.png(1000, 500))], [200, 400, 800])
+        versiones = imagenes._redimensionar(self.png(300, 150))
+        self.assertEqual([(imagen.width, imagen.height) for _, imagen in versiones], [(200, 100), (300, 150)])
+
+    def test_transparencia_sobre_fondo_blanco_en_jpeg(self):
+        (_, imagen), = imagenes._redimensionar(self.png(100, 100, 'RGBA', (0, 0, 0, 0)))
+        self.assertEqual(imagen.mode, 'RGBA')
+        jpeg = Image.open(io.BytesIO(imagenes._codificar(imagen, 'JPEG', imagenes.CALIDAD_JPEG)))
+        self.assertEqual(jpeg.mode, 'RGB')
+        self.assertTrue(all(canal >= 250 for canal in jpeg.getpixel((50, 50))))
+
+    def test_generar_derivados(self):
+        nombre = self.con_imagen()
+        self.assertEqual(imagenes.generar_derivados(self.producto.pk), 'generado')
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.imagen_derivados_de, nombre)
+        self.assertEqual([d['ancho'] for d in self.producto.imagen_derivados], [200, 400, 800])
+        self.assertEqual(len(self.derivados()), 6)
+        self.assertEqual(imagenes.generar_derivados(self.producto.pk), 'al_dia')
+
+        # Regenerar reemplaza los archivos anteriores
+        anteriores = self.derivados()
+        self.assertEqual(imagenes.generar_derivados(self.producto.pk, forzar=True), 'generado')
+        self.assertEqual(len(self.derivados()), 6)
+        self.assertFalse(set(anteriores) & set(self.derivados()))
+
+    def test_imagen_cambiada_durante_el_proceso(self):
+        self.con_imagen()
+        redimensionar = imagenes._redimensionar
+
+        def cambiar_imagen(archivo):
+            Producto.objects.filter(pk=self.producto.pk).update(imagen='productos/otra.png')
+            return redimensionar(archivo)
+
+        with mock.patch.object(imagenes, '_redimensionar', cambiar_imagen):
+            self.assertEqual(imagenes.generar_derivados(self.producto.pk), 'reemplazada')
+        # No se pisa la imagen nueva y las miniaturas subidas se descartan
+        self.producto.refresh_from_db()
+        self.assertEqual((self.producto.imagen.name, self.producto.imagen_derivados_de), ('productos/otra.png', ''))
+        self.assertEqual(self.derivados(), [])
+
+    def test_urls_para_plantillas(self):
+        self.assertEqual((imagenes.srcset(self.producto), imagenes.url_imagen(self.producto)), ('', ''))
+
+        nombre = self.con_imagen()
+        self.producto.refresh_from_db()
+        # Sin miniaturas: la original
+        self.assertEqual(imagenes.srcset(self.producto), '')
+        self.assertEqual(imagenes.url_imagen(self.producto), f'/media/{nombre}')
+
+        imagenes.generar_derivados(self.producto.pk)
+        self.producto.refresh_from_db()
+        self.assertEqual(imagenes.srcset(self.producto).count('.webp'), 3)
+        self.assertRegex(imagenes.srcset(self.producto, 'jpeg'), r'^/media/productos/derivados/plancha_200\.jpg 200w, ')
+        self.assertTrue(imagenes.url_imagen(self.producto, 300).endswith('_400.jpg'))
+        self.assertTrue(imagenes.url_imagen(self.producto, 2000).endswith('_800.jpg'))
+
+        # Miniaturas de una imagen anterior: no se usan
+        self.producto.imagen = 'productos/nueva.png'
+        self.assertEqual(imagenes.srcset(self.producto), '')
+        self.assertEqual(imagenes.url_imagen(self.producto), '/media/productos/nueva.png')
+
+
+class ReglaPreciosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Tubos')
+        cls.precios = {
+            'TU-1': ('304', Decimal('1000')),
+            'TU-2': ('304', Decimal('1049')),
+            'TU-3': ('304', Decimal('334')),
+            'XX-1': ('316', Decimal('333.33')),
+        }
+        for codigo, (tipo_acero, precio) in cls.precios.items():
+            Producto.objects.create(
+                nombre=codigo, descripcion='Tubo', codigo_producto=codigo, categoria=categoria,
+                tipo_acero=tipo_acero, precio_por_unidad=precio, stock_actual=1,
+            )
+        cls.admin = User.objects.create_user('admin_precios', 'precios@test.cl', 'clave-segura-123')
+
+    def setUp(self):
+        cache.delete_many([catalogo.CLAVE_VERSION, catalogo.CLAVE_VERSION_CONTENIDO])
+
+    def actuales(self):
+        return dict(Producto.objects.values_list('codigo_producto', 'precio_por_unidad'))
+
+    def aplicar(self, tipo_cambio, valor, redondeo, **filtros):
+        productos = precios.filtrar_productos(**filtros)
+        expresion = precios.expresion_precio(tipo_cambio, Decimal(valor), redondeo)
+        regla = precios.describir_regla(tipo_cambio, Decimal(valor), redondeo, **filtros)
+        resumen = precios.previsualizar(productos, expresion)
+        with self.captureOnCommitCallbacks(execute=True):
+            cambiados = precios.aplicar(productos, expresion, regla, usuario=self.admin)
+        # La vista previa anticipa lo mismo que se aplica
+        self.assertEqual(resumen['con_cambio'], cambiados)
+        return cambiados
+
+    def test_redondeo_e_historial(self):
+        version = catalogo.version_catalogo()
+        sin_cambio = Producto.objects.get(codigo_producto='TU-1').fecha_actualizacion
+
+        # +0,2 % a la decena: 1002 -> 1000 (sin cambio), 1051,098 -> 1050, 334,668 -> 330
+        self.assertEqual(self.aplicar('porcentaje', '0.2', 'decena', tipo_acero='304'), 2)
+        self.assertEqual(self.actuales(), {
+            'TU-1': Decimal('1000'), 'TU-2': Decimal('1050'), 'TU-3': Decimal('330'), 'XX-1': Decimal('333.33'),
+        })
+        # La fila sin cambio no se escribe ni queda en el historial
+        self.assertEqual(Producto.objects.get(codigo_producto='TU-1').fecha_actualizacion, sin_cambio)
+        historial = {
+            h.producto.codigo_producto: (h.precio_anterior, h.precio_nuevo, h.usuario)
+            for h in HistorialPrecio.objects.select_related('producto')
+        }
+        self.assertEqual(historial, {
+            'TU-2': (Decimal('1049'), Decimal('1050'), self.admin),
+            'TU-3': (Decimal('334'), Decimal('330'), self.admin),
+        })
+        self.assertEqual(HistorialPrecio.objects.values_list('regla', flat=True).first(), '+0.2% (A la decena) - acero=304')
+        self.assertEqual(catalogo.version_catalogo(), version + 1)
+
+        # Sin redondeo: 333,33 * 1,1 = 366,663 -> 366,66
+        self.assertEqual(self.aplicar('porcentaje', '10', 'centavos', prefijo_codigo='xx'), 1)
+        self.assertEqual(self.actuales()['XX-1'], Decimal('366.66'))
+        self.assertEqual(HistorialPrecio.objects.count(), 3)
+
+        # Una regla que no cambia nada no escribe ni cambia la versión
+        self.assertEqual(self.aplicar('monto', '0.4', 'entero', tipo_acero='304'), 0)
+        self.assertEqual(catalogo.version_catalogo(), version + 2)
+
+    def test_precio_invalido_no_aplica_nada(self):
+        productos = precios.filtrar_productos()
+        expresion = precios.expresion_precio('monto', Decimal('-500'), 'entero')
+        with self.assertRaises(ValueError):
+            precios.aplicar(productos, expresion, 'regla inválida')
+        self.assertEqual(self.actuales(), {codigo: precio for codigo, (_, precio) in self.precios.items()})
+        self.assertFalse(HistorialPrecio.objects.exists())
+
+
+class TrabajosReporteTests(TestCase):
+
+    def setUp(self):
+        self.hoy = timezone.localdate()
+        cache.delete_many([catalogo.CLAVE_VERSION, catalogo.CLAVE_VERSION_REPORTES])
+
+    def test_version_de_datos(self):
+        cliente = User.objects.create_user('cliente_reporte', 'cliente@test.cl', 'clave-segura-123')
+        cotizacion = Cotizacion.objects.create(usuario=cliente)
+        reportes.version_datos('stock')
+        reportes.version_datos('cotizaciones')
+        # Con los contadores en caché: el stock no consulta y el resto solo lee el Max
+        with self.assertNumQueries(0):
+            version_stock = reportes.version_datos('stock')
+        with self.assertNumQueries(1):
+            version = reportes.version_datos('cotizaciones')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Cotizacion.objects.create(usuario=cliente)
+        self.assertNotEqual(reportes.version_datos('cotizaciones'), version)
+        version = reportes.version_datos('cotizaciones')
+
+        # Eliminar una cotización antigua no cambia el Max: lo cubre la versión de reportes
+        with self.captureOnCommitCallbacks(execute=True):
+            cotizacion.delete()
+        self.assertNotEqual(reportes.version_datos('cotizaciones'), version)
+        self.assertEqual(reportes.version_datos('stock'), version_stock)
+
+    def test_calculo_en_la_peticion_reclama_el_trabajo(self):
+        trabajo = reportes.obtener_trabajo('stock', self.hoy, self.hoy)
+        otro = TrabajoReporte.objects.get(pk=trabajo.pk)
+        self.assertTrue(reportes.reclamar_trabajo(otro))
+        # La segunda petición ve que ya está en proceso y no lo calcula de nuevo
+        self.assertFalse(reportes.reclamar_trabajo(trabajo))
+        self.assertEqual(trabajo.estado, 'procesando')
+        self.assertIsNone(reportes.reclamar_siguiente_trabajo())
+        self.assertEqual(reportes.procesar_trabajo(otro).estado, 'completado')
+
+    def test_resumen_por_dia_local(self):
+        cliente = User.objects.create_user('cliente_resumen', 'resumen@test.cl', 'clave-segura-123')
+        # 2026-09-06: cambio de horario en Chile, las 00:00 no existen
+        for dia in (datetime.date(2026, 3, 10), datetime.date(2026, 9, 6)):
+            inicio = timezone.make_aware(datetime.datetime.combine(dia, datetime.time.min))
+            with self.subTest(dia=dia):
+                for fecha, total in (
+                    (inicio - datetime.timedelta(microseconds=1), '100'),
+                    (inicio, '200'),
+                    (inicio + datetime.timedelta(hours=23), '300'),
+                    (inicio + datetime.timedelta(days=1, hours=1), '400'),
+                ):
+                    cotizacion = Cotizacion.objects.create(usuario=cliente, estado='pagada')
+                    Cotizacion.objects.filter(pk=cotizacion.pk).update(fecha_creacion=fecha, total=Decimal(total))
+
+                reportes.recalcular_dias([dia])
+                resumen = VentaDiaria.objects.get(dia=dia)
+                self.assertEqual((resumen.cantidad_ventas, resumen.total), (2, Decimal('500')))
+                Cotizacion.objects.all().delete()
+
+    def test_error_se_reintenta_sin_cambio_de_datos(self):
+        trabajo = reportes.obtener_trabajo('stock', self.hoy, self.hoy)
+        TrabajoReporte.objects.filter(pk=trabajo.pk).update(estado='error', error='conexión perdida', fecha_fin=timezone.now())
+        # Recién fallado: se muestra el error
+        self.assertEqual(reportes.obtener_trabajo('stock', self.hoy, self.hoy).estado, 'error')
+
+        TrabajoReporte.objects.filter(pk=trabajo.pk).update(fecha_fin=timezone.now() - reportes.REINTENTO_ERROR * 2)
+        trabajo = reportes.obtener_trabajo('stock', self.hoy, self.hoy)
+        self.assertEqual((trabajo.estado, trabajo.error), ('pendiente', ''))
+
+    def test_trabajo_abandonado_se_retoma(self):
+        trabajo = reportes.obtener_trabajo('stock', self.hoy, self.hoy)
+        self.assertEqual(reportes.reclamar_siguiente_trabajo().pk, trabajo.pk)
+        # En proceso por otro worker: no se toma de nuevo
+        self.assertIsNone(reportes.reclamar_siguiente_trabajo())
+
+        TrabajoReporte.objects.filter(pk=trabajo.pk).update(
+            fecha_inicio=timezone.now() - reportes.LIMITE_PROCESANDO - datetime.timedelta(minutes=1)
+        )
+        retomado = reportes.reclamar_siguiente_trabajo()
+        self.assertEqual(retomado.pk, trabajo.pk)
+        self.assertEqual(reportes.procesar_trabajo(retomado).estado, 'completado')
+
+
+class VersionCatalogoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Planchas')
+        cls.producto = Producto.objects.create(
+            nombre='Plancha', descripcion='Plancha 2B', codigo_producto='PL-01', categoria=categoria,
+            tipo_acero='316', precio_por_unidad=Decimal('5000'), stock_actual=10,
+        )
+
+    def setUp(self):
+        # La caché no se revierte con la transacción de cada prueba
+        cache.delete_many([catalogo.CLAVE_VERSION, catalogo.CLAVE_VERSION_CONTENIDO])
+
+    def versiones(self):
+        return catalogo.version_catalogo(), catalogo.version_contenido()
+
+    def test_aumenta_al_confirmar(self):
+        antes = self.versiones()
+        with self.captureOnCommitCallbacks(execute=True):
+            catalogo.incrementar_version()
+            # Dentro de la transacción no se toca la fila del contador
+            self.assertEqual(self.versiones(), antes)
+        self.assertEqual(self.versiones(), (antes[0] + 1, antes[1] + 1))
+
+    def test_escritura_de_stock_no_cambia_el_contenido(self):
+        antes = self.versiones()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.stock_actual = 4
+            self.producto.save(update_fields=['stock_actual', 'fecha_actualizacion'])
+        self.assertEqual(self.versiones(), (antes[0] + 1, antes[1]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.producto.precio_por_unidad = Decimal('5500')
+            self.producto.save()
+        self.assertEqual(self.versiones(), (antes[0] + 2, antes[1] + 1))
+
+    def test_clave_de_pagina_ignora_parametros_ajenos(self):
+        url = reverse('productos')
+        base = self.client.get(url, {'q': 'plancha', 'page': '1', 'x': 'aleatorio'})
+        self.assertEqual(base.status_code, 200)
+        # Los enlaces de paginación tampoco arrastran los parámetros ajenos
+        self.assertEqual(base.context['filtros_url'], 'q=plancha')
+
+        clave = catalogo.clave_pagina(base.wsgi_request)
+        for extra in ({}, {'x': 'otro'}, {'utm_source': 'correo', 'fbclid': 'abc'}):
+            with self.subTest(extra=extra):
+                respuesta = self.client.get(url, {'q': 'plancha', 'page': '1', **extra})
+                self.assertEqual(catalogo.clave_pagina(respuesta.wsgi_request), clave)
+
+        otra = self.client.get(url, {'q': 'plancha', 'page': '2'})
+        self.assertNotEqual(catalogo.clave_pagina(otra.wsgi_request), clave)
+
+
+class ImportacionValoresTests(TestCase):
+
+    def test_enteros_invalidos_se_reportan(self):
+        self.assertEqual(importacion._entero('2,0', 'stock_actual', 0), 2)
+        for valor in ('Infinity', 'NaN', '2.5', '-1', '1e30'):
+            with self.subTest(valor=valor), self.assertRaises(ValueError):
+                importacion._entero(valor, 'stock_actual', 0)
+
+    def test_decimales_fuera_de_la_columna_se_reportan(self):
+        self.assertEqual(importacion._decimal('12.345,67', 'precio_por_unidad'), Decimal('12345.67'))
+        for valor in ('Infinity', 'NaN', '1e8', '12.345,678', '0,005', '0.001'):
+            with self.subTest(valor=valor), self.assertRaises(ValueError):
+                importacion._decimal(valor, 'precio_por_unidad')
+
+    def test_punto_de_miles(self):
+        casos = {'12.345': '12345.00', '$ 1.234.567': '1234567.00', '1990.5': '1990.50', '12.30': '12.30', '-1.000': '-1000.00'}
+        for valor, esperado in casos.items():
+            with self.subTest(valor=valor):
+                self.assertEqual(importacion._decimal(valor, 'precio_por_unidad'), Decimal(esperado))
+        # Las celdas numéricas de XLSX no se reinterpretan
+        self.assertEqual(importacion._decimal(12.5, 'precio_por_unidad'), Decimal('12.50'))
+        self.assertEqual(importacion._entero('1.000', 'stock_actual', 0), 1000)
+
+
+class VentaN8nCantidadesTests(TestCase):
+
+    def crear_venta(self, cantidad):
+        return self.client.post(reverse('api_crear_venta_n8n'), {
+            'preference_id': f'pref-{cantidad}',
+            'email_comprador': 'comprador@test.cl',
+            'items': [{'title': 'Plancha', 'unit_price': '1990.5', 'quantity': cantidad}],
+        }, content_type='application/json')
+
+    def test_cantidad_entera_en_cualquier_formato(self):
+        for cantidad in (2, '2.0', 2.0):
+            with self.subTest(cantidad=cantidad):
+                self.assertEqual(self.crear_venta(cantidad).status_code, 200)
+        self.assertEqual(VentaN8n.objects.get(mercadopago_preference_id='pref-2.0').total, Decimal('3981.00'))
+
+    def test_cantidad_invalida_responde_400(self):
+        for cantidad in (2.5, '0', -1, 'dos', 'Infinity'):
+            with self.subTest(cantidad=cantidad):
+                self.assertEqual(self.crear_venta(cantidad).status_code, 400)
+        self.assertFalse(VentaN8n.objects.exists())
+
+
+class IdempotenciaTests(TestCase):
+
+    venta = {
+        'preference_id': 'pref-idem',
+        'email_comprador': 'comprador@test.cl',
+        'items': [{'title': 'Plancha', 'unit_price': 1000, 'quantity': 2}],
+    }
+
+    def post(self, datos, clave='clave-1'):
+        return self.client.post(
+            reverse('api_crear_venta_n8n'), datos, content_type='application/json',
+            headers={idempotencia.ENCABEZADO: clave},
+        )
+
+    def vista(self, respuesta):
+        """Vista de prueba decorada; cuenta sus ejecuciones"""
+        llamadas = []
+
+        @idempotencia.idempotente
+        def vista(request):
+            llamadas.append(request)
+            if isinstance(respuesta, Exception):
+                raise respuesta
+            return respuesta
+        return vista, llamadas
+
+    def peticion(self):
+        return RequestFactory().post(
+            '/api/prueba/', b'{}', content_type='application/json', headers={idempotencia.ENCABEZADO: 'clave-1'}
+        )
+
+    def test_repeticion_devuelve_la_respuesta_guardada(self):
+        primera = self.post(self.venta)
+        self.assertEqual(primera.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', primera)
+
+        VentaN8n.objects.all().delete()
+        repetida = self.post(self.venta)
+        self.assertEqual(repetida.status_code, 200)
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(repetida.json(), primera.json())
+        # La vista no se volvió a ejecutar
+        self.assertFalse(VentaN8n.objects.exists())
+
+    def test_otro_cuerpo_responde_422(self):
+        self.post(self.venta)
+        respuesta = self.post({**self.venta, 'preference_id': 'otra'})
+        self.assertEqual(respuesta.status_code, 422)
+        self.assertEqual(VentaN8n.objects.count(), 1)
+
+    def test_en_curso_responde_409(self):
+        firma = hashlib.sha256(json.dumps(self.venta).encode()).hexdigest()
+        ClaveIdempotencia.objects.create(clave='clave-1', ruta=reverse('api_crear_venta_n8n'), firma=firma)
+        self.assertEqual(self.post(self.venta).status_code, 409)
+        self.assertFalse(VentaN8n.objects.exists())
+
+    def test_error_libera_la_clave(self):
+        for respuesta in (JsonResponse({'error': 'caída'}, status=503), RuntimeError('caída')):
+            with self.subTest(respuesta=respuesta):
+                vista, _ = self.vista(respuesta)
+                if isinstance(respuesta, Exception):
+                    with self.assertRaises(RuntimeError):
+                        vista(self.peticion())
+                else:
+                    self.assertEqual(vista(self.peticion()).status_code, 503)
+                self.assertFalse(ClaveIdempotencia.objects.exists())
+
+                # El reintento con la misma clave vuelve a ejecutar la vista
+                exitosa, llamadas = self.vista(JsonResponse({'ok': True}))
+                self.assertEqual(exitosa(self.peticion()).status_code, 200)
+                self.assertEqual(len(llamadas), 1)
+                ClaveIdempotencia.objects.all().delete()
+
+
+class VentasN8nLoteTests(TestCase):
+
+    def item(self, precio=1000, cantidad=1):
+        return [{'title': 'Plancha', 'unit_price': precio, 'quantity': cantidad}]
+
+    def post(self, ventas):
+        return self.client.post(reverse('api_crear_ventas_n8n_lote'), {'ventas': ventas}, content_type='application/json')
+
+    def test_errores_por_venta(self):
+        respuesta = self.post([
+            {'preference_id': 'pref-1', 'email_comprador': 'a@test.cl', 'items': self.item()},
+            {'email_comprador': 'a@test.cl', 'items': self.item()},
+            {'preference_id': 'pref-2', 'email_comprador': 'a@test.cl', 'items': self.item(cantidad=2.5)},
+            'no es un objeto',
+        ])
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertEqual((datos['total'], datos['registradas']), (4, 1))
+        self.assertEqual([r['success'] for r in datos['resultados']], [True, False, False, False])
+        self.assertEqual(datos['resultados'][1]['error'], 'preference_id es requerido')
+        self.assertEqual(list(VentaN8n.objects.values_list('mercadopago_preference_id', flat=True)), ['pref-1'])
+
+    def test_preference_id_repetido_gana_la_ultima(self):
+        respuesta = self.post([
+            {'preference_id': 'pref-1', 'email_comprador': 'a@test.cl', 'items': self.item(1000)},
+            {'preference_id': 'pref-1', 'email_comprador': 'b@test.cl', 'items': self.item(2500)},
+        ])
+        resultados = respuesta.json()['resultados']
+        venta = VentaN8n.objects.get()
+        self.assertEqual((venta.email_comprador, venta.total), ('b@test.cl', Decimal('2500')))
+        self.assertEqual([r['venta_id'] for r in resultados], [venta.id, venta.id])
+        self.assertTrue(all(r['created'] for r in resultados))
+
+    def test_conserva_el_usuario_ya_asociado(self):
+        asociado = User.objects.create_user('asociado', 'asociado@test.cl', 'clave-segura-123')
+        User.objects.create_user('nuevo', 'nuevo@test.cl', 'clave-segura-123')
+        VentaN8n.objects.create(
+            mercadopago_preference_id='pref-1', email_comprador='asociado@test.cl', items=self.item(),
+            subtotal=Decimal('1000'), total=Decimal('1000'), usuario=asociado,
+        )
+        respuesta = self.post([
+            {'preference_id': 'pref-1', 'email_comprador': 'nuevo@test.cl', 'items': self.item(3000)},
+            {'preference_id': 'pref-2', 'email_comprador': 'nuevo@test.cl', 'items': self.item()},
+        ])
+        self.assertEqual([r['created'] for r in respuesta.json()['resultados']], [False, True])
+        actualizada = VentaN8n.objects.get(mercadopago_preference_id='pref-1')
+        self.assertEqual((actualizada.usuario, actualizada.total), (asociado, Decimal('3000')))
+        self.assertEqual(VentaN8n.objects.get(mercadopago_preference_id='pref-2').usuario.username, 'nuevo')
+
+
+class CotizacionDesdeVentaN8nTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = CategoriaAcero.objects.create(nombre='Barras')
+        cls.barra = Producto.objects.create(
+            nombre='Barra', descripcion='Barra redonda', codigo_producto='BA-01', categoria=cls.categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('1000'), stock_actual=10,
+        )
+        cls.pletina = Producto.objects.create(
+            nombre='Pletina', descripcion='Pletina 2B', codigo_producto='PT-01', categoria=cls.categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('2000'), stock_actual=10,
+        )
+        cls.comprador = User.objects.create_user('comprador_n8n', 'comprador@test.cl', 'clave-segura-123')
+
+    def venta(self, preference_id, items):
+        venta = VentaN8n.objects.create(
+            mercadopago_preference_id=preference_id, email_comprador=self.comprador.email, usuario=self.comprador,
+            items=items, subtotal=Decimal('0'),
+            total=sum(Decimal(str(i['unit_price'])) * i['quantity'] for i in items),
+        )
+        # Sin el usuario ya cargado (y su perfil en caché) de la venta anterior
+        return VentaN8n.objects.get(pk=venta.pk)
+
+    def test_consultas_fijas_con_mas_items(self):
+        # Un item con id (ya no existe) y SKU nuevo: pasa por las mismas consultas que varios
+        una = self.venta('pref-1', [
+            {'id': self.pletina.pk + 100, 'sku': 'NUEVO-1', 'title': 'Codo nuevo', 'unit_price': 1190, 'quantity': 1},
+        ])
+        with CaptureQueriesContext(connection) as contexto:
+            crear_cotizacion_desde_venta_n8n(una)
+        venta = self.venta('pref-n', [
+            {'id': self.barra.pk, 'title': 'Barra', 'unit_price': 1190, 'quantity': 2},
+            {'sku': 'PT-01', 'title': 'Pletina', 'unit_price': 2380, 'quantity': 1},
+            {'sku': 'NUEVO-2', 'title': 'Tee nueva', 'unit_price': 595, 'quantity': 3},
+            {'sku': 'NUEVO-3', 'title': 'Brida nueva', 'unit_price': 5950, 'quantity': 1},
+            # Repetidos: se suman en una sola línea
+            {'sku': 'BA-01', 'title': 'Barra', 'unit_price': 2380, 'quantity': 1},
+            {'sku': 'NUEVO-2', 'title': 'Tee nueva', 'unit_price': 595, 'quantity': 1},
+        ])
+        with self.assertNumQueries(len(contexto.captured_queries)):
+            cotizacion = crear_cotizacion_desde_venta_n8n(venta)
+
+        lineas = {d.producto.codigo_producto: d for d in cotizacion.detalles.select_related('producto')}
+        self.assertEqual(sorted(lineas), ['BA-01', 'NUEVO-2', 'NUEVO-3', 'PT-01'])
+        self.assertEqual(lineas['BA-01'].cantidad, 3)
+        self.assertEqual(lineas['BA-01'].subtotal, Decimal('4000.00'))
+        self.assertEqual((lineas['NUEVO-2'].cantidad, lineas['NUEVO-2'].subtotal), (4, Decimal('2000.00')))
+        self.assertEqual(lineas['NUEVO-3'].producto.categoria, self.categoria)
+
+        # Los totales de la cotización son los de MercadoPago (IVA incluido)
+        cotizacion.refresh_from_db()
+        self.assertEqual(cotizacion.total, venta.total)
+        self.assertEqual(cotizacion.subtotal, Decimal('13000.00'))
+        self.assertEqual(cotizacion.iva, Decimal('2470.00'))
+        self.assertEqual(sum(d.subtotal for d in lineas.values()), cotizacion.subtotal)
+
+
+@override_settings(API_INTEGRACIONES_TOKEN='token-pruebas')
+class FeedCambiosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Perfiles')
+        cls.ids = [
+            Producto.objects.create(
+                nombre=f'Perfil {numero}', descripcion='Perfil L', codigo_producto=f'PF-{numero}', categoria=categoria,
+                tipo_acero='304', precio_por_unidad=Decimal('1000'), stock_actual=1,
+            ).id
+            for numero in range(5)
+        ]
+        # Todas con la misma fecha: el cursor debe desempatar por id
+        Producto.objects.update(fecha_actualizacion=timezone.now() - datetime.timedelta(minutes=1))
+
+    def consultar(self, **parametros):
+        return self.client.get(
+            reverse('api_cambios', args=['productos']), parametros, HTTP_AUTHORIZATION='Bearer token-pruebas'
+        )
+
+    def test_cursor_con_fechas_iguales(self):
+        vistos = []
+        cursor = ''
+        for _ in range(3):
+            datos = self.consultar(cursor=cursor, limite=2).json()
+            vistos += [fila[0] for fila in datos['filas']]
+            cursor = datos['cursor']
+        self.assertEqual(vistos, self.ids)
+        self.assertFalse(datos['hay_mas'])
+
+        # Sin cambios nuevos, el mismo cursor no repite filas
+        datos = self.consultar(cursor=cursor).json()
+        self.assertEqual((datos['filas'], datos['cursor']), ([], cursor))
+
+        Producto.objects.filter(pk=self.ids[1]).update(fecha_actualizacion=timezone.now() - cambios.MARGEN * 2)
+        self.assertEqual([fila[0] for fila in self.consultar(cursor=cursor).json()['filas']], [self.ids[1]])
+
+    def test_cursor_ajeno_se_rechaza(self):
+        cursor = cambios.codificar_cursor('cotizaciones', timezone.now(), 1)
+        self.assertEqual(self.consultar(cursor=cursor).status_code, 400)
+        self.assertEqual(self.consultar(cursor='alterado').status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_cambios', args=['productos'])).status_code, 401)
+
+
+class GetCondicionalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaAcero.objects.create(nombre='Tubos')
+        cls.tubo = Producto.objects.create(
+            nombre='Tubo', descripcion='Tubo redondo', codigo_producto='TU-01', categoria=categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('3000'), stock_actual=10,
+        )
+        cls.codo = Producto.objects.create(
+            nombre='Codo', descripcion='Codo 90°', codigo_producto='CO-01', categoria=categoria,
+            tipo_acero='304', precio_por_unidad=Decimal('1500'), stock_actual=10,
+        )
+        cls.cliente = User.objects.create_user('comprador', 'comprador@test.cl', 'clave-segura-123')
+        cls.cotizacion = Cotizacion.objects.create(usuario=cls.cliente)
+        for producto in (cls.tubo, cls.codo):
+            DetalleCotizacion.objects.create(
+                cotizacion=cls.cotizacion, producto=producto, cantidad=1, precio_unitario=producto.precio_por_unidad,
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidar(self, url):
+        """(primera respuesta, revalidación con su ETag)"""
+        primera = self.client.get(url)
+        self.assertEqual(primera.status_code, 200)
+        return primera, self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+
+    def test_listado_y_detalle_de_producto(self):
+        for url in (reverse('productos'), reverse('detalle_producto', args=[self.tubo.id])):
+            with self.subTest(url=url):
+                primera, segunda = self.revalidar(url)
+                self.assertEqual(segunda.status_code, 304)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.tubo.nombre = 'Tubo redondo'
+                    self.tubo.save()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag']).status_code, 200)
+
+    def test_pdf_de_cotizacion(self):
+        self.client.force_login(self.cliente)
+        url = reverse('descargar_cotizacion_pdf', args=[self.cotizacion.id])
+        primera, segunda = self.revalidar(url)
+        self.assertEqual(segunda.status_code, 304)
+
+        # Eliminar una línea cambia el PDF
+        detalle = self.cotizacion.detalles.get(producto=self.codo)
+        self.client.post(reverse('eliminar_producto_cotizacion', args=[detalle.id]))
+        tercera = self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag'])
+        self.assertEqual(tercera.status_code, 200)
+
+        # También los datos del cliente que se imprimen
+        perfil = self.cliente.perfil
+        perfil.telefono = '+56 9 8765 4321'
+        perfil.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=tercera['ETag']).status_code, 200)
+
+    def test_documento_tributario_generado_al_vuelo(self):
+        Cotizacion.objects.filter(pk=self.cotizacion.pk).update(
+            facturada=True, tipo_documento='boleta', numero_documento='B-1', estado='pagada'
+        )
+        self.client.force_login(self.cliente)
+        url = reverse('descargar_documento_tributario', args=[self.cotizacion.id])
+        primera, segunda = self.revalidar(url)
+        self.assertEqual(segunda.status_code, 304)
+
+        User.objects.filter(pk=self.cliente.pk).update(first_name='Nuevo')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag']).status_code, 200)
+
+    def test_cotizacion_ajena_no_responde_304(self):
+        otro = User.objects.create_user('otro', 'otro@test.cl', 'clave-segura-123')
+        self.client.force_login(otro)
+        url = reverse('descargar_cotizacion_pdf', args=[self.cotizacion.id])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
@@ -12,6 +12,8 @@ urlpatterns = [
     path('panel-admin/', views.panel_admin, name='panel_admin'),
     path('panel-admin/productos/', views.lista_productos_admin, name='lista_productos_admin'),
     path('panel-admin/productos/crear/', views.crear_producto, name='crear_producto'),
+    path('panel-admin/productos/importar/', views.importar_productos_admin, name='importar_productos_admin'),
+    path('panel-admin/productos/precios/', views.actualizar_precios_admin, name='actualizar_precios_admin'),
     path('panel-admin/productos/editar/<int:producto_id>/', views.editar_producto, name='editar_producto'),
     path('panel-admin/productos/eliminar/<int:producto_id>/', views.eliminar_producto, name='eliminar_producto'),
     path('panel-admin/categorias/', views.lista_categorias_admin, name='lista_categorias_admin'),
@@ -21,6 +23,7 @@ urlpatterns = [
     path('panel-admin/transferencias/', views.panel_verificacion_transferencias, name='panel_verificacion_transferencias'),
     path('panel-admin/transferencias/<int:transferencia_id>/verificar/', views.verificar_transferencia, name='verificar_transferencia'),
     path('panel-admin/reportes/', views.reportes_generales, name='reportes_generales'),
+    path('panel-admin/reportes/trabajos/<int:trabajo_id>/estado/', views.estado_trabajo_reporte, name='estado_trabajo_reporte'),
     
     # Recepciones de Compras (Solo Administradores)
     path('panel-admin/recepciones/', views.gestionar_recepciones, name='gestionar_recepciones'),
@@ -47,6 +50,7 @@ urlpatterns = [
     path('cotizaciones/crear/', views.crear_cotizacion, name='crear_cotizacion'),
     path('cotizaciones/<int:cotizacion_id>/', views.detalle_cotizacion, name='detalle_cotizacion'),
     path('cotizaciones/<int:cotizacion_id>/agregar-producto/', views.agregar_producto_cotizacion, name='agregar_producto_cotizacion'),
+    path('cotizaciones/autocompletar-productos/', views.autocompletar_productos, name='autocompletar_productos'),
     path('cotizaciones/detalle/<int:detalle_id>/actualizar-cantidad/', views.actualizar_cantidad_producto, name='actualizar_cantidad_producto'),
     path('cotizaciones/detalle/<int:detalle_id>/eliminar/', views.eliminar_producto_cotizacion, name='eliminar_producto_cotizacion'),
     path('cotizaciones/<int:cotizacion_id>/finalizar/', views.finalizar_cotizacion, name='finalizar_cotizacion'),
@@ -72,6 +76,9 @@ urlpatterns = [
     
     # Ventas N8N - Bot de ventas
     path('api/n8n/crear-venta/', views.api_crear_venta_n8n, name='api_crear_venta_n8n'),
+    path('api/n8n/crear-ventas/', views.api_crear_ventas_n8n_lote, name='api_crear_ventas_n8n_lote'),
+    path('api/n8n/catalogo/', views.api_catalogo, name='api_catalogo'),
+    path('api/cambios/<str:recurso>/', views.api_cambios, name='api_cambios'),
     path('exito/', views.pago_exitoso_n8n, name='pago_exitoso_n8n'),
     path('fallo/', views.pago_fallido_n8n, name='pago_fallido_n8n'),
     path('pendiente/', views.pago_pendiente_n8n, name='pago_pendiente_n8n'),
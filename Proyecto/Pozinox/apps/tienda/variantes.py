@@ -0,0 +1,139 @@
+"""
+Variantes de producto (una por medida) con SKU, precio, stock y peso propios.
+
+El catálogo no agrega variantes por fila: Producto guarda el resumen
+desnormalizado. Con variantes activas, precio_minimo/precio_maximo son el
+rango de precios y stock_actual la suma de sus stocks (los reportes de stock,
+los filtros y la API siguen leyendo Producto.stock_actual). Sin variantes,
+precio_minimo/precio_maximo quedan en NULL y stock_actual es el del producto.
+
+``actualizar_resumen`` recalcula ese resumen con un UPDATE por lote de
+productos; lo llaman las señales de VarianteProducto, ``descontar_stock``
+al facturar y ``sumar_stock`` al confirmar una recepción de compra. Como update() no envía post_save, aquí mismo se actualiza
+fecha_actualizacion y se aumenta la versión del catálogo.
+"""
+from django.db import transaction
+from django.db.models import F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import catalogo
+from .models import Producto, VarianteProducto
+
+TAMANO_LOTE = 500
+
+
+class MedidaRequerida(ValueError):
+    """Se intentó cotizar o recibir sin medida un producto con variantes activas"""
+
+
+def _agregado(funcion, campo):
+    """Subconsulta con ``funcion(campo)`` de las variantes activas de cada producto"""
+    return Subquery(
+        VarianteProducto.objects.filter(producto=OuterRef('pk'), activa=True)
+        .order_by().values('producto').annotate(valor=funcion(campo)).values('valor')
+    )
+
+
+def actualizar_resumen(producto_ids, solo_stock=False):
+    """
+    Recalcula precio_minimo, precio_maximo y stock_actual de los productos
+    indicados. ``solo_stock``: solo cambió el stock de las variantes.
+    """
+    producto_ids = sorted(set(producto_ids))
+    ahora = timezone.now()
+    with transaction.atomic():
+        for inicio in range(0, len(producto_ids), TAMANO_LOTE):
+            Producto.objects.filter(pk__in=producto_ids[inicio:inicio + TAMANO_LOTE]).update(
+                precio_minimo=_agregado(Min, 'precio_por_unidad'),
+                precio_maximo=_agregado(Max, 'precio_por_unidad'),
+                # Sin variantes activas se conserva el stock propio del producto
+                stock_actual=Coalesce(_agregado(Sum, 'stock_actual'), F('stock_actual')),
+                fecha_actualizacion=ahora,
+            )
+        if producto_ids:
+            catalogo.incrementar_version(solo_stock=solo_stock)
+
+
+def precio(producto, variante=None):
+    """Precio unitario de una línea de cotización"""
+    return variante.precio_por_unidad if variante else producto.precio_por_unidad
+
+
+def obtener_variante(producto, variante_id):
+    """
+    Variante activa del producto con ese id; None si el producto no tiene
+    variantes. Lanza MedidaRequerida si tiene variantes y no se indicó una
+    (la línea se cobraría al precio del producto y descontaría un stock que
+    actualizar_resumen recalcula) y VarianteProducto.DoesNotExist si el id
+    no corresponde.
+    """
+    if not variante_id:
+        if producto.tiene_variantes:
+            raise MedidaRequerida(f'Selecciona una medida de "{producto.nombre}".')
+        return None
+    return VarianteProducto.objects.get(pk=variante_id, producto=producto, activa=True)
+
+
+def descontar_stock(cotizacion):
+    """
+    Descuenta el stock de cada línea al facturar: de la variante si la línea
+    tiene una, si no del producto. Cada descuento es un UPDATE condicionado a
+    que alcance el stock (dos facturaciones simultáneas no dejan stock
+    negativo). Retorna los textos de las líneas sin stock suficiente.
+    """
+    sin_stock = []
+    con_variantes = set()
+    ahora = timezone.now()
+    with transaction.atomic():
+        for detalle in cotizacion.detalles.all().select_related('producto', 'variante'):
+            if detalle.variante_id:
+                objetivo, modelo, pk = detalle.variante, VarianteProducto, detalle.variante_id
+                extra = {}
+            else:
+                objetivo, modelo, pk = detalle.producto, Producto, detalle.producto_id
+                extra = {'fecha_actualizacion': ahora}
+            descontados = modelo.objects.filter(pk=pk, stock_actual__gte=detalle.cantidad).update(
+                stock_actual=F('stock_actual') - detalle.cantidad, **extra
+            )
+            if not descontados:
+                objetivo.refresh_from_db(fields=['stock_actual'])
+                sin_stock.append(f'{detalle.nombre_producto} (disponible: {objetivo.stock_actual}, necesario: {detalle.cantidad})')
+            elif detalle.variante_id:
+                con_variantes.add(detalle.producto_id)
+
+        if con_variantes:
+            actualizar_resumen(con_variantes, solo_stock=True)
+        else:
+            catalogo.incrementar_version(solo_stock=True)
+    return sin_stock
+
+
+def sumar_stock(detalles):
+    """
+    Suma al stock las líneas de una recepción de compra: a la variante si la
+    línea tiene una, si no al producto, con UPDATE ... + cantidad (no pisa un
+    descuento simultáneo). Lanza MedidaRequerida si una línea sin variante es
+    de un producto con variantes: su stock_actual lo recalcula
+    actualizar_resumen y las unidades se perderían.
+    """
+    con_variantes = set()
+    ahora = timezone.now()
+    with transaction.atomic():
+        for detalle in detalles:
+            if detalle.variante_id:
+                VarianteProducto.objects.filter(pk=detalle.variante_id).update(
+                    stock_actual=F('stock_actual') + detalle.cantidad
+                )
+                con_variantes.add(detalle.producto_id)
+            elif detalle.producto.tiene_variantes:
+                raise MedidaRequerida(f'Selecciona la medida recibida de "{detalle.producto.nombre}".')
+            else:
+                Producto.objects.filter(pk=detalle.producto_id).update(
+                    stock_actual=F('stock_actual') + detalle.cantidad, fecha_actualizacion=ahora
+                )
+
+        if con_variantes:
+            actualizar_resumen(con_variantes, solo_stock=True)
+        else:
+            catalogo.incrementar_version(solo_stock=True)
@@ -1,20 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.models import User
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q, F, Count, Sum
-from django.http import JsonResponse, HttpResponse
+from django.db import transaction
+from django.db.models import Q, F, Count, Sum, Prefetch
+from django.http import JsonResponse, HttpResponse, QueryDict
 from django.utils import timezone
-from django.views.decorators.http import require_POST
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import parse_etags
+from django.core.cache import cache
+from django.views.decorators.http import require_GET, require_POST
 from django.conf import settings
 from django.urls import reverse
-from .models import Producto, CategoriaAcero, Cotizacion, DetalleCotizacion, TransferenciaBancaria, RecepcionCompra, DetalleRecepcionCompra, VentaN8n
-from .forms import ProductoForm, CategoriaForm
+from .models import Producto, VarianteProducto, CategoriaAcero, Cotizacion, DetalleCotizacion, TransferenciaBancaria, RecepcionCompra, DetalleRecepcionCompra, VentaN8n, TrabajoReporte
+from . import reportes
+from . import catalogo
+from . import cambios
+from . import medidas
+from . import recomendaciones
+from . import variantes
+from . import autocompletar
+from .forms import ProductoForm, CategoriaForm, ReglaPrecioForm
+from apps.exportacion import exportar_queryset, formato_solicitado
+from apps.usuarios.decorators import staff_required, admin_required
+from apps.usuarios.roles import obtener_rol
+from apps.usuarios.correo import encolar_correo
+from apps.usuarios.notificaciones import notificar
+from .idempotencia import idempotente
+from .condicional import (
+    condicional, validadores_catalogo, validadores_producto,
+    validadores_cotizacion_pdf, validadores_documento_tributario,
+)
 import mercadopago
 import os
 import json
 import logging
 from datetime import timedelta
+from decimal import Decimal, InvalidOperation
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.units import inch
@@ -34,10 +57,7 @@ def es_superusuario(user):
 def puede_editar_cotizacion(user, cotizacion):
     """Verifica si el usuario puede editar la cotización"""
     # Verificar si es staff (superusuario, trabajador o administrador)
-    es_staff = user.is_superuser or (
-        hasattr(user, 'perfil') and 
-        user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = obtener_rol(user).es_staff
     
     # Puede editar si: está en borrador Y (es el propietario O es quien la creó O es staff)
     return (
@@ -61,6 +81,12 @@ def aplicar_filtros_productos(queryset, request):
             Q(descripcion__icontains=busqueda) |
             Q(codigo_producto__icontains=busqueda)
         )
+    # Rango de medida en mm (también acepta 1/2", 2 cm...); se ignora si no es válido
+    queryset = medidas.filtrar_por_rango(
+        queryset,
+        desde=medidas.a_milimetros(request.GET.get('medida_min'), 'mm'),
+        hasta=medidas.a_milimetros(request.GET.get('medida_max'), 'mm'),
+    )
     return queryset
 
 def paginar_queryset(queryset, request, per_page=20):
@@ -70,15 +96,17 @@ def paginar_queryset(queryset, request, per_page=20):
     return paginator.get_page(page_number)
 
 
+@catalogo.cache_pagina_anonima
 def home(request):
     """Vista principal de la página de inicio"""
-    from django.core.mail import send_mail
     
     if request.method == 'GET':
+        # Querysets sin evaluar: si el fragmento está en caché no se consultan
         context = {
             'productos_destacados': Producto.objects.filter(activo=True)[:6],
             'categorias': CategoriaAcero.objects.filter(activa=True)[:4],
             'titulo': 'Pozinox - Tienda de Aceros',
+            **catalogo.contexto_cache(request),
         }
         return render(request, 'tienda/home.html', context)
 
@@ -122,16 +150,13 @@ Mensaje:
         # Intentar enviar correos
         try:
             # Enviar correo a la empresa
-            send_mail(
-                subject=f"Nuevo mensaje de contacto de {nombre}",
-                message=cuerpo,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=["pozinox.empresa@gmail.com"],
-                fail_silently=False,
+            encolar_correo(
+                asunto=f"Nuevo mensaje de contacto de {nombre}",
+                destinatarios=["pozinox.empresa@gmail.com"],
+                texto=cuerpo,
             )
             
             # Enviar correo de confirmación al usuario (HTML)
-            from django.core.mail import EmailMultiAlternatives
             
             subject = "Confirmación de Contacto - Pozinox"
             text_content = f"Estimado/a {nombre}, hemos recibido tu mensaje correctamente."
@@ -250,9 +275,7 @@ Mensaje:
 </html>
 """
             
-            msg = EmailMultiAlternatives(subject, text_content, settings.DEFAULT_FROM_EMAIL, [email])
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
+            encolar_correo(subject, [email], texto=text_content, html=html_content)
             
             success = "¡Mensaje enviado correctamente! Hemos enviado un correo de confirmación a tu email."
             
@@ -264,13 +287,13 @@ Mensaje:
             'categorias': CategoriaAcero.objects.filter(activa=True)[:4],
             'titulo': 'Pozinox - Tienda de Aceros',
             'success': success,
+            **catalogo.contexto_cache(request),
         }
         return render(request, 'tienda/home.html', context)
 
 
 def contacto(request):
     """Vista de la página de contacto"""
-    from django.core.mail import send_mail
     
     if request.method == 'GET':
         return render(request, 'tienda/contacto.html')
@@ -315,16 +338,13 @@ Mensaje:
         # Intentar enviar correos
         try:
             # Enviar correo a la empresa
-            send_mail(
-                subject=f"Nuevo mensaje de contacto de {nombre}",
-                message=cuerpo,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=["pozinox.empresa@gmail.com"],
-                fail_silently=False,
+            encolar_correo(
+                asunto=f"Nuevo mensaje de contacto de {nombre}",
+                destinatarios=["pozinox.empresa@gmail.com"],
+                texto=cuerpo,
             )
             
             # Enviar correo de confirmación al usuario (HTML)
-            from django.core.mail import EmailMultiAlternatives
             
             subject = "Confirmación de Contacto - Pozinox"
             text_content = f"Estimado/a {nombre}, hemos recibido tu mensaje correctamente."
@@ -443,9 +463,7 @@ Mensaje:
 </html>
 """
             
-            msg = EmailMultiAlternatives(subject, text_content, settings.DEFAULT_FROM_EMAIL, [email])
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
+            encolar_correo(subject, [email], texto=text_content, html=html_content)
             
             # Mostrar mensaje de éxito
             success = "¡Mensaje enviado correctamente! Hemos enviado un correo de confirmación a tu email."
@@ -460,34 +478,44 @@ Mensaje:
         return render(request, 'tienda/contacto.html', context)
 
 
+@condicional(validadores_catalogo)
+@catalogo.cache_pagina_anonima
 def productos_publicos(request):
     """Vista pública de productos para todos los usuarios"""
-    productos = aplicar_filtros_productos(Producto.objects.filter(activo=True), request)
+    productos = aplicar_filtros_productos(Producto.objects.filter(activo=True).select_related('categoria'), request)
+    # Filtros actuales para los enlaces de paginación
+    parametros = QueryDict(mutable=True)
+    for nombre, valores in catalogo.parametros_pagina(request):
+        if nombre != 'page':
+            parametros.setlist(nombre, valores)
+    filtros_url = parametros.urlencode()
     context = {
-        'productos': paginar_queryset(productos, request, 12),
+        # La paginación (COUNT + página) solo se ejecuta si el fragmento no está en caché
+        'productos': SimpleLazyObject(lambda: paginar_queryset(productos, request, 12)),
         'categorias': CategoriaAcero.objects.filter(activa=True),
         'categoria_actual': request.GET.get('categoria') or '',
         'busqueda': request.GET.get('q') or '',
+        'medida_min': request.GET.get('medida_min') or '',
+        'medida_max': request.GET.get('medida_max') or '',
+        'filtros_url': filtros_url,
+        'pagina': request.GET.get('page') or '',
+        **catalogo.contexto_cache(request),
     }
     return render(request, 'tienda/productos.html', context)
 
 
+@condicional(validadores_producto)
+@catalogo.cache_pagina_anonima
 def detalle_producto(request, producto_id):
     """Vista de detalle de un producto específico"""
     producto = get_object_or_404(Producto, id=producto_id, activo=True)
-    # Parse medidas JSON into a Python list for the template
-    medidas_list = []
-    try:
-        import json
-        medidas_list = json.loads(producto.medidas or '[]')
-    except Exception:
-        medidas_list = []
     context = {
         'producto': producto,
-        'productos_relacionados': Producto.objects.filter(
-            categoria=producto.categoria, activo=True
-        ).exclude(id=producto.id)[:4],
-        'medidas_list': medidas_list,
+        # Solo se consulta si el fragmento no está en caché
+        'productos_relacionados': SimpleLazyObject(lambda: recomendaciones.relacionados(producto)),
+        'medidas_list': producto.medidas_normalizadas.all(),
+        'variantes': producto.variantes.filter(activa=True),
+        **catalogo.contexto_cache(request),
     }
     return render(request, 'tienda/detalle_producto.html', context)
 
@@ -588,60 +616,30 @@ def reportes_generales(request):
     except Exception:
         pass
 
-    # Estados de cotización que consideramos para ventas/ingresos/productos vendidos
-    estados_ventas = ['pagada', 'finalizada', 'en_revision']
-
-    if tipo == 'ventas':
-        # Ventas: sumamos el total por día dentro del rango
-        qs = Cotizacion.objects.filter(fecha_creacion__gte=fecha_desde_dt, fecha_creacion__lte=fecha_hasta_dt, estado__in=estados_ventas)
-        if not qs.exists():
-            no_data = True
-        else:
-            ventas_por_dia = qs.extra(select={'dia': "date(fecha_creacion)"}).values('dia').annotate(total=Sum('total')).order_by('dia')
-            results = [{'label': v['dia'], 'value': v['total'] or 0} for v in ventas_por_dia]
-
-    elif tipo == 'ingresos':
-        # Ingresos por fecha: similar a ventas, pero explícito
-        qs = Cotizacion.objects.filter(fecha_creacion__gte=fecha_desde_dt, fecha_creacion__lte=fecha_hasta_dt, estado__in=estados_ventas)
-        if not qs.exists():
-            no_data = True
-        else:
-            ingresos_por_dia = qs.extra(select={'dia': "date(fecha_creacion)"}).values('dia').annotate(total=Sum('total')).order_by('dia')
-            results = [{'label': v['dia'], 'value': v['total'] or 0} for v in ingresos_por_dia]
-
-    elif tipo == 'productos_mas_vendidos':
-        # Productos más vendidos: sumar cantidades en DetalleCotizacion para cotizaciones pagadas/finalizadas
-        detalles_qs = DetalleCotizacion.objects.filter(cotizacion__fecha_creacion__gte=fecha_desde_dt, cotizacion__fecha_creacion__lte=fecha_hasta_dt, cotizacion__estado__in=estados_ventas)
-        if not detalles_qs.exists():
-            no_data = True
-        else:
-            vendidos = detalles_qs.values('producto__id', 'producto__nombre').annotate(total_vendido=Sum('cantidad')).order_by('-total_vendido')[:100]
-            results = list(vendidos)
-
-    elif tipo == 'clientes':
-        # Reporte de clientes: top por total comprado y número de pedidos
-        qs = Cotizacion.objects.filter(fecha_creacion__gte=fecha_desde_dt, fecha_creacion__lte=fecha_hasta_dt, estado__in=estados_ventas)
-        if not qs.exists():
-            no_data = True
-        else:
-            clientes_qs = qs.values('usuario__id', 'usuario__username', 'usuario__first_name', 'usuario__last_name').annotate(total_gastado=Sum('total'), pedidos=Count('id')).order_by('-total_gastado')[:100]
-            results = list(clientes_qs)
-
-    elif tipo == 'stock':
-        # Productos con stock bajo
-        qs = Producto.objects.filter(stock_actual__lte=F('stock_minimo'))
-        if not qs.exists():
-            no_data = True
-        else:
-            results = list(qs.values('id', 'nombre', 'stock_actual', 'stock_minimo', 'categoria__nombre'))
-
-    elif tipo == 'cotizaciones':
-        qs = Cotizacion.objects.filter(fecha_creacion__gte=fecha_desde_dt, fecha_creacion__lte=fecha_hasta_dt)
-        if not qs.exists():
-            no_data = True
-        else:
-            results = list(qs.values('numero_cotizacion', 'usuario__username', 'estado', 'total', 'fecha_creacion')[:100])
-
+    # Los reportes trabajan con días locales (America/Santiago)
+    dia_desde = timezone.localtime(fecha_desde_dt).date()
+    dia_hasta = timezone.localtime(fecha_hasta_dt).date()
+
+    # Exportación: se genera en el momento y se envía por streaming (sin el límite de 100 filas)
+    formato = formato_solicitado(request)
+    if formato and tipo in reportes.TIPOS_REPORTE:
+        if tipo in reportes.TIPOS_CON_RESUMEN:
+            reportes.actualizar_resumenes()
+        reporte_qs, columnas_exportar = reportes.consulta_reporte(tipo, dia_desde, dia_hasta)
+        if reporte_qs.exists():
+            return exportar_queryset(reporte_qs, columnas_exportar, f'reporte_{tipo}', formato)
+
+    # En pantalla: el reporte se calcula como trabajo en segundo plano y se reutiliza
+    # mientras los datos no cambien
+    trabajo = None
+    if tipo in reportes.TIPOS_REPORTE:
+        trabajo = reportes.obtener_trabajo(tipo, dia_desde, dia_hasta)
+        # Sin worker configurado se calcula en la misma petición, si nadie lo tomó antes
+        if trabajo.estado == 'pendiente' and not settings.REPORTES_ASINCRONOS and reportes.reclamar_trabajo(trabajo):
+            trabajo = reportes.procesar_trabajo(trabajo)
+        if trabajo.estado == 'completado':
+            results = trabajo.filas_como_dict()
+            no_data = not results
     else:
         no_data = True
 
@@ -649,12 +647,24 @@ def reportes_generales(request):
         'tipo': tipo,
         'results': results,
         'no_data': no_data,
-        'fecha_desde': fecha_desde_dt.date() if fecha_desde_dt else None,
-        'fecha_hasta': fecha_hasta_dt.date() if fecha_hasta_dt else None,
+        'trabajo': trabajo,
+        'fecha_desde': dia_desde,
+        'fecha_hasta': dia_hasta,
     }
     return render(request, 'tienda/admin/reportes_generales.html', context)
 
 
+@login_required
+@user_passes_test(es_superusuario)
+def estado_trabajo_reporte(request, trabajo_id):
+    """Estado de un reporte en segundo plano (consultado por la página con polling)"""
+    trabajo = get_object_or_404(TrabajoReporte, id=trabajo_id)
+    return JsonResponse({
+        'estado': trabajo.estado,
+        'error': trabajo.error,
+    })
+
+
 @login_required
 @user_passes_test(es_superusuario)
 def lista_productos_admin(request):
@@ -670,6 +680,23 @@ def lista_productos_admin(request):
     
     productos = aplicar_filtros_productos(productos, request)
     
+    formato = formato_solicitado(request)
+    if formato:
+        tipos_acero = dict(Producto.TIPOS_ACERO)
+        return exportar_queryset(productos, [
+            ('codigo_producto', 'Código'),
+            ('nombre', 'Nombre'),
+            ('categoria__nombre', 'Categoría'),
+            ('tipo_acero', 'Tipo de Acero', lambda v: tipos_acero.get(v, v)),
+            ('medidas', 'Medidas'),
+            ('precio_por_unidad', 'Precio por Unidad'),
+            ('unidad_medida', 'Unidad'),
+            ('stock_actual', 'Stock Actual'),
+            ('stock_minimo', 'Stock Mínimo'),
+            ('activo', 'Activo'),
+            ('fecha_actualizacion', 'Última Actualización'),
+        ], 'productos', formato)
+    
     context = {
         'productos': paginar_queryset(productos, request, 20),
         'categorias': CategoriaAcero.objects.all(),
@@ -695,6 +722,80 @@ def crear_producto(request):
     })
 
 
+@login_required
+@user_passes_test(es_superusuario)
+def importar_productos_admin(request):
+    """Carga masiva de productos desde CSV/XLSX con opción de simulación"""
+    from .importacion import importar_productos, leer_filas, ErrorImportacion
+
+    resultado = None
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        dry_run = request.POST.get('dry_run') == 'on'
+        if not archivo:
+            messages.error(request, 'Debes seleccionar un archivo CSV o XLSX.')
+        else:
+            try:
+                resultado = importar_productos(
+                    leer_filas(archivo, archivo.name),
+                    dry_run=dry_run,
+                    crear_categorias=request.POST.get('crear_categorias') == 'on',
+                )
+            except ErrorImportacion as e:
+                messages.error(request, str(e))
+            except Exception as e:
+                logger.exception('Error importando productos desde %s', archivo.name)
+                messages.error(request, f'Error al procesar el archivo: {str(e)}')
+            else:
+                if dry_run:
+                    messages.info(request, 'Simulación completada. Revisa los cambios y vuelve a subir el archivo sin marcar "Simular" para aplicarlos.')
+                else:
+                    messages.success(
+                        request,
+                        f"Importación completada: {resultado['creados']} creados, "
+                        f"{resultado['actualizados']} actualizados, {resultado['errores']} con errores."
+                    )
+
+    return render(request, 'tienda/admin/importar_productos.html', {
+        'resultado': resultado,
+    })
+
+
+@login_required
+@user_passes_test(es_superusuario)
+def actualizar_precios_admin(request):
+    """Actualización masiva de precios por regla (previsualizar y aplicar)"""
+    from . import precios
+
+    form = ReglaPrecioForm(request.POST or None)
+    resumen = None
+    if request.method == 'POST' and form.is_valid():
+        datos = form.cleaned_data
+        productos = precios.filtrar_productos(datos['categoria'], datos['tipo_acero'], datos['prefijo_codigo'])
+        expresion = precios.expresion_precio(datos['tipo_cambio'], datos['valor'], datos['redondeo'])
+
+        if request.POST.get('accion') == 'aplicar':
+            regla = precios.describir_regla(
+                datos['tipo_cambio'], datos['valor'], datos['redondeo'],
+                datos['categoria'], datos['tipo_acero'], datos['prefijo_codigo']
+            )
+            try:
+                cambiados = precios.aplicar(productos, expresion, regla, usuario=request.user)
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                logger.info('Regla de precios aplicada por %s: %s (%s productos)', request.user.username, regla, cambiados)
+                messages.success(request, f'Precios actualizados en {cambiados} productos.')
+                return redirect('lista_productos_admin')
+
+        resumen = precios.previsualizar(productos, expresion)
+
+    return render(request, 'tienda/admin/actualizar_precios.html', {
+        'form': form,
+        'resumen': resumen,
+    })
+
+
 @login_required
 @user_passes_test(es_superusuario)
 def editar_producto(request, producto_id):
@@ -862,18 +963,9 @@ def mis_cotizaciones(request):
 
 
 @login_required
+@staff_required(redirect_url='mis_cotizaciones')
 def todas_cotizaciones(request):
     """Lista de TODAS las cotizaciones - Solo para staff/trabajadores/administradores"""
-    # Verificar permisos
-    tiene_permiso = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
-    
-    if not tiene_permiso:
-        messages.error(request, 'No tienes permisos para acceder a esta sección.')
-        return redirect('mis_cotizaciones')
-    
     # Obtener TODAS las cotizaciones
     cotizaciones = Cotizacion.objects.all().select_related('usuario', 'creado_por').order_by('-fecha_creacion')
     
@@ -894,6 +986,22 @@ def todas_cotizaciones(request):
             Q(usuario__email__icontains=busqueda)
         )
     
+    formato = formato_solicitado(request)
+    if formato:
+        estados = dict(Cotizacion.ESTADOS_COTIZACION)
+        return exportar_queryset(cotizaciones, [
+            ('numero_cotizacion', 'Número'),
+            ('fecha_creacion', 'Fecha'),
+            ('usuario_nombre', 'Cliente'),
+            ('usuario_email', 'Email'),
+            ('creado_por_nombre', 'Creada por'),
+            ('estado', 'Estado', lambda v: estados.get(v, v)),
+            ('metodo_pago', 'Método de Pago'),
+            ('subtotal', 'Subtotal'),
+            ('iva', 'IVA'),
+            ('total', 'Total'),
+        ], 'cotizaciones', formato)
+    
     return render(request, 'tienda/cotizaciones/todas_cotizaciones.html', {
         'cotizaciones': paginar_queryset(cotizaciones, request, 20),
         'estado_actual': estado,
@@ -915,43 +1023,39 @@ def crear_cotizacion(request):
     if producto_id:
         try:
             producto = Producto.objects.get(id=producto_id, activo=True)
+            variante = variantes.obtener_variante(producto, request.GET.get('variante_id'))
             cantidad = int(request.GET.get('cantidad', 1))
             
-            # Verificar si el producto ya está en la cotización
+            # Verificar si el producto (o la variante) ya está en la cotización
             detalle, created = DetalleCotizacion.objects.get_or_create(
                 cotizacion=cotizacion,
                 producto=producto,
-                defaults={'cantidad': cantidad, 'precio_unitario': producto.precio_por_unidad}
+                variante=variante,
+                defaults={'cantidad': cantidad, 'precio_unitario': variantes.precio(producto, variante)}
             )
             
             if not created:
                 # Si ya existe, incrementar la cantidad
                 detalle.cantidad += cantidad
                 detalle.save()
-                messages.success(request, f'Se agregó {cantidad} más de "{producto.nombre}" a tu cotización.')
+                messages.success(request, f'Se agregó {cantidad} más de "{detalle.nombre_producto}" a tu cotización.')
             else:
-                messages.success(request, f'"{producto.nombre}" agregado a tu cotización.')
-        except Producto.DoesNotExist:
+                messages.success(request, f'"{detalle.nombre_producto}" agregado a tu cotización.')
+        except variantes.MedidaRequerida as e:
+            messages.error(request, str(e))
+            return redirect('detalle_producto', producto_id=producto.id)
+        except (Producto.DoesNotExist, VarianteProducto.DoesNotExist):
             messages.error(request, 'El producto seleccionado no está disponible.')
     
     return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
 
 
 @login_required
+@staff_required
 def crear_cotizacion_para_cliente(request):
     """Vista para que trabajadores/administradores creen cotizaciones para clientes"""
     from django.contrib.auth.models import User
     
-    # Verificar permisos
-    tiene_permiso = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
-    
-    if not tiene_permiso:
-        messages.error(request, 'No tienes permisos para acceder a esta sección.')
-        return redirect('home')
-    
     if request.method == 'POST':
         cliente_id = request.POST.get('cliente_id')
         
@@ -989,23 +1093,20 @@ def crear_cotizacion_para_cliente(request):
 def detalle_cotizacion(request, cotizacion_id):
     """Ver detalle de una cotización"""
     # Superusuarios, administradores y trabajadores pueden ver cualquier cotización
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
     else:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id, usuario=request.user)
     
-    detalles = cotizacion.detalles.all().select_related('producto')
+    detalles = cotizacion.detalles.all().select_related('producto', 'variante')
     
-    # Productos disponibles para agregar
-    productos_en_cotizacion = detalles.values_list('producto_id', flat=True)
+    # Productos disponibles para agregar (los con variantes se pueden agregar en otra medida)
+    productos_en_cotizacion = detalles.filter(variante__isnull=True).values_list('producto_id', flat=True)
     productos_disponibles = Producto.objects.filter(activo=True).exclude(
         id__in=productos_en_cotizacion
-    )
+    ).prefetch_related(Prefetch('variantes', queryset=VarianteProducto.objects.filter(activa=True)))
     
     # Aplicar filtros
     categoria_id = request.GET.get('categoria')
@@ -1036,15 +1137,33 @@ def detalle_cotizacion(request, cotizacion_id):
     })
 
 
+@login_required
+@require_GET
+def autocompletar_productos(request):
+    """API de autocompletado para agregar productos a una cotización (índice en memoria, ver autocompletar.py)"""
+    es_staff = request.rol.es_staff
+    resultados = []
+    # Los clientes no ven los códigos: tampoco se busca por ellos
+    encontrados = autocompletar.buscar(request.GET.get('q', ''), por_codigo=es_staff)
+    for producto_id, codigo, nombre, precio, tiene_rango, unidad in encontrados:
+        resultados.append({
+            'id': producto_id,
+            # El código solo se muestra al staff, como en las tarjetas del selector
+            'codigo': codigo if es_staff else None,
+            'nombre': nombre,
+            'precio': float(precio),
+            'desde': tiene_rango,
+            'unidad_medida': unidad,
+        })
+    return JsonResponse({'productos': resultados})
+
+
 @login_required
 @require_POST
 def agregar_producto_cotizacion(request, cotizacion_id):
     """Agregar un producto a la cotización"""
     # Verificar permisos: staff puede ver cualquier cotización, usuarios solo las suyas
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
@@ -1057,19 +1176,27 @@ def agregar_producto_cotizacion(request, cotizacion_id):
         return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
     
     producto = get_object_or_404(Producto, id=request.POST.get('producto_id'), activo=True)
+    try:
+        variante = variantes.obtener_variante(producto, request.POST.get('variante_id'))
+    except variantes.MedidaRequerida as e:
+        messages.error(request, str(e))
+        return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
+    except VarianteProducto.DoesNotExist:
+        messages.error(request, 'La medida seleccionada no está disponible.')
+        return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
     cantidad = int(request.POST.get('cantidad', 1))
     
     detalle, created = DetalleCotizacion.objects.get_or_create(
-        cotizacion=cotizacion, producto=producto,
-        defaults={'cantidad': cantidad, 'precio_unitario': producto.precio_por_unidad}
+        cotizacion=cotizacion, producto=producto, variante=variante,
+        defaults={'cantidad': cantidad, 'precio_unitario': variantes.precio(producto, variante)}
     )
     
     if not created:
         detalle.cantidad += cantidad
         detalle.save()
-        messages.info(request, f'Se actualizó la cantidad de {producto.nombre} en la cotización.')
+        messages.info(request, f'Se actualizó la cantidad de {detalle.nombre_producto} en la cotización.')
     else:
-        messages.success(request, f'{producto.nombre} agregado a la cotización.')
+        messages.success(request, f'{detalle.nombre_producto} agregado a la cotización.')
     
     return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
 
@@ -1111,6 +1238,8 @@ def eliminar_producto_cotizacion(request, detalle_id):
     
     producto_nombre = detalle.producto.nombre
     detalle.delete()
+    # Recalcula los totales (y fecha_actualizacion, que usa el ETag del PDF)
+    cotizacion.calcular_totales()
     messages.success(request, f'{producto_nombre} eliminado de la cotización.')
     
     return redirect('detalle_cotizacion', cotizacion_id=cotizacion.id)
@@ -1120,10 +1249,7 @@ def eliminar_producto_cotizacion(request, detalle_id):
 def finalizar_cotizacion(request, cotizacion_id):
     """Finalizar cotización y mostrar opciones de pago"""
     # Verificar permisos: staff puede ver cualquier cotización, usuarios solo las suyas
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
@@ -1159,10 +1285,7 @@ def finalizar_cotizacion(request, cotizacion_id):
 def seleccionar_pago(request, cotizacion_id):
     """Página para seleccionar método de pago"""
     # Verificar permisos: staff puede ver cualquier cotización, usuarios solo las suyas
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
@@ -1180,7 +1303,7 @@ def seleccionar_pago(request, cotizacion_id):
     
     return render(request, 'tienda/cotizaciones/seleccionar_pago.html', {
         'cotizacion': cotizacion,
-        'detalles': cotizacion.detalles.all().select_related('producto'),
+        'detalles': cotizacion.detalles.all().select_related('producto', 'variante'),
         'tiene_transferencia': hasattr(cotizacion, 'transferencia'),
     })
 
@@ -1200,10 +1323,7 @@ def simular_pago_exitoso(request, cotizacion_id):
     # Verificar permisos
     es_propietario = cotizacion.usuario == request.user
     es_creador = cotizacion.creado_por == request.user if cotizacion.creado_por else False
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if not (es_propietario or es_creador or es_staff):
         messages.error(request, 'No tienes permisos para realizar esta acción.')
@@ -1224,10 +1344,7 @@ def procesar_pago_mercadopago(request, cotizacion_id):
     logger.error(f"=== PROCESAR PAGO MERCADOPAGO EJECUTADO === Cotización ID: {cotizacion_id}, Usuario: {request.user.username}")
     
     # Verificar permisos: staff puede ver cualquier cotización, usuarios solo las suyas
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     logger.error(f"Es staff: {es_staff}")
     
@@ -1277,9 +1394,9 @@ def procesar_pago_mercadopago(request, cotizacion_id):
         # Crear items de la preferencia
         # Incluir los productos con sus precios sin IVA
         items = []
-        for detalle in cotizacion.detalles.all():
+        for detalle in cotizacion.detalles.all().select_related('producto', 'variante'):
             items.append({
-                "title": f"{detalle.producto.nombre} ({detalle.producto.codigo_producto})",
+                "title": f"{detalle.nombre_producto} ({detalle.codigo})",
                 "quantity": detalle.cantidad,
                 "unit_price": float(detalle.precio_unitario),
                 "currency_id": "CLP"  # Peso chileno
@@ -1452,10 +1569,7 @@ def pago_exitoso(request, cotizacion_id):
     if request.user.is_authenticated:
         es_propietario = cotizacion.usuario == request.user
         es_creador = cotizacion.creado_por == request.user if cotizacion.creado_por else False
-        es_staff = request.user.is_superuser or (
-            hasattr(request.user, 'perfil') and 
-            request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-        )
+        es_staff = request.rol.es_staff
         
         if not (es_propietario or es_creador or es_staff):
             messages.error(request, 'No tienes permisos para ver esta página.')
@@ -1493,14 +1607,14 @@ def pago_exitoso(request, cotizacion_id):
                     cotizacion.estado = 'pagada'
                     cotizacion.pago_completado = True
                     cotizacion.metodo_pago = 'mercadopago'
-                    cotizacion.save()
-                    
-                    # Enviar email de confirmación de compra
-                    try:
-                        from apps.tienda.views import enviar_confirmacion_compra
-                        enviar_confirmacion_compra(cotizacion)
-                    except Exception as e:
-                        logger.exception(f'Error al enviar confirmación de compra: {e}')
+                    with transaction.atomic():
+                        cotizacion.save()
+                        
+                        # Encolar email de confirmación de compra (misma transacción)
+                        try:
+                            enviar_confirmacion_compra(cotizacion)
+                        except Exception as e:
+                            logger.exception(f'Error al enviar confirmación de compra: {e}')
                     
                     # IMPORTANTE: Facturación automática para pagos con MercadoPago desde la página web
                     # Boleta para persona natural, factura para empresa
@@ -1531,14 +1645,14 @@ def pago_exitoso(request, cotizacion_id):
                     cotizacion.pago_completado = True
                     cotizacion.mercadopago_payment_id = str(payment_id)
                     cotizacion.metodo_pago = 'mercadopago'
-                    cotizacion.save()
-                    
-                    # Enviar email de confirmación
-                    try:
-                        from apps.tienda.views import enviar_confirmacion_compra
-                        enviar_confirmacion_compra(cotizacion)
-                    except Exception as e:
-                        logger.exception(f'Error al enviar confirmación de compra: {e}')
+                    with transaction.atomic():
+                        cotizacion.save()
+                        
+                        # Encolar email de confirmación (misma transacción)
+                        try:
+                            enviar_confirmacion_compra(cotizacion)
+                        except Exception as e:
+                            logger.exception(f'Error al enviar confirmación de compra: {e}')
                     
                     # IMPORTANTE: Facturación automática para pagos con MercadoPago desde la página web
                     # Boleta para persona natural, factura para empresa
@@ -1605,10 +1719,7 @@ def pago_fallido(request, cotizacion_id):
     if request.user.is_authenticated:
         es_propietario = cotizacion.usuario == request.user
         es_creador = cotizacion.creado_por == request.user if cotizacion.creado_por else False
-        es_staff = request.user.is_superuser or (
-            hasattr(request.user, 'perfil') and 
-            request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-        )
+        es_staff = request.rol.es_staff
         
         if not (es_propietario or es_creador or es_staff):
             messages.error(request, 'No tienes permisos para ver esta página.')
@@ -1636,10 +1747,7 @@ def pago_pendiente(request, cotizacion_id):
     if request.user.is_authenticated:
         es_propietario = cotizacion.usuario == request.user
         es_creador = cotizacion.creado_por == request.user if cotizacion.creado_por else False
-        es_staff = request.user.is_superuser or (
-            hasattr(request.user, 'perfil') and 
-            request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-        )
+        es_staff = request.rol.es_staff
     
     if not (es_propietario or es_creador or es_staff):
         messages.error(request, 'No tienes permisos para ver esta página.')
@@ -1715,20 +1823,18 @@ def pago_pendiente(request, cotizacion_id):
 
 
 @login_required
+@condicional(validadores_cotizacion_pdf)
 def descargar_cotizacion_pdf(request, cotizacion_id):
     """Generar y descargar PDF de la cotización"""
     # Verificar permisos: staff puede descargar cualquier cotizacion, usuarios solo las suyas
-    es_staff = request.user.is_superuser or request.user.is_staff or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.user.is_staff or request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
     else:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id, usuario=request.user)
     
-    detalles = cotizacion.detalles.all().select_related('producto')
+    detalles = cotizacion.detalles.all().select_related('producto', 'variante')
     
     # Crear el buffer
     buffer = BytesIO()
@@ -1833,8 +1939,8 @@ def descargar_cotizacion_pdf(request, cotizacion_id):
     
     item_num = 1
     for detalle in detalles:
-        descripcion = f"{detalle.producto.nombre}<br/>"
-        descripcion += f"Código: {detalle.producto.codigo_producto}<br/>"
+        descripcion = f"{detalle.nombre_producto}<br/>"
+        descripcion += f"Código: {detalle.codigo}<br/>"
         if detalle.producto.tipo_acero:
             descripcion += f"Material: {detalle.producto.get_tipo_acero_display()}"
         
@@ -1956,14 +2062,25 @@ def descargar_cotizacion_pdf(request, cotizacion_id):
 # SISTEMA DE TRANSFERENCIAS BANCARIAS
 # ============================================
 
+EXTENSIONES_COMPROBANTE = ['.jpg', '.jpeg', '.png', '.pdf', '.gif']
+TAMANO_MAXIMO_COMPROBANTE = 10 * 1024 * 1024  # 10MB
+
+
+def validar_comprobante(comprobante):
+    """Mensaje de error si el comprobante no es imagen/PDF o supera 10MB, None si es válido"""
+    file_extension = os.path.splitext(comprobante.name)[1].lower()
+    if file_extension not in EXTENSIONES_COMPROBANTE:
+        return f'Formato de archivo no permitido. Solo se aceptan: {", ".join(EXTENSIONES_COMPROBANTE)}'
+    if comprobante.size > TAMANO_MAXIMO_COMPROBANTE:
+        return 'El archivo es demasiado grande. El tamaño máximo es 10MB.'
+    return None
+
+
 @login_required
 def procesar_pago_transferencia(request, cotizacion_id):
     """Página para procesar pago por transferencia bancaria"""
     # Verificar permisos: staff puede ver cualquier cotización, usuarios solo las suyas
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
@@ -1986,49 +2103,47 @@ def procesar_pago_transferencia(request, cotizacion_id):
         comprobante = request.FILES.get('comprobante_pago')
         comentarios = request.POST.get('comentarios_pago', '').strip()
         
-        # Validar que se haya subido un comprobante
+        # Validar que se haya subido un comprobante (imagen o PDF de hasta 10MB)
         if not comprobante:
-            messages.error(request, 'Debes adjuntar el comprobante de transferencia.')
+            error = 'Debes adjuntar el comprobante de transferencia.'
+        else:
+            error = validar_comprobante(comprobante)
+        
+        if error:
+            messages.error(request, error)
         else:
-            # Validar tipo de archivo (solo imágenes y PDFs)
-            allowed_extensions = ['.jpg', '.jpeg', '.png', '.pdf', '.gif']
-            file_extension = os.path.splitext(comprobante.name)[1].lower()
+            # Guardar comprobante y comentarios
+            cotizacion.comprobante_pago = comprobante
+            cotizacion.comentarios_pago = comentarios
+            cotizacion.metodo_pago = 'transferencia'
+            cotizacion.estado = 'en_revision'  # En revisión hasta que el admin apruebe
+            cotizacion.pago_completado = False  # No está completado hasta que se apruebe
+            cotizacion.save()
             
-            if file_extension not in allowed_extensions:
-                messages.error(request, f'Formato de archivo no permitido. Solo se aceptan: {", ".join(allowed_extensions)}')
-            else:
-                # Validar tamaño del archivo (máximo 10MB)
-                if comprobante.size > 10 * 1024 * 1024:  # 10MB
-                    messages.error(request, 'El archivo es demasiado grande. El tamaño máximo es 10MB.')
-                else:
-                    # Guardar comprobante y comentarios
-                    cotizacion.comprobante_pago = comprobante
-                    cotizacion.comentarios_pago = comentarios
-                    cotizacion.metodo_pago = 'transferencia'
-                    cotizacion.estado = 'en_revision'  # En revisión hasta que el admin apruebe
-                    cotizacion.pago_completado = False  # No está completado hasta que se apruebe
-                    cotizacion.save()
-                    
-                    # Crear o actualizar el objeto TransferenciaBancaria
-                    transferencia, created = TransferenciaBancaria.objects.get_or_create(
-                        cotizacion=cotizacion,
-                        defaults={
-                            'monto_transferencia': cotizacion.total,
-                            'estado': 'pendiente',
-                            'comprobante': comprobante,
-                            'observaciones_cliente': comentarios,
-                        }
-                    )
-                    
-                    # Si ya existe, actualizar el comprobante y estado
-                    if not created:
-                        transferencia.comprobante = comprobante
-                        transferencia.observaciones_cliente = comentarios
-                        transferencia.estado = 'pendiente'
-                        transferencia.save()
-                    
-                    messages.info(request, 'Tu comprobante de transferencia ha sido registrado. Está pendiente de verificación por un administrador.')
-                    return redirect('pago_pendiente', cotizacion_id=cotizacion.id)
+            # La transferencia apunta al archivo ya subido (mismo storage y
+            # carpeta): asignar el nombre no vuelve a subirlo
+            archivo_subido = cotizacion.comprobante_pago.name
+            
+            # Crear o actualizar el objeto TransferenciaBancaria
+            transferencia, created = TransferenciaBancaria.objects.get_or_create(
+                cotizacion=cotizacion,
+                defaults={
+                    'monto_transferencia': cotizacion.total,
+                    'estado': 'pendiente',
+                    'comprobante': archivo_subido,
+                    'observaciones_cliente': comentarios,
+                }
+            )
+            
+            # Si ya existe, actualizar el comprobante y estado
+            if not created:
+                transferencia.comprobante = archivo_subido
+                transferencia.observaciones_cliente = comentarios
+                transferencia.estado = 'pendiente'
+                transferencia.save()
+            
+            messages.info(request, 'Tu comprobante de transferencia ha sido registrado. Está pendiente de verificación por un administrador.')
+            return redirect('pago_pendiente', cotizacion_id=cotizacion.id)
     
     # Obtener información de cuenta bancaria desde settings (o usar valores por defecto)
     cuenta_bancaria = {
@@ -2040,7 +2155,7 @@ def procesar_pago_transferencia(request, cotizacion_id):
         'email_confirmacion': getattr(settings, 'BANCO_EMAIL_CONFIRMACION', 'info@pozinox.cl'),
     }
     
-    detalles = cotizacion.detalles.all().select_related('producto')
+    detalles = cotizacion.detalles.all().select_related('producto', 'variante')
     
     context = {
         'cotizacion': cotizacion,
@@ -2054,10 +2169,7 @@ def procesar_pago_transferencia(request, cotizacion_id):
 def procesar_pago_efectivo(request, cotizacion_id):
     """Página para procesar pago en efectivo"""
     # Verificar permisos: staff puede ver cualquier cotización, usuarios solo las suyas
-    es_staff = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.rol.es_staff
     
     if es_staff:
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
@@ -2077,23 +2189,22 @@ def procesar_pago_efectivo(request, cotizacion_id):
     # Si es POST, confirmar el pago
     if request.method == 'POST':
         # Marcar como pagada (retiro en tienda con pago confirmado)
-        cotizacion.metodo_pago = 'efectivo'
-        cotizacion.estado = 'pagada'
-        cotizacion.pago_completado = True
-        cotizacion.save()
-        
-        # Enviar email de confirmación de compra
-        try:
-            enviar_confirmacion_compra(cotizacion)
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.exception(f'Error al enviar confirmación de compra: {e}')
+        with transaction.atomic():
+            cotizacion.metodo_pago = 'efectivo'
+            cotizacion.estado = 'pagada'
+            cotizacion.pago_completado = True
+            cotizacion.save()
+            
+            # Encolar email de confirmación de compra (misma transacción)
+            try:
+                enviar_confirmacion_compra(cotizacion)
+            except Exception as e:
+                logger.exception(f'Error al enviar confirmación de compra: {e}')
         
         messages.success(request, 'Pago en efectivo confirmado. Recibirás notificaciones sobre el estado de tu pedido.')
         return redirect('pago_exitoso', cotizacion_id=cotizacion.id)
     
-    detalles = cotizacion.detalles.all().select_related('producto')
+    detalles = cotizacion.detalles.all().select_related('producto', 'variante')
     
     # Información de retiro (desde settings o valores por defecto)
     info_retiro = {
@@ -2154,6 +2265,11 @@ def subir_comprobante(request, cotizacion_id):
             messages.error(request, 'Debes subir un comprobante de transferencia.')
             return redirect('subir_comprobante', cotizacion_id=cotizacion.id)
         
+        error = validar_comprobante(comprobante)
+        if error:
+            messages.error(request, error)
+            return redirect('subir_comprobante', cotizacion_id=cotizacion.id)
+        
         # Actualizar la transferencia
         transferencia.comprobante = comprobante
         transferencia.numero_transaccion = numero_transaccion
@@ -2169,21 +2285,18 @@ def subir_comprobante(request, cotizacion_id):
         
         transferencia.save()
         
-        # Notificar a los trabajadores
-        from apps.usuarios.models import Notificacion
+        # Notificar a los trabajadores (un solo INSERT para todos)
         trabajadores = User.objects.filter(
             perfil__tipo_usuario__in=['administrador', 'trabajador']
         )
-        
-        for trabajador in trabajadores:
-            Notificacion.objects.create(
-                usuario=trabajador,
-                tipo='info',
-                titulo='Nueva Transferencia para Verificar',
-                mensaje=f'Transferencia {transferencia.cotizacion.numero_cotizacion} requiere verificación.',
-                modelo_relacionado='TransferenciaBancaria',
-                objeto_id=transferencia.id
-            )
+        notificar(
+            trabajadores,
+            tipo='info',
+            titulo='Nueva Transferencia para Verificar',
+            mensaje=f'Transferencia {transferencia.cotizacion.numero_cotizacion} requiere verificación.',
+            modelo_relacionado='TransferenciaBancaria',
+            objeto_id=transferencia.id
+        )
         
         messages.success(request, 'Comprobante subido exitosamente. Será verificado en las próximas 24 horas.')
         return redirect('detalle_transferencia', cotizacion_id=cotizacion.id)
@@ -2200,20 +2313,9 @@ def subir_comprobante(request, cotizacion_id):
 # ============================================
 
 @login_required
+@staff_required
 def panel_verificacion_transferencias(request):
     """Panel para verificar transferencias bancarias"""
-    # Verificar permisos manualmente
-    if not request.user.is_authenticated:
-        return redirect('login')
-    
-    # Verificar que el usuario tenga permisos de trabajador
-    # Los superusuarios siempre tienen acceso
-    if not request.user.is_superuser:
-        # Verificar si tiene perfil y tipo de usuario válido (usa get_tipo_usuario_real para considerar superusuarios)
-        if not hasattr(request.user, 'perfil') or request.user.perfil.get_tipo_usuario_real() not in ['administrador', 'trabajador']:
-            messages.error(request, 'No tienes permisos para acceder a esta sección.')
-            return redirect('home')
-    
     transferencias = TransferenciaBancaria.objects.filter(
         estado__in=['pendiente', 'verificando']
     ).order_by('-fecha_creacion')
@@ -2236,20 +2338,9 @@ def panel_verificacion_transferencias(request):
 
 
 @login_required
+@staff_required
 def verificar_transferencia(request, transferencia_id):
     """Verificar una transferencia bancaria"""
-    # Verificar permisos manualmente
-    if not request.user.is_authenticated:
-        return redirect('login')
-    
-    # Verificar que el usuario tenga permisos de trabajador
-    # Los superusuarios siempre tienen acceso
-    if not request.user.is_superuser:
-        # Verificar si tiene perfil y tipo de usuario válido (usa get_tipo_usuario_real para considerar superusuarios)
-        if not hasattr(request.user, 'perfil') or request.user.perfil.get_tipo_usuario_real() not in ['administrador', 'trabajador']:
-            messages.error(request, 'No tienes permisos para acceder a esta sección.')
-            return redirect('home')
-    
     transferencia = get_object_or_404(TransferenciaBancaria, id=transferencia_id)
     
     if request.method == 'POST':
@@ -2261,9 +2352,8 @@ def verificar_transferencia(request, transferencia_id):
             messages.success(request, 'Transferencia aprobada exitosamente.')
             
             # Notificar al cliente
-            from apps.usuarios.models import Notificacion
-            Notificacion.objects.create(
-                usuario=transferencia.cotizacion.usuario,
+            notificar(
+                transferencia.cotizacion.usuario,
                 tipo='success',
                 titulo='Transferencia Aprobada',
                 mensaje=f'Tu transferencia para la cotización {transferencia.cotizacion.numero_cotizacion} ha sido aprobada.',
@@ -2276,9 +2366,8 @@ def verificar_transferencia(request, transferencia_id):
             messages.success(request, 'Transferencia rechazada.')
             
             # Notificar al cliente
-            from apps.usuarios.models import Notificacion
-            Notificacion.objects.create(
-                usuario=transferencia.cotizacion.usuario,
+            notificar(
+                transferencia.cotizacion.usuario,
                 tipo='error',
                 titulo='Transferencia Rechazada',
                 mensaje=f'Tu transferencia para la cotización {transferencia.cotizacion.numero_cotizacion} ha sido rechazada. Motivo: {observaciones}',
@@ -2316,12 +2405,7 @@ def terminos_condiciones(request):
 def gestionar_estados_preparacion(request):
     """Vista para que los trabajadores gestionen los estados de preparación de cotizaciones pagadas"""
     # Verificar que el usuario sea trabajador, administrador o superusuario
-    tiene_permiso = request.user.is_superuser or request.user.is_staff
-    
-    # También verificar el tipo de usuario en el perfil
-    if not tiene_permiso and hasattr(request.user, 'perfil'):
-        tipo_usuario = request.user.perfil.get_tipo_usuario_real()
-        tiene_permiso = tipo_usuario in ['administrador', 'trabajador']
+    tiene_permiso = request.user.is_staff or request.rol.es_staff
     
     if not tiene_permiso:
         messages.error(request, 'No tienes permisos para acceder a esta sección.')
@@ -2356,12 +2440,7 @@ def gestionar_estados_preparacion(request):
 def cambiar_estado_preparacion(request, cotizacion_id):
     """Vista para cambiar el estado de preparación de una cotización"""
     # Verificar que el usuario sea trabajador, administrador o superusuario
-    tiene_permiso = request.user.is_superuser or request.user.is_staff
-    
-    # También verificar el tipo de usuario en el perfil
-    if not tiene_permiso and hasattr(request.user, 'perfil'):
-        tipo_usuario = request.user.perfil.get_tipo_usuario_real()
-        tiene_permiso = tipo_usuario in ['administrador', 'trabajador']
+    tiene_permiso = request.user.is_staff or request.rol.es_staff
     
     if not tiene_permiso:
         messages.error(request, 'No tienes permisos para realizar esta acción.')
@@ -2380,19 +2459,19 @@ def cambiar_estado_preparacion(request, cotizacion_id):
         # Guardar el estado anterior para comparar
         estado_anterior = cotizacion.estado_preparacion
         
-        # Actualizar el estado
-        cotizacion.estado_preparacion = nuevo_estado
-        cotizacion.save()
-        
         # Obtener el nombre legible del estado
         nombre_estado = dict(Cotizacion.ESTADOS_PREPARACION)[nuevo_estado]
         
-        # Enviar notificación por email al cliente
-        try:
-            enviar_notificacion_cambio_estado(cotizacion, nombre_estado)
-            messages.success(request, f'Estado actualizado a "{nombre_estado}" y notificación enviada al cliente.')
-        except Exception as e:
-            messages.warning(request, f'Estado actualizado pero hubo un error al enviar la notificación: {str(e)}')
+        # Actualizar el estado y encolar la notificación en la misma transacción
+        with transaction.atomic():
+            cotizacion.estado_preparacion = nuevo_estado
+            cotizacion.save()
+            
+            try:
+                enviar_notificacion_cambio_estado(cotizacion, nombre_estado)
+                messages.success(request, f'Estado actualizado a "{nombre_estado}" y notificación enviada al cliente.')
+            except Exception as e:
+                messages.warning(request, f'Estado actualizado pero hubo un error al enviar la notificación: {str(e)}')
         
         return redirect('gestionar_estados_preparacion')
     
@@ -2401,7 +2480,6 @@ def cambiar_estado_preparacion(request, cotizacion_id):
 
 def enviar_notificacion_cambio_estado(cotizacion, nombre_estado):
     """Envía un email al cliente notificando el cambio de estado de su cotización"""
-    from django.core.mail import send_mail
     from django.template.loader import render_to_string
     from django.utils.html import strip_tags
     
@@ -2426,19 +2504,16 @@ def enviar_notificacion_cambio_estado(cotizacion, nombre_estado):
     asunto = asuntos.get(cotizacion.estado_preparacion, f'Actualización de tu pedido #{cotizacion.numero_cotizacion}')
     
     # Enviar el email
-    send_mail(
-        subject=asunto,
-        message=plain_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[cotizacion.usuario.email],
-        html_message=html_message,
-        fail_silently=False,
+    encolar_correo(
+        asunto=asunto,
+        destinatarios=[cotizacion.usuario.email],
+        texto=plain_message,
+        html=html_message,
     )
 
 
 def enviar_confirmacion_compra(cotizacion):
     """Envía un email de confirmación de compra cuando la cotización es pagada"""
-    from django.core.mail import send_mail
     from django.template.loader import render_to_string
     from django.utils.html import strip_tags
     
@@ -2446,7 +2521,7 @@ def enviar_confirmacion_compra(cotizacion):
     context = {
         'cotizacion': cotizacion,
         'cliente_nombre': cotizacion.usuario.get_full_name() or cotizacion.usuario.username,
-        'detalles': cotizacion.detalles.all().select_related('producto'),
+        'detalles': cotizacion.detalles.all().select_related('producto', 'variante'),
     }
     
     # Renderizar el template del email
@@ -2454,13 +2529,11 @@ def enviar_confirmacion_compra(cotizacion):
     plain_message = strip_tags(html_message)
     
     # Enviar el email
-    send_mail(
-        subject=f'Confirmación de Compra - Orden #{cotizacion.numero_cotizacion}',
-        message=plain_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[cotizacion.usuario.email],
-        html_message=html_message,
-        fail_silently=False,
+    encolar_correo(
+        asunto=f'Confirmación de Compra - Orden #{cotizacion.numero_cotizacion}',
+        destinatarios=[cotizacion.usuario.email],
+        texto=plain_message,
+        html=html_message,
     )
 
 
@@ -2469,18 +2542,9 @@ def enviar_confirmacion_compra(cotizacion):
 # ============================================
 
 @login_required
+@staff_required
 def gestionar_facturacion(request):
     """Vista para que trabajadores/admins gestionen la facturación de cotizaciones pagadas"""
-    # Verificar permisos
-    tiene_permiso = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
-    
-    if not tiene_permiso:
-        messages.error(request, 'No tienes permisos para acceder a esta sección.')
-        return redirect('home')
-    
     # Obtener cotizaciones pagadas
     cotizaciones = Cotizacion.objects.filter(
         estado='pagada'
@@ -2519,6 +2583,23 @@ def gestionar_facturacion(request):
             Q(numero_documento__icontains=busqueda)
         )
     
+    formato = formato_solicitado(request)
+    if formato:
+        tipos_documento = dict(Cotizacion.TIPOS_DOCUMENTO)
+        return exportar_queryset(cotizaciones, [
+            ('numero_cotizacion', 'Número Cotización'),
+            ('fecha_creacion', 'Fecha'),
+            ('usuario_nombre', 'Cliente'),
+            ('usuario__perfil__rut', 'RUT'),
+            ('usuario__perfil__tipo_cliente', 'Tipo Cliente'),
+            ('total', 'Total'),
+            ('facturada', 'Facturada'),
+            ('tipo_documento', 'Tipo Documento', lambda v: tipos_documento.get(v, v)),
+            ('numero_documento', 'Número Documento'),
+            ('fecha_facturacion', 'Fecha Facturación'),
+            ('facturado_por__username', 'Facturado por'),
+        ], 'facturacion', formato)
+    
     # Paginación
     paginator = Paginator(cotizaciones, 20)
     page_number = request.GET.get('page')
@@ -2546,18 +2627,9 @@ def gestionar_facturacion(request):
 
 
 @login_required
+@staff_required(mensaje='No tienes permisos para realizar esta acción.')
 def generar_documento_electronico(request, cotizacion_id):
     """Vista para generar boleta o factura electrónica"""
-    # Verificar permisos
-    tiene_permiso = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
-    
-    if not tiene_permiso:
-        messages.error(request, 'No tienes permisos para realizar esta acción.')
-        return redirect('home')
-    
     cotizacion = get_object_or_404(
         Cotizacion.objects.select_related('usuario', 'usuario__perfil'),
         id=cotizacion_id,
@@ -2618,17 +2690,8 @@ def generar_documento_electronico(request, cotizacion_id):
             cotizacion.folio_sii = cotizacion.numero_documento
             cotizacion.estado_sii = 'PENDIENTE_ENVIO'
             
-            # Descontar stock de productos
-            detalles = cotizacion.detalles.all().select_related('producto')
-            productos_sin_stock = []
-            
-            for detalle in detalles:
-                producto = detalle.producto
-                if producto.stock_actual >= detalle.cantidad:
-                    producto.stock_actual -= detalle.cantidad
-                    producto.save()
-                else:
-                    productos_sin_stock.append(f'{producto.nombre} (disponible: {producto.stock_actual}, necesario: {detalle.cantidad})')
+            # Descontar stock de productos (o de sus variantes)
+            productos_sin_stock = variantes.descontar_stock(cotizacion)
             
             if productos_sin_stock:
                 messages.warning(
@@ -2781,17 +2844,8 @@ def facturar_cotizacion_automaticamente(cotizacion, usuario_que_factura=None):
         cotizacion.folio_sii = cotizacion.numero_documento
         cotizacion.estado_sii = 'PENDIENTE_ENVIO'
         
-        # Descontar stock de productos
-        detalles = cotizacion.detalles.all().select_related('producto')
-        productos_sin_stock = []
-        
-        for detalle in detalles:
-            producto = detalle.producto
-            if producto.stock_actual >= detalle.cantidad:
-                producto.stock_actual -= detalle.cantidad
-                producto.save()
-            else:
-                productos_sin_stock.append(f'{producto.nombre} (disponible: {producto.stock_actual}, necesario: {detalle.cantidad})')
+        # Descontar stock de productos (o de sus variantes)
+        productos_sin_stock = variantes.descontar_stock(cotizacion)
         
         if productos_sin_stock:
             logger.warning(f'Cotización {cotizacion.id}: Algunos productos no tenían stock suficiente: {", ".join(productos_sin_stock)}')
@@ -2825,7 +2879,7 @@ def facturar_cotizacion_automaticamente(cotizacion, usuario_que_factura=None):
 
 def generar_pdf_documento_tributario(cotizacion):
     """Generar PDF del documento tributario (Boleta o Factura) - Función reutilizable"""
-    detalles = cotizacion.detalles.all().select_related('producto')
+    detalles = cotizacion.detalles.all().select_related('producto', 'variante')
     cliente = cotizacion.usuario
     
     # Obtener perfil del cliente para datos adicionales
@@ -2967,8 +3021,8 @@ def generar_pdf_documento_tributario(cotizacion):
     for idx, detalle in enumerate(detalles, 1):
         table_data.append([
             str(idx),
-            Paragraph(detalle.producto.nombre, normal_style),
-            detalle.producto.codigo_producto,
+            Paragraph(detalle.nombre_producto, normal_style),
+            detalle.codigo,
             str(detalle.cantidad),
             f'${detalle.precio_unitario:,.0f}',
             f'${detalle.subtotal:,.0f}'
@@ -3066,15 +3120,13 @@ def generar_pdf_documento_tributario(cotizacion):
     return pdf
 
 @login_required
+@condicional(validadores_documento_tributario)
 def descargar_documento_tributario(request, cotizacion_id):
     """Descargar PDF del documento tributario (Boleta o Factura)"""
     cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id, facturada=True)
     
     # Verificar permisos: staff puede descargar cualquier documento, usuarios solo los suyos
-    es_staff = request.user.is_superuser or request.user.is_staff or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
+    es_staff = request.user.is_staff or request.rol.es_staff
     
     if not es_staff and cotizacion.usuario != request.user:
         messages.error(request, 'No tienes permisos para descargar este documento.')
@@ -3109,7 +3161,6 @@ def descargar_documento_tributario(request, cotizacion_id):
 
 def enviar_notificacion_facturacion(cotizacion, tipo_documento):
     """Enviar email al cliente notificando la generación del documento con PDF adjunto"""
-    from django.core.mail import EmailMultiAlternatives
     from django.template.loader import render_to_string
     from django.utils.html import strip_tags
     
@@ -3126,30 +3177,26 @@ def enviar_notificacion_facturacion(cotizacion, tipo_documento):
     html_message = render_to_string('tienda/emails/notificacion_facturacion.html', context)
     plain_message = strip_tags(html_message)
     
-    # Crear email con EmailMultiAlternatives para poder adjuntar archivos
-    email = EmailMultiAlternatives(
-        subject=f'📄 {tipo_doc_texto} N° {cotizacion.numero_documento} - Pozinox',
-        body=plain_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[cotizacion.usuario.email],
-    )
-    
-    # Adjuntar HTML
-    email.attach_alternative(html_message, "text/html")
-    
     # Generar y adjuntar PDF del documento tributario
+    adjuntos = []
     try:
         pdf_content = generar_pdf_documento_tributario(cotizacion)
         tipo_doc_filename = 'boleta' if cotizacion.tipo_documento == 'boleta' else 'factura'
         filename = f'{tipo_doc_filename}_{cotizacion.numero_documento or cotizacion.numero_cotizacion}.pdf'
         
-        email.attach(filename, pdf_content, 'application/pdf')
+        adjuntos.append((filename, pdf_content, 'application/pdf'))
     except Exception as e:
         logger.exception(f'Error al adjuntar PDF al email: {e}')
         # Continuar enviando el email sin adjunto si hay error
     
-    # Enviar email
-    email.send(fail_silently=False)
+    # Encolar email en la bandeja de salida
+    encolar_correo(
+        asunto=f'📄 {tipo_doc_texto} N° {cotizacion.numero_documento} - Pozinox',
+        destinatarios=[cotizacion.usuario.email],
+        texto=plain_message,
+        html=html_message,
+        adjuntos=adjuntos,
+    )
 
 
 # ==========================================
@@ -3157,18 +3204,9 @@ def enviar_notificacion_facturacion(cotizacion, tipo_documento):
 # ==========================================
 
 @login_required
+@admin_required
 def gestionar_recepciones(request):
     """Vista para gestionar recepciones de compras - Solo administradores"""
-    # Verificar que sea administrador o superusuario
-    es_admin = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario == 'administrador'
-    )
-    
-    if not es_admin:
-        messages.error(request, 'No tienes permisos para acceder a esta sección.')
-        return redirect('home')
-    
     # Obtener todas las recepciones
     recepciones = RecepcionCompra.objects.all().select_related('creado_por', 'confirmado_por').order_by('-fecha_creacion')
     
@@ -3210,17 +3248,9 @@ def gestionar_recepciones(request):
 
 
 @login_required
+@admin_required(mensaje='No tienes permisos para realizar esta acción.')
 def crear_recepcion(request):
     """Crear nueva recepción de compra"""
-    es_admin = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario == 'administrador'
-    )
-    
-    if not es_admin:
-        messages.error(request, 'No tienes permisos para realizar esta acción.')
-        return redirect('home')
-    
     if request.method == 'POST':
         proveedor = request.POST.get('proveedor')
         numero_factura = request.POST.get('numero_factura', '')
@@ -3248,17 +3278,9 @@ def crear_recepcion(request):
 
 
 @login_required
+@admin_required(mensaje='No tienes permisos para realizar esta acción.')
 def editar_recepcion(request, recepcion_id):
     """Editar recepción y agregar productos"""
-    es_admin = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario == 'administrador'
-    )
-    
-    if not es_admin:
-        messages.error(request, 'No tienes permisos para realizar esta acción.')
-        return redirect('home')
-    
     recepcion = get_object_or_404(RecepcionCompra, id=recepcion_id)
     
     if recepcion.estado == 'confirmada':
@@ -3286,23 +3308,34 @@ def editar_recepcion(request, recepcion_id):
             
             if producto_id and cantidad:
                 producto = get_object_or_404(Producto, id=producto_id)
+                try:
+                    variante = variantes.obtener_variante(producto, request.POST.get('variante_id'))
+                except variantes.MedidaRequerida as e:
+                    messages.error(request, str(e))
+                    return redirect('editar_recepcion', recepcion_id=recepcion.id)
+                except (VarianteProducto.DoesNotExist, ValueError):
+                    messages.error(request, 'La medida seleccionada no corresponde al producto.')
+                    return redirect('editar_recepcion', recepcion_id=recepcion.id)
                 DetalleRecepcionCompra.objects.create(
                     recepcion=recepcion,
                     producto=producto,
+                    variante=variante,
                     cantidad=int(cantidad),
                     precio_compra=precio_compra if precio_compra else None,
                     lote=lote,
                     observaciones=observaciones_detalle
                 )
-                messages.success(request, f'✅ Producto {producto.nombre} agregado.')
+                messages.success(request, f'✅ Producto {producto.nombre}{f" ({variante.medida})" if variante else ""} agregado.')
             else:
                 messages.error(request, 'Debe seleccionar un producto y especificar la cantidad.')
         
         return redirect('editar_recepcion', recepcion_id=recepcion.id)
     
     # GET - Mostrar formulario
-    productos = Producto.objects.filter(activo=True).order_by('nombre')
-    detalles = recepcion.detalles.all().select_related('producto')
+    productos = Producto.objects.filter(activo=True).order_by('nombre').prefetch_related(
+        Prefetch('variantes', queryset=VarianteProducto.objects.filter(activa=True))
+    )
+    detalles = recepcion.detalles.all().select_related('producto', 'variante')
     
     context = {
         'recepcion': recepcion,
@@ -3314,17 +3347,9 @@ def editar_recepcion(request, recepcion_id):
 
 
 @login_required
+@admin_required(mensaje='No tienes permisos para realizar esta acción.')
 def eliminar_detalle_recepcion(request, detalle_id):
     """Eliminar un producto de la recepción"""
-    es_admin = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario == 'administrador'
-    )
-    
-    if not es_admin:
-        messages.error(request, 'No tienes permisos para realizar esta acción.')
-        return redirect('home')
-    
     detalle = get_object_or_404(DetalleRecepcionCompra, id=detalle_id)
     recepcion = detalle.recepcion
     
@@ -3340,17 +3365,9 @@ def eliminar_detalle_recepcion(request, detalle_id):
 
 
 @login_required
+@admin_required(mensaje='No tienes permisos para realizar esta acción.')
 def confirmar_recepcion(request, recepcion_id):
     """Confirmar recepción y actualizar stock"""
-    es_admin = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario == 'administrador'
-    )
-    
-    if not es_admin:
-        messages.error(request, 'No tienes permisos para realizar esta acción.')
-        return redirect('home')
-    
     recepcion = get_object_or_404(RecepcionCompra, id=recepcion_id)
     
     if recepcion.estado == 'confirmada':
@@ -3362,7 +3379,12 @@ def confirmar_recepcion(request, recepcion_id):
         return redirect('editar_recepcion', recepcion_id=recepcion.id)
     
     if request.method == 'POST':
-        if recepcion.confirmar(request.user):
+        try:
+            confirmada = recepcion.confirmar(request.user)
+        except variantes.MedidaRequerida as e:
+            messages.error(request, f'{e} Elimina la línea y agrégala con su medida.')
+            return redirect('editar_recepcion', recepcion_id=recepcion.id)
+        if confirmada:
             messages.success(request, f'✅ Recepción {recepcion.numero_recepcion} confirmada. Stock actualizado.')
         else:
             messages.error(request, 'Error al confirmar la recepción.')
@@ -3370,7 +3392,7 @@ def confirmar_recepcion(request, recepcion_id):
         return redirect('detalle_recepcion', recepcion_id=recepcion.id)
     
     # GET - Mostrar confirmación
-    detalles = recepcion.detalles.all().select_related('producto')
+    detalles = recepcion.detalles.all().select_related('producto', 'variante')
     context = {
         'recepcion': recepcion,
         'detalles': detalles,
@@ -3379,19 +3401,11 @@ def confirmar_recepcion(request, recepcion_id):
 
 
 @login_required
+@admin_required
 def detalle_recepcion(request, recepcion_id):
     """Ver detalle de una recepción"""
-    es_admin = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario == 'administrador'
-    )
-    
-    if not es_admin:
-        messages.error(request, 'No tienes permisos para acceder a esta sección.')
-        return redirect('home')
-    
     recepcion = get_object_or_404(RecepcionCompra, id=recepcion_id)
-    detalles = recepcion.detalles.all().select_related('producto')
+    detalles = recepcion.detalles.all().select_related('producto', 'variante')
     
     context = {
         'recepcion': recepcion,
@@ -3405,6 +3419,72 @@ def detalle_recepcion(request, recepcion_id):
 # VENTAS N8N - BOT DE VENTAS
 # ============================================
 
+def _id_producto(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def resolver_productos_n8n(venta):
+    """
+    Asocia cada item de la venta n8n con su Producto: primero por id, luego por
+    SKU y si no existe se crea uno genérico. Usa un número fijo de consultas
+    sin importar la cantidad de items. Retorna una lista de (item, producto).
+    """
+    from decimal import Decimal
+    
+    metadata = venta.metadata or {}
+    claves = []
+    for item in venta.items:
+        producto_id = _id_producto(item.get('id') or metadata.get('product_id'))
+        sku = item.get('sku') or metadata.get('sku')
+        claves.append((item, producto_id, sku))
+    
+    por_id = Producto.objects.filter(activo=True).in_bulk(
+        {producto_id for _, producto_id, _ in claves if producto_id}
+    )
+    por_sku = Producto.objects.filter(activo=True).in_bulk(
+        {sku for _, _, sku in claves if sku}, field_name='codigo_producto'
+    )
+    
+    resueltos = []
+    faltantes = {}  # codigo_producto -> Producto genérico por crear
+    for item, producto_id, sku in claves:
+        producto = por_id.get(producto_id) or por_sku.get(sku)
+        if producto is None:
+            codigo_producto = sku or f"N8N-{venta.id}-{len(resueltos)}"
+            faltantes.setdefault(codigo_producto, Producto(
+                codigo_producto=codigo_producto,
+                nombre=item.get('title', 'Producto sin nombre')[:200],
+                descripcion=item.get('description', '')[:500],
+                tipo_acero='304',
+                precio_por_unidad=Decimal(str(item.get('unit_price', 0))),
+                stock_actual=0,
+                activo=True,
+            ))
+            producto = codigo_producto
+        resueltos.append((item, producto))
+    
+    if faltantes:
+        categoria_default = CategoriaAcero.objects.first()
+        if not categoria_default:
+            logger.warning(f'No se encontró categoría para crear productos de la venta n8n {venta.id}')
+            return [(item, producto) for item, producto in resueltos if not isinstance(producto, str)]
+        for producto in faltantes.values():
+            producto.categoria = categoria_default
+        # Un código puede existir ya (inactivo o creado por otra venta): se conserva ese producto
+        Producto.objects.bulk_create(faltantes.values(), ignore_conflicts=True)
+        catalogo.incrementar_version()
+        creados = Producto.objects.in_bulk(list(faltantes), field_name='codigo_producto')
+        resueltos = [
+            (item, creados[producto] if isinstance(producto, str) else producto)
+            for item, producto in resueltos
+        ]
+    
+    return resueltos
+
+
 def crear_cotizacion_desde_venta_n8n(venta):
     """
     Crea una nueva cotización pagada desde una venta de n8n
@@ -3466,84 +3546,59 @@ def crear_cotizacion_desde_venta_n8n(venta):
     subtotal_sin_iva = (total_con_iva / Decimal('1.19')).quantize(Decimal('0.01'))
     iva_calculado = (subtotal_sin_iva * Decimal('0.19')).quantize(Decimal('0.01'))
     
-    # Crear la cotización con los totales correctos (solo para ventas n8n)
-    cotizacion = Cotizacion.objects.create(
-        usuario=usuario,
-        estado='pagada',
-        metodo_pago='mercadopago',
-        pago_completado=True,
-        mercadopago_preference_id=venta.mercadopago_preference_id,
-        mercadopago_payment_id=venta.mercadopago_payment_id or '',
-        subtotal=subtotal_sin_iva,  # Subtotal sin IVA
-        iva=iva_calculado,  # IVA calculado correctamente
-        total=total_con_iva,  # Total original de MercadoPago (ya incluye IVA)
-        fecha_finalizacion=timezone.now(),
-    )
+    # Cotización y detalles en una transacción: no queda una cotización sin líneas
+    with transaction.atomic():
+        # Crear la cotización con los totales correctos (solo para ventas n8n)
+        cotizacion = Cotizacion.objects.create(
+            usuario=usuario,
+            estado='pagada',
+            metodo_pago='mercadopago',
+            pago_completado=True,
+            mercadopago_preference_id=venta.mercadopago_preference_id,
+            mercadopago_payment_id=venta.mercadopago_payment_id or '',
+            subtotal=subtotal_sin_iva,  # Subtotal sin IVA
+            iva=iva_calculado,  # IVA calculado correctamente
+            total=total_con_iva,  # Total original de MercadoPago (ya incluye IVA)
+            fecha_finalizacion=timezone.now(),
+        )
     
-    # Crear detalles de cotización basándose en los items
-    for item in venta.items:
-        producto_id = item.get('id') or (venta.metadata.get('product_id') if venta.metadata else None)
-        sku = item.get('sku') or (venta.metadata.get('sku') if venta.metadata else None)
-        
-        producto = None
-        
-        # Intentar buscar el producto por ID o SKU
-        if producto_id:
-            try:
-                producto = Producto.objects.get(id=producto_id, activo=True)
-            except Producto.DoesNotExist:
-                pass
-        
-        if not producto and sku:
-            try:
-                producto = Producto.objects.get(codigo_producto=sku, activo=True)
-            except Producto.DoesNotExist:
-                pass
-        
-        # Si no encontramos el producto, crear uno genérico
-        if not producto:
-            categoria_default = CategoriaAcero.objects.first()
-            if not categoria_default:
-                logger.warning(f'No se encontró categoría para crear producto de item: {item.get("title")}')
-                continue
-            
-            codigo_producto = sku or f"N8N-{venta.id}-{len(cotizacion.detalles.all())}"
-            producto, created = Producto.objects.get_or_create(
-                codigo_producto=codigo_producto,
-                defaults={
-                    'nombre': item.get('title', 'Producto sin nombre')[:200],
-                    'descripcion': item.get('description', '')[:500],
-                    'categoria': categoria_default,
-                    'tipo_acero': '304',
-                    'precio_por_unidad': Decimal(str(item.get('unit_price', 0))),
-                    'stock_actual': 0,
-                    'activo': True,
-                }
-            )
-        
-        # Crear detalle de cotización
+        # Crear detalles de cotización basándose en los items.
+        # bulk_create no llama a DetalleCotizacion.save(), que recalcularía los
+        # totales con calcular_totales() en cada línea y pisaría los de n8n.
         # IMPORTANTE: Para ventas n8n, el precio unitario de MercadoPago ya incluye IVA
         # Calcular precio sin IVA: precio_con_iva / 1.19
-        cantidad = item.get('quantity', 1)
-        precio_unitario_con_iva = Decimal(str(item.get('unit_price', 0)))
-        precio_unitario_sin_iva = (precio_unitario_con_iva / Decimal('1.19')).quantize(Decimal('0.01'))
-        
-        DetalleCotizacion.objects.create(
-            cotizacion=cotizacion,
-            producto=producto,
-            cantidad=cantidad,
-            precio_unitario=precio_unitario_sin_iva,  # Precio sin IVA (solo para n8n)
-        )
+        detalles = {}
+        for item, producto in resolver_productos_n8n(venta):
+            cantidad = _cantidad_n8n(item.get('quantity', 1))
+            precio_unitario_con_iva = Decimal(str(item.get('unit_price', 0)))
+            precio_unitario_sin_iva = (precio_unitario_con_iva / Decimal('1.19')).quantize(Decimal('0.01'))
+        
+            detalle = detalles.get(producto.pk)
+            if detalle is None:
+                detalles[producto.pk] = DetalleCotizacion(
+                    cotizacion=cotizacion,
+                    producto=producto,
+                    cantidad=cantidad,
+                    precio_unitario=precio_unitario_sin_iva,  # Precio sin IVA (solo para n8n)
+                    subtotal=precio_unitario_sin_iva * cantidad,
+                )
+            else:
+                # Un producto solo puede aparecer una vez por cotización: se suman las líneas
+                detalle.cantidad += cantidad
+                detalle.subtotal += precio_unitario_sin_iva * cantidad
+                detalle.precio_unitario = (detalle.subtotal / detalle.cantidad).quantize(Decimal('0.01'))
     
-    # NO recalcular totales con calcular_totales() porque ya están calculados correctamente
-    # calcular_totales() agregaría otro IVA encima, duplicando el IVA
-    # Los totales ya están establecidos correctamente arriba
+        DetalleCotizacion.objects.bulk_create(detalles.values())
     
-    # Asociar la cotización con la venta
-    if not venta.metadata:
-        venta.metadata = {}
-    venta.metadata['cotizacion_id'] = cotizacion.id
-    venta.save()
+        # NO recalcular totales con calcular_totales() porque ya están calculados correctamente
+        # calcular_totales() agregaría otro IVA encima, duplicando el IVA
+        # Los totales ya están establecidos correctamente arriba
+    
+        # Asociar la cotización con la venta
+        if not venta.metadata:
+            venta.metadata = {}
+        venta.metadata['cotizacion_id'] = cotizacion.id
+        venta.save()
     
     # Enviar email de confirmación
     try:
@@ -3570,39 +3625,152 @@ def crear_cotizacion_desde_venta_n8n(venta):
     return cotizacion
 
 
+@require_GET
+def api_catalogo(request):
+    """
+    Catálogo y stock en JSON para el bot de n8n (solo lectura).
+    
+    Parámetros GET:
+    - campos: lista separada por comas (ver catalogo.CAMPOS_API)
+    - categoria: id o nombre; tipo_acero
+    - skus: hasta 500 códigos separados por comas (sin paginar)
+    - pagina, por_pagina (máx. 1000)
+    
+    La respuesta lleva un ETag fuerte según la versión del catálogo; si el
+    cliente envía el mismo en If-None-Match se responde 304 sin consultar la
+    base de datos.
+    """
+    try:
+        parametros = catalogo.parametros_consulta(request.GET)
+    except catalogo.ParametroInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    # La versión se lee antes de consultar: si cambia durante la consulta, la
+    # respuesta queda guardada con la versión anterior y no se vuelve a usar
+    version = catalogo.version_catalogo()
+    etiqueta = catalogo.etag(version, parametros)
+    
+    if etiqueta in parse_etags(request.headers.get('If-None-Match', '')):
+        respuesta = HttpResponse(status=304)
+    else:
+        clave = catalogo.clave_respuesta(etiqueta)
+        contenido = cache.get(clave)
+        if contenido is None:
+            datos = catalogo.consultar_productos(parametros)
+            datos['version'] = version
+            contenido = JsonResponse(datos).content
+            cache.set(clave, contenido, catalogo.DURACION_RESPUESTA)
+        respuesta = HttpResponse(contenido, content_type='application/json')
+    
+    respuesta['ETag'] = etiqueta
+    respuesta['Cache-Control'] = 'no-cache'
+    return respuesta
+
+
+@require_GET
+def api_cambios(request, recurso):
+    """
+    Feed de cambios de cotizaciones, ventas n8n, productos o transferencias
+    (ver cambios.py). Parámetros GET: cursor (el devuelto por la consulta
+    anterior; vacío para empezar desde el inicio) y limite (máx. 1000).
+    """
+    if not cambios.autorizado(request):
+        return JsonResponse({'error': 'No autorizado'}, status=401)
+    if recurso not in cambios.RECURSOS:
+        return JsonResponse({'error': f'Recurso desconocido. Opciones: {", ".join(cambios.RECURSOS)}'}, status=404)
+    
+    try:
+        limite = int(request.GET.get('limite', cambios.LIMITE))
+    except ValueError:
+        limite = 0
+    if not 1 <= limite <= cambios.MAX_LIMITE:
+        return JsonResponse({'error': f'limite debe estar entre 1 y {cambios.MAX_LIMITE}'}, status=400)
+    
+    try:
+        datos = cambios.cambios(recurso, request.GET.get('cursor'), limite)
+    except cambios.CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(datos)
+
+
+MAX_VENTAS_LOTE_N8N = 500
+
+
+def _cantidad_n8n(valor):
+    """Cantidad de un item de n8n: entero positivo (acepta 2, 2.0 o "2"). Lanza ValueError"""
+    try:
+        cantidad = Decimal(str(valor))
+    except InvalidOperation:
+        raise ValueError(f'quantity no es un número: {valor!r}')
+    if not cantidad.is_finite() or cantidad != cantidad.to_integral_value() or cantidad <= 0:
+        raise ValueError(f'quantity debe ser un entero mayor a 0: {valor!r}')
+    return int(cantidad)
+
+
+def _datos_venta_n8n(data):
+    """
+    Valida una venta enviada por n8n. Retorna (datos, None) con los campos de
+    VentaN8n o (None, mensaje_de_error).
+    """
+    if not isinstance(data, dict):
+        return None, 'La venta debe ser un objeto JSON'
+    
+    preference_id = data.get('preference_id')
+    email_comprador = data.get('email_comprador') or (data.get('payer') or {}).get('email')
+    items = data.get('items', [])
+    metadata = data.get('metadata', {})
+    
+    if not preference_id:
+        return None, 'preference_id es requerido'
+    if not email_comprador:
+        return None, 'email_comprador es requerido'
+    if not items:
+        return None, 'items es requerido'
+    
+    # Calcular totales (en Decimal: n8n puede enviar "2.0" o 1990.5)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return None, 'items debe ser una lista de objetos con unit_price y quantity numéricos'
+    subtotal = Decimal('0')
+    for item in items:
+        try:
+            cantidad = _cantidad_n8n(item.get('quantity', 1))
+            precio = Decimal(str(item.get('unit_price', 0)))
+        except ValueError as e:
+            return None, str(e)
+        except InvalidOperation:
+            return None, f'unit_price no es un número: {item.get("unit_price")!r}'
+        if not precio.is_finite() or precio < 0:
+            return None, f'unit_price debe ser un número no negativo: {item.get("unit_price")!r}'
+        subtotal += precio * cantidad
+    total = subtotal  # Puedes agregar IVA si es necesario
+    
+    return {
+        'mercadopago_preference_id': str(preference_id),
+        'email_comprador': email_comprador,
+        'items': items,
+        'metadata': metadata,
+        'subtotal': subtotal,
+        'total': total,
+    }, None
+
+
 @require_POST
+@idempotente
 def api_crear_venta_n8n(request):
     """API endpoint para que n8n registre una venta cuando crea una preferencia de MercadoPago"""
     try:
         data = json.loads(request.body)
         
         # Validar datos requeridos
-        preference_id = data.get('preference_id')
-        email_comprador = data.get('email_comprador') or data.get('payer', {}).get('email')
-        items = data.get('items', [])
-        metadata = data.get('metadata', {})
-        
-        if not preference_id:
-            return JsonResponse({'error': 'preference_id es requerido'}, status=400)
-        if not email_comprador:
-            return JsonResponse({'error': 'email_comprador es requerido'}, status=400)
-        if not items:
-            return JsonResponse({'error': 'items es requerido'}, status=400)
-        
-        # Calcular totales
-        subtotal = sum(item.get('unit_price', 0) * item.get('quantity', 0) for item in items)
-        total = subtotal  # Puedes agregar IVA si es necesario
+        datos, error = _datos_venta_n8n(data)
+        if error:
+            return JsonResponse({'error': error}, status=400)
         
         # Crear o actualizar venta
+        preference_id = datos.pop('mercadopago_preference_id')
         venta, created = VentaN8n.objects.update_or_create(
             mercadopago_preference_id=preference_id,
-            defaults={
-                'email_comprador': email_comprador,
-                'items': items,
-                'metadata': metadata,
-                'subtotal': subtotal,
-                'total': total,
-            }
+            defaults=datos,
         )
         
         # Intentar asociar usuario por email
@@ -3622,6 +3790,89 @@ def api_crear_venta_n8n(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@require_POST
+@idempotente
+def api_crear_ventas_n8n_lote(request):
+    """
+    Registra varias ventas de n8n en una sola petición (p. ej. al reenviar
+    las pendientes tras una caída). Recibe una lista de ventas o
+    {"ventas": [...]} con el mismo formato que api_crear_venta_n8n y responde
+    el resultado de cada una en el mismo orden.
+    
+    Los compradores se buscan por email en una sola consulta y las ventas se
+    insertan o actualizan con un solo bulk_create sobre
+    mercadopago_preference_id.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    
+    ventas_data = data.get('ventas') if isinstance(data, dict) else data
+    if not isinstance(ventas_data, list) or not ventas_data:
+        return JsonResponse({'error': 'Se espera una lista de ventas'}, status=400)
+    if len(ventas_data) > MAX_VENTAS_LOTE_N8N:
+        return JsonResponse({'error': f'Máximo {MAX_VENTAS_LOTE_N8N} ventas por petición'}, status=400)
+    
+    resultados = []
+    validas = {}  # preference_id -> datos (si se repite, gana la última)
+    for indice, venta_data in enumerate(ventas_data):
+        datos, error = _datos_venta_n8n(venta_data)
+        if error:
+            resultados.append({'indice': indice, 'success': False, 'error': error})
+            continue
+        resultados.append({'indice': indice, 'success': True, 'preference_id': datos['mercadopago_preference_id']})
+        validas[datos['mercadopago_preference_id']] = datos
+    
+    if validas:
+        try:
+            with transaction.atomic():
+                existentes = {
+                    preference_id: usuario_id
+                    for preference_id, usuario_id in VentaN8n.objects.filter(
+                        mercadopago_preference_id__in=list(validas)
+                    ).values_list('mercadopago_preference_id', 'usuario_id')
+                }
+                
+                # Usuarios por email en una sola consulta (con emails repetidos, el más antiguo)
+                usuarios_por_email = {}
+                emails = {datos['email_comprador'] for datos in validas.values()}
+                for usuario_id, email in User.objects.filter(email__in=emails).order_by('-id').values_list('id', 'email'):
+                    usuarios_por_email[email] = usuario_id
+                
+                ventas = []
+                for preference_id, datos in validas.items():
+                    venta = VentaN8n(**datos)
+                    # Igual que asociar_usuario_por_email: no se reemplaza un usuario ya asociado
+                    venta.usuario_id = existentes.get(preference_id) or usuarios_por_email.get(datos['email_comprador'])
+                    ventas.append(venta)
+                
+                VentaN8n.objects.bulk_create(
+                    ventas,
+                    update_conflicts=True,
+                    unique_fields=['mercadopago_preference_id'],
+                    update_fields=['email_comprador', 'items', 'metadata', 'subtotal', 'total', 'usuario', 'fecha_actualizacion'],
+                )
+                ids = dict(VentaN8n.objects.filter(
+                    mercadopago_preference_id__in=list(validas)
+                ).values_list('mercadopago_preference_id', 'id'))
+        except Exception as e:
+            logger.exception(f'Error al registrar lote de ventas n8n: {e}')
+            return JsonResponse({'error': str(e)}, status=500)
+        
+        for resultado in resultados:
+            if resultado['success']:
+                resultado['venta_id'] = ids.get(resultado['preference_id'])
+                resultado['created'] = resultado['preference_id'] not in existentes
+    
+    return JsonResponse({
+        'success': True,
+        'total': len(resultados),
+        'registradas': sum(1 for r in resultados if r['success']),
+        'resultados': resultados,
+    })
+
+
 def pago_exitoso_n8n(request):
     """Página de pago exitoso para ventas de n8n"""
     payment_id = request.GET.get('payment_id') or request.GET.get('collection_id')
@@ -3767,10 +4018,7 @@ def pago_exitoso_n8n(request):
         # Si el usuario está logueado, verificar permisos solo para mostrar información adicional
         if request.user.is_authenticated:
             es_propietario = venta.usuario == request.user
-            es_staff = request.user.is_superuser or (
-                hasattr(request.user, 'perfil') and 
-                request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-            )
+            es_staff = request.rol.es_staff
             # También verificar por email
             if not es_propietario and not es_staff:
                 es_propietario = request.user.email == venta.email_comprador
@@ -1,12 +1,29 @@
 from django.contrib import admin
-from .models import PerfilUsuario, ConfiguracionSistema, LogActividad, Notificacion, EmailVerificationToken, VisitorLog
+from django.utils import timezone
+from .models import PerfilUsuario, ConfiguracionSistema, LogActividad, Notificacion, EmailVerificationToken, VisitorLog, CorreoSaliente
+from .busqueda import perfiles_con_rut_repetido
+from .notificaciones import recalcular_contadores
+
+
+class RutRepetidoFilter(admin.SimpleListFilter):
+    """Perfiles cuyo RUT ya pertenece a otro perfil (quedaron sin rut_normalizado)"""
+    title = 'RUT repetido'
+    parameter_name = 'rut_repetido'
+
+    def lookups(self, request, model_admin):
+        return [('si', 'Sí')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'si':
+            return perfiles_con_rut_repetido(queryset)
+        return queryset
 
 
 @admin.register(PerfilUsuario)
 class PerfilUsuarioAdmin(admin.ModelAdmin):
-    list_display = ['user', 'tipo_usuario', 'email_verificado', 'telefono', 'api_token', 'activo']
-    list_filter = ['tipo_usuario', 'email_verificado', 'activo']
-    search_fields = ['user__username', 'user__email', 'telefono', 'api_token']
+    list_display = ['user', 'tipo_usuario', 'rut', 'email_verificado', 'telefono', 'api_token', 'activo']
+    list_filter = ['tipo_usuario', 'email_verificado', 'activo', RutRepetidoFilter]
+    search_fields = ['user__username', 'user__email', 'rut', 'telefono', 'api_token']
     readonly_fields = ['fecha_creacion', 'fecha_actualizacion', 'fecha_verificacion_email', 'token_created']
 
 
@@ -51,6 +68,20 @@ class NotificacionAdmin(admin.ModelAdmin):
     search_fields = ['usuario__username', 'titulo', 'mensaje']
     readonly_fields = ['fecha_creacion', 'fecha_leida']
 
+    # Los cambios hechos aquí no pasan por notificaciones.py: se recalcula el contador
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        recalcular_contadores([obj.usuario_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recalcular_contadores([obj.usuario_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = list(queryset.values_list('usuario_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        recalcular_contadores(user_ids)
+
 
 @admin.register(VisitorLog)
 class VisitorLogAdmin(admin.ModelAdmin):
@@ -62,3 +93,20 @@ class VisitorLogAdmin(admin.ModelAdmin):
     
     def has_add_permission(self, request):
         return False  # No permitir crear registros manualmente
+
+
+@admin.register(CorreoSaliente)
+class CorreoSalienteAdmin(admin.ModelAdmin):
+    list_display = ['asunto', 'destinatarios', 'estado', 'intentos', 'proximo_intento', 'fecha_creacion', 'fecha_envio']
+    list_filter = ['estado', 'fecha_creacion']
+    search_fields = ['asunto', 'destinatarios']
+    readonly_fields = ['fecha_creacion', 'fecha_envio', 'ultimo_error']
+    exclude = ['adjuntos']
+    actions = ['reintentar']
+
+    @admin.action(description='Reintentar envío')
+    def reintentar(self, request, queryset):
+        actualizados = queryset.exclude(estado='enviado').update(
+            estado='pendiente', intentos=0, proximo_intento=timezone.now()
+        )
+        self.message_user(request, f'{actualizados} correos vuelven a la bandeja de salida.')
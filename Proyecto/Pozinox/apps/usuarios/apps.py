@@ -1,7 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class UsuariosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.usuarios'
     verbose_name = 'Gestión de Usuarios'
+
+    def ready(self):
+        from .busqueda import asegurar_indice
+        post_migrate.connect(asegurar_indice, sender=self)
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class PerfilModelBackend(ModelBackend):
+    """
+    ModelBackend que carga el perfil junto con el usuario (select_related),
+    así request.user.perfil no genera otra consulta en cada petición.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related('perfil').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,187 @@
+"""
+Búsqueda de clientes sobre un documento desnormalizado (PerfilUsuario.busqueda).
+
+El documento concatena usuario, nombre, apellido, email, razón social y el RUT
+solo con dígitos, en minúsculas y sin tildes. Se indexa según el motor:
+
+- PostgreSQL: índice GIN con pg_trgm, que acelera los ILIKE '%texto%'.
+- SQLite: tabla virtual FTS5 (usuarios_perfil_fts) mantenida con triggers,
+  consultada por prefijo y ordenada por relevancia (bm25).
+
+La migración 0010 crea el índice del motor activo y asegurar_indice (post_migrate)
+lo repone si una migración posterior lo eliminó.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+
+
+TABLA_FTS = 'usuarios_perfil_fts'
+CAMPOS_USUARIO = ('username', 'first_name', 'last_name', 'email')
+
+_RE_RUT = re.compile(r'^[\d.]+-?[\dkK]?$')
+_RE_TERMINO = re.compile(r'[a-z0-9]+')
+
+
+def normalizar_texto(texto):
+    """Minúsculas y sin tildes"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def normalizar_rut(rut):
+    """'12.345.678-9' -> '123456789' (conserva la K del dígito verificador)"""
+    return re.sub(r'[^0-9k]', '', (rut or '').lower())
+
+
+def clave_rut(rut):
+    """Valor de PerfilUsuario.rut_normalizado: '12.345.678-k' -> '12345678K'"""
+    return normalizar_rut(rut).upper() or None
+
+
+def perfiles_con_rut_repetido(perfiles):
+    """
+    Perfiles con RUT pero sin rut_normalizado: la migración 0011 se lo dejó
+    solo al perfil más antiguo con ese RUT.
+    """
+    return perfiles.exclude(rut='').filter(rut_normalizado=None)
+
+
+def documento_busqueda(user, perfil):
+    """Texto que se guarda en PerfilUsuario.busqueda"""
+    partes = [getattr(user, campo) for campo in CAMPOS_USUARIO]
+    partes.append(perfil.razon_social)
+    partes.append(normalizar_rut(perfil.rut))
+    return normalizar_texto(' '.join(p for p in partes if p))
+
+
+def terminos_consulta(consulta):
+    """
+    Separa la consulta en términos normalizados. Un término con forma de RUT
+    ('12.345.678-9', '12345') se reduce a sus dígitos.
+    """
+    terminos = []
+    for palabra in consulta.split():
+        if _RE_RUT.match(palabra) and any(c.isdigit() for c in palabra):
+            terminos.append(normalizar_rut(palabra))
+        else:
+            terminos.extend(_RE_TERMINO.findall(normalizar_texto(palabra)))
+    return [t for t in terminos if t]
+
+
+def buscar_clientes(consulta, limite=10):
+    """
+    Perfiles de clientes activos que coinciden con todos los términos,
+    ordenados por relevancia. Retorna una lista de PerfilUsuario con user.
+    """
+    from .models import PerfilUsuario
+
+    terminos = terminos_consulta(consulta)
+    if not terminos:
+        return []
+
+    base = PerfilUsuario.objects.filter(
+        tipo_usuario='cliente', user__is_active=True
+    ).select_related('user')
+
+    if connection.vendor == 'sqlite':
+        ids = _ids_fts5(terminos, limite)
+        perfiles = base.in_bulk(ids)
+        return [perfiles[i] for i in ids if i in perfiles]
+
+    for termino in terminos:
+        base = base.filter(busqueda__contains=termino)
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        base = base.annotate(
+            similitud=TrigramWordSimilarity(' '.join(terminos), 'busqueda')
+        ).order_by('-similitud', 'user__username')
+    else:
+        base = base.order_by('user__username')
+    return list(base[:limite])
+
+
+def _ids_fts5(terminos, limite):
+    # Cada término como prefijo entre comillas: '"juan"* "gm"*' (AND implícito)
+    expresion = ' '.join(f'"{t}"*' for t in terminos)
+    sql = f"""
+        SELECT p.id
+        FROM {TABLA_FTS} f
+        JOIN usuarios_perfilusuario p ON p.id = f.rowid
+        JOIN auth_user u ON u.id = p.user_id
+        WHERE {TABLA_FTS} MATCH %s AND p.tipo_usuario = 'cliente' AND u.is_active
+        ORDER BY f.rank
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [expresion, limite])
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+# ============================================
+# ÍNDICE SEGÚN MOTOR
+# ============================================
+
+_TRIGGERS_FTS = {
+    f'{TABLA_FTS}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON usuarios_perfilusuario BEGIN
+            INSERT INTO {TABLA_FTS}(rowid, busqueda) VALUES (new.id, new.busqueda);
+        END""",
+    f'{TABLA_FTS}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON usuarios_perfilusuario BEGIN
+            INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, busqueda) VALUES ('delete', old.id, old.busqueda);
+        END""",
+    f'{TABLA_FTS}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE OF busqueda ON usuarios_perfilusuario BEGIN
+            INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, busqueda) VALUES ('delete', old.id, old.busqueda);
+            INSERT INTO {TABLA_FTS}(rowid, busqueda) VALUES (new.id, new.busqueda);
+        END""",
+}
+
+
+def crear_indice(conexion):
+    """Crea el índice de búsqueda del motor activo (idempotente)"""
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS usuarios_perfil_busqueda_trgm '
+                'ON usuarios_perfilusuario USING gin (busqueda gin_trgm_ops)'
+            )
+        elif conexion.vendor == 'sqlite':
+            columnas = [c.name for c in conexion.introspection.get_table_description(cursor, 'usuarios_perfilusuario')]
+            if 'busqueda' not in columnas:
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5("
+                f"busqueda, content='usuarios_perfilusuario', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'usuarios_perfilusuario'"
+            )
+            existentes = {fila[0] for fila in cursor.fetchall()}
+            if not set(_TRIGGERS_FTS) <= existentes:
+                # En SQLite los ALTER TABLE de Django recrean la tabla y borran
+                # los triggers: se vuelven a crear y se reconstruye el índice
+                for sql in _TRIGGERS_FTS.values():
+                    cursor.execute(sql)
+                cursor.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+
+
+def eliminar_indice(conexion):
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS usuarios_perfil_busqueda_trgm')
+        elif conexion.vendor == 'sqlite':
+            for nombre in _TRIGGERS_FTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {nombre}')
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLA_FTS}')
+
+
+def asegurar_indice(sender, using='default', **kwargs):
+    """post_migrate: repone los triggers FTS5 si una migración los eliminó"""
+    from django.db import connections
+    crear_indice(connections[using])
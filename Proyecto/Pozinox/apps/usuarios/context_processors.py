@@ -28,3 +28,16 @@ def visitor_info(request):
             'is_returning_visitor': visitor_data.get('visit_count', 0) > 1,
         }
     }
+
+
+def notificaciones(request):
+    """
+    Cantidad de notificaciones sin leer para el badge del encabezado.
+    Se lee del perfil ya cargado con el usuario, sin consultas adicionales.
+    """
+    from .notificaciones import no_leidas
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'notificaciones_no_leidas': no_leidas(user)}
@@ -0,0 +1,170 @@
+"""
+Bandeja de salida de correos (CorreoSaliente).
+
+``encolar_correo`` guarda el correo en la base de datos dentro de la
+transacción actual, de modo que solo se envía si el cambio que lo originó se
+confirma. El envío lo hace ``enviar_pendientes``, que toma lotes de la bandeja
+y los despacha por una sola conexión SMTP reutilizada, respetando
+CORREOS_POR_MINUTO y reintentando con espera exponencial hasta
+CORREOS_MAX_INTENTOS.
+
+Con CORREOS_ASINCRONOS=True el envío lo hace el comando ``enviar_correos``;
+con False (desarrollo) se envía al confirmar la transacción, en la misma
+petición, y si falla queda pendiente para un reintento.
+"""
+import base64
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CorreoSaliente
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 50
+# Mientras un proceso envía un lote, los correos quedan reservados hasta este plazo
+RESERVA = timedelta(minutes=10)
+
+
+def encolar_correo(asunto, destinatarios, texto='', html='', adjuntos=(), remitente=None):
+    """
+    Agrega un correo a la bandeja de salida.
+    ``adjuntos`` es una lista de tuplas (nombre, contenido_bytes, mimetype).
+    """
+    if isinstance(destinatarios, str):
+        destinatarios = [destinatarios]
+    destinatarios = [d for d in destinatarios if d]
+    if not destinatarios:
+        return None
+
+    # Savepoint propio: si falla el INSERT no invalida la transacción de quien llama
+    with transaction.atomic():
+        correo = CorreoSaliente.objects.create(
+            asunto=asunto[:255],
+            remitente=remitente or settings.DEFAULT_FROM_EMAIL,
+            destinatarios=destinatarios,
+            cuerpo_texto=texto,
+            cuerpo_html=html,
+            adjuntos=[
+                {'nombre': nombre, 'mimetype': mimetype, 'contenido': base64.b64encode(contenido).decode('ascii')}
+                for nombre, contenido, mimetype in adjuntos
+            ],
+        )
+
+    if not getattr(settings, 'CORREOS_ASINCRONOS', False):
+        transaction.on_commit(lambda: enviar_pendientes(ids=[correo.pk]))
+    return correo
+
+
+def construir_mensaje(correo, conexion=None):
+    """EmailMultiAlternatives a partir de un CorreoSaliente"""
+    mensaje = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.cuerpo_texto,
+        from_email=correo.remitente,
+        to=correo.destinatarios,
+        connection=conexion,
+    )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    for adjunto in correo.adjuntos:
+        mensaje.attach(adjunto['nombre'], base64.b64decode(adjunto['contenido']), adjunto['mimetype'])
+    return mensaje
+
+
+def reclamar_lote(tamano=TAMANO_LOTE, ids=None):
+    """
+    Reserva hasta ``tamano`` correos pendientes (corriendo proximo_intento)
+    para que otro proceso no los envíe a la vez. Si el proceso muere, la
+    reserva vence y los correos se vuelven a tomar.
+    """
+    ahora = timezone.now()
+    with transaction.atomic():
+        pendientes = CorreoSaliente.objects.select_for_update(skip_locked=True).filter(
+            estado='pendiente', proximo_intento__lte=ahora
+        )
+        if ids is not None:
+            pendientes = pendientes.filter(pk__in=ids)
+        correos = list(pendientes.order_by('proximo_intento', 'id')[:tamano])
+        if correos:
+            CorreoSaliente.objects.filter(pk__in=[c.pk for c in correos]).update(
+                proximo_intento=ahora + RESERVA
+            )
+    return correos
+
+
+def _registrar_error(correo, error):
+    correo.intentos += 1
+    correo.ultimo_error = str(error)[:2000]
+    max_intentos = getattr(settings, 'CORREOS_MAX_INTENTOS', 5)
+    if correo.intentos >= max_intentos:
+        correo.estado = 'fallido'
+        logger.error(f'Correo {correo.pk} descartado tras {correo.intentos} intentos: {error}')
+    else:
+        # 1, 2, 4, 8... minutos
+        correo.proximo_intento = timezone.now() + timedelta(minutes=2 ** (correo.intentos - 1))
+        logger.warning(f'Error al enviar correo {correo.pk} (intento {correo.intentos}): {error}')
+    correo.save(update_fields=['intentos', 'ultimo_error', 'estado', 'proximo_intento'])
+
+
+def _posponer(correos, espera=timedelta(minutes=1)):
+    """Devuelve correos reservados a la bandeja sin contar un intento (falla de conexión)"""
+    CorreoSaliente.objects.filter(pk__in=[c.pk for c in correos]).update(
+        proximo_intento=timezone.now() + espera
+    )
+
+
+def enviar_pendientes(tamano=TAMANO_LOTE, ids=None):
+    """
+    Envía un lote de la bandeja por una sola conexión SMTP.
+    Retorna (enviados, con_error).
+    """
+    correos = reclamar_lote(tamano, ids)
+    if not correos:
+        return 0, 0
+
+    conexion = get_connection(fail_silently=False)
+    try:
+        conexion.open()
+    except Exception as e:
+        logger.warning(f'No se pudo conectar al servidor de correo: {e}')
+        _posponer(correos)
+        return 0, 0
+
+    por_minuto = getattr(settings, 'CORREOS_POR_MINUTO', 0)
+    pausa = 60.0 / por_minuto if por_minuto else 0
+    enviados = con_error = 0
+    ultimo_envio = None
+    try:
+        for posicion, correo in enumerate(correos):
+            if pausa and ultimo_envio is not None:
+                espera = pausa - (time.monotonic() - ultimo_envio)
+                if espera > 0:
+                    time.sleep(espera)
+            ultimo_envio = time.monotonic()
+            try:
+                conexion.send_messages([construir_mensaje(correo, conexion)])
+            except Exception as e:
+                con_error += 1
+                _registrar_error(correo, e)
+                # La conexión puede haber quedado inservible: se abre otra
+                conexion.close()
+                try:
+                    conexion.open()
+                except Exception as e_conexion:
+                    logger.warning(f'No se pudo reabrir la conexión SMTP: {e_conexion}')
+                    _posponer(correos[posicion + 1:])
+                    break
+                continue
+            correo.estado = 'enviado'
+            correo.fecha_envio = timezone.now()
+            correo.save(update_fields=['estado', 'fecha_envio'])
+            enviados += 1
+    finally:
+        conexion.close()
+    return enviados, con_error
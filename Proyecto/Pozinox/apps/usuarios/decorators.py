@@ -0,0 +1,38 @@
+"""
+Decoradores de permisos basados en request.rol (ver roles.py).
+Se usan después de @login_required.
+"""
+from functools import wraps
+
+from django.contrib import messages
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+from .roles import obtener_rol
+
+
+def _requiere(condicion, redirect_url, mensaje, json):
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            rol = getattr(request, 'rol', None) or obtener_rol(request.user)
+            if not condicion(rol):
+                if json:
+                    return JsonResponse({'error': 'No tienes permisos'}, status=403)
+                messages.error(request, mensaje)
+                return redirect(redirect_url)
+            return vista(request, *args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def staff_required(vista=None, redirect_url='home', mensaje='No tienes permisos para acceder a esta sección.', json=False):
+    """Solo superusuarios, administradores y trabajadores"""
+    decorador = _requiere(lambda rol: rol.es_staff, redirect_url, mensaje, json)
+    return decorador(vista) if vista else decorador
+
+
+def admin_required(vista=None, redirect_url='home', mensaje='No tienes permisos para acceder a esta sección.', json=False):
+    """Solo superusuarios y administradores"""
+    decorador = _requiere(lambda rol: rol.es_admin, redirect_url, mensaje, json)
+    return decorador(vista) if vista else decorador
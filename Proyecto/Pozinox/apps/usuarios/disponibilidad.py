@@ -0,0 +1,162 @@
+"""
+Verificación rápida de disponibilidad de username, email y RUT.
+
+Cada proceso mantiene un filtro de Bloom por campo con los valores ya
+registrados. Si el filtro dice que el valor no está, está disponible con
+certeza y no se consulta la base de datos; si dice que podría estar, se hace
+la consulta indexada normal. Los falsos positivos (~1%) solo cuestan esa
+consulta.
+
+Los filtros se actualizan al crear usuarios en este proceso. Cada
+INTERVALO_RECONSTRUCCION segundos se compara la versión de los datos (último id
+de usuario y cantidad de RUT registrados) y solo si cambió, o si pasó
+RECONSTRUCCION_FORZADA, se reconstruyen en segundo plano. Editar un perfil no
+cambia la versión; un email cambiado en otro proceso entra al filtro en la
+reconstrucción forzada. Mientras no hay
+filtro construido se consulta siempre la base de datos. La validación final
+del formulario de registro sigue consultando la base de datos.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = ('username', 'email', 'rut')
+INTERVALO_RECONSTRUCCION = 300  # segundos
+RECONSTRUCCION_FORZADA = 3600  # segundos
+TASA_FALSOS_POSITIVOS = 0.01
+MARGEN_CRECIMIENTO = 1.5  # capacidad extra para altas entre reconstrucciones
+
+_lock = threading.Lock()
+_estado = {
+    'filtros': None, 'version': None, 'construido': float('-inf'), 'revisado': float('-inf'),
+    'construyendo': False, 'pendientes': [],
+}
+
+
+class FiltroBloom:
+    """Filtro de Bloom sobre un bytearray con doble hashing (blake2b)"""
+
+    def __init__(self, capacidad, tasa=TASA_FALSOS_POSITIVOS):
+        capacidad = max(int(capacidad), 1000)
+        self.bits = max(8, int(-capacidad * math.log(tasa) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacidad * math.log(2)))
+        self._datos = bytearray((self.bits + 7) // 8)
+
+    def _posiciones(self, valor):
+        digest = hashlib.blake2b(valor.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def agregar(self, valor):
+        for posicion in self._posiciones(valor):
+            self._datos[posicion >> 3] |= 1 << (posicion & 7)
+
+    def __contains__(self, valor):
+        return all(self._datos[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(valor))
+
+
+def normalizar(campo, valor):
+    """Clave usada en el filtro. Es más laxa que la consulta (minúsculas): solo aumenta los falsos positivos"""
+    from .busqueda import normalizar_rut
+    if campo == 'rut':
+        return normalizar_rut(valor)
+    return (valor or '').strip().lower()
+
+
+def _valores(campo):
+    from django.contrib.auth.models import User
+    from .models import PerfilUsuario
+
+    if campo == 'rut':
+        return PerfilUsuario.objects.exclude(rut_normalizado=None).values_list('rut_normalizado', flat=True)
+    return User.objects.exclude(**{campo: ''}).values_list(campo, flat=True)
+
+
+def construir_filtros():
+    """Construye los filtros recorriendo los valores registrados por partes"""
+    filtros = {}
+    for campo in CAMPOS:
+        valores = _valores(campo)
+        filtro = FiltroBloom(valores.count() * MARGEN_CRECIMIENTO)
+        for valor in valores.iterator(chunk_size=5000):
+            filtro.agregar(normalizar(campo, valor))
+        filtros[campo] = filtro
+    return filtros
+
+
+def version_datos():
+    from django.contrib.auth.models import User
+    from django.db.models import Max
+    from .models import PerfilUsuario
+
+    # Ambas consultas usan índices (PK y rut_normalizado único)
+    return (
+        User.objects.aggregate(m=Max('id'))['m'],
+        PerfilUsuario.objects.exclude(rut_normalizado=None).count(),
+    )
+
+
+def _reconstruir(forzar):
+    try:
+        version = version_datos()
+        if not forzar and version == _estado['version']:
+            return
+        filtros = construir_filtros()
+        with _lock:
+            # Altas ocurridas mientras se construía el filtro
+            for campo, valor in _estado['pendientes']:
+                filtros[campo].agregar(valor)
+            _estado['filtros'] = filtros
+            _estado['version'] = version
+            _estado['construido'] = time.monotonic()
+    except Exception:
+        logger.exception('Error al reconstruir los filtros de disponibilidad')
+    finally:
+        with _lock:
+            _estado['construyendo'] = False
+            _estado['pendientes'] = []
+        connection.close()
+
+
+def _filtros():
+    """Filtros vigentes (o None) y lanza la reconstrucción si corresponde"""
+    with _lock:
+        ahora = time.monotonic()
+        if ahora - _estado['revisado'] > INTERVALO_RECONSTRUCCION and not _estado['construyendo']:
+            _estado['revisado'] = ahora
+            _estado['construyendo'] = True
+            forzar = ahora - _estado['construido'] > RECONSTRUCCION_FORZADA
+            threading.Thread(
+                target=_reconstruir, args=(forzar,), name='filtros-disponibilidad', daemon=True
+            ).start()
+        return _estado['filtros']
+
+
+def podria_existir(campo, valor):
+    """
+    False solo si el valor con certeza no está registrado.
+    True significa "consultar la base de datos".
+    """
+    filtros = _filtros()
+    if filtros is None:
+        return True
+    return normalizar(campo, valor) in filtros[campo]
+
+
+def registrar(campo, valor):
+    """Agrega un valor recién registrado a los filtros de este proceso"""
+    if not valor:
+        return
+    clave = normalizar(campo, valor)
+    with _lock:
+        if _estado['filtros'] is not None:
+            _estado['filtros'][campo].agregar(clave)
+        if _estado['construyendo']:
+            _estado['pendientes'].append((campo, clave))
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import PerfilUsuario
+from .busqueda import clave_rut
 
 
 def validar_rut_chileno(rut):
@@ -292,7 +293,7 @@ class RegistroForm(UserCreationForm):
             rut_formateado = formatear_rut(rut)
             
             # Verificar si el RUT ya existe en otro usuario
-            if PerfilUsuario.objects.filter(rut=rut_formateado).exists():
+            if PerfilUsuario.objects.filter(rut_normalizado=clave_rut(rut_formateado)).exists():
                 raise forms.ValidationError('Este RUT ya está registrado en el sistema.')
             
             return rut_formateado
@@ -307,7 +308,7 @@ class RegistroForm(UserCreationForm):
             rut_formateado = formatear_rut(rut)
             
             # Verificar si el RUT ya existe en otro usuario
-            if PerfilUsuario.objects.filter(rut=rut_formateado).exists():
+            if PerfilUsuario.objects.filter(rut_normalizado=clave_rut(rut_formateado)).exists():
                 raise forms.ValidationError('Este RUT ya está registrado en el sistema.')
             
             return rut_formateado
@@ -622,7 +623,7 @@ class CrearCompradorForm(forms.ModelForm):
             rut_formateado = formatear_rut(rut)
             
             # Verificar si el RUT ya existe en otro usuario
-            if PerfilUsuario.objects.filter(rut=rut_formateado).exists():
+            if PerfilUsuario.objects.filter(rut_normalizado=clave_rut(rut_formateado)).exists():
                 raise forms.ValidationError('Este RUT ya está registrado en el sistema.')
             
             return rut_formateado
@@ -637,7 +638,7 @@ class CrearCompradorForm(forms.ModelForm):
             rut_formateado = formatear_rut(rut)
             
             # Verificar si el RUT ya existe en otro usuario
-            if PerfilUsuario.objects.filter(rut=rut_formateado).exists():
+            if PerfilUsuario.objects.filter(rut_normalizado=clave_rut(rut_formateado)).exists():
                 raise forms.ValidationError('Este RUT ya está registrado en el sistema.')
             
             return rut_formateado
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.usuarios.correo import enviar_pendientes, TAMANO_LOTE
+
+
+class Command(BaseCommand):
+    help = 'Envía los correos de la bandeja de salida (worker en segundo plano)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Envía los pendientes y termina')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help=f'Correos por conexión SMTP (default: {TAMANO_LOTE})')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Segundos de espera cuando no hay correos (default: 5)')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Worker de correos iniciado')
+        while True:
+            close_old_connections()
+            enviados, con_error = enviar_pendientes(tamano=options['lote'])
+            if enviados or con_error:
+                estilo = self.style.WARNING if con_error else self.style.SUCCESS
+                self.stdout.write(estilo(f'{enviados} correos enviados, {con_error} con error'))
+                continue
+            if options['una_vez']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.usuarios.busqueda import clave_rut, perfiles_con_rut_repetido
+from apps.usuarios.models import PerfilUsuario
+
+
+class Command(BaseCommand):
+    help = 'Lista los perfiles cuyo RUT ya está registrado por otro perfil (para corregirlos en el admin)'
+
+    def handle(self, *args, **options):
+        repetidos = [
+            (perfil_id, username, rut, clave_rut(rut))
+            for perfil_id, username, rut in perfiles_con_rut_repetido(PerfilUsuario.objects.all())
+            .values_list('id', 'user__username', 'rut').order_by('id')
+        ]
+        if not repetidos:
+            self.stdout.write(self.style.SUCCESS('No hay perfiles con RUT repetido'))
+            return
+        duenos = dict(
+            PerfilUsuario.objects.filter(rut_normalizado__in={clave for *_, clave in repetidos if clave})
+            .values_list('rut_normalizado', 'user__username')
+        )
+        self.stdout.write(self.style.WARNING(f'{len(repetidos)} perfiles con RUT repetido o inválido:'))
+        for perfil_id, username, rut, clave in repetidos:
+            dueno = duenos.get(clave)
+            detalle = f'ya registrado por {dueno}' if dueno else 'RUT inválido'
+            self.stdout.write(f'  perfil {perfil_id} ({username}): RUT {rut} {detalle}')
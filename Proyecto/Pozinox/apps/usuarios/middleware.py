@@ -1,22 +1,84 @@
 """
 Middleware para rastrear visitantes del sitio mediante cookies
+
+Las visitas se acumulan en memoria y se insertan con un bulk_create cada
+settings.VISITAS_LOTE visitas o VISITAS_INTERVALO segundos, así una página servida desde
+caché no escribe en la base de datos en cada petición (VisitorLog.timestamp
+queda con la hora de la inserción, a lo más VISITAS_INTERVALO después). A los
+visitantes sin sesión no se les crea una: se identifican con un id guardado en
+la cookie de seguimiento.
+
+El lote se vacía solo desde las peticiones (no al terminar el proceso): si el
+proceso muere, se pierden las del lote en curso (menos de VISITAS_LOTE). Con
+VISITAS_LOTE = 1 (así corren las pruebas) cada visita se inserta en su petición.
 """
 import json
+import logging
+import threading
+import time
+import uuid
 from datetime import datetime
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_ipv46_address
 from django.utils.deprecation import MiddlewareMixin
 from django.http import HttpRequest
 from django.contrib.sessions.models import Session
 
+logger = logging.getLogger(__name__)
+
+VISITAS_INTERVALO = 10  # segundos
+
+_lock = threading.Lock()
+_visitas = []
+_ultimo_vaciado = [time.monotonic()]
+
+
+def registrar_visita(visita):
+    """Agrega la visita al lote y lo inserta si se llenó o pasó el intervalo"""
+    if settings.VISITAS_LOTE <= 1:
+        visita.save()
+        return
+    with _lock:
+        _visitas.append(visita)
+    vaciar_visitas(forzar=False)
+
+
+def vaciar_visitas(forzar=True):
+    """Inserta las visitas acumuladas. Sin ``forzar`` solo si se llenó el lote o pasó el intervalo"""
+    from apps.usuarios.models import VisitorLog
+    
+    with _lock:
+        ahora = time.monotonic()
+        if not _visitas or not (
+            forzar or len(_visitas) >= settings.VISITAS_LOTE or ahora - _ultimo_vaciado[0] >= VISITAS_INTERVALO
+        ):
+            return 0
+        lote = _visitas[:]
+        _visitas.clear()
+        _ultimo_vaciado[0] = ahora
+    try:
+        VisitorLog.objects.bulk_create(lote)
+    except Exception as e:
+        logger.warning(f'No se pudieron registrar {len(lote)} visitas: {e}')
+        return 0
+    return len(lote)
+
 
 class VisitorTrackingMiddleware(MiddlewareMixin):
     """
     Middleware que rastrea información de visitantes usando cookies y base de datos
     """
+    # Las APIs (n8n, chatbot) no son visitas: no crean sesión ni registro
+    SEGMENTO_API = '/api/'
     
     def process_request(self, request: HttpRequest):
         """
         Procesa cada petición para rastrear información del visitante
         """
+        if self.SEGMENTO_API in request.path:
+            return None
+        
         # Obtener datos actuales de la cookie
         visitor_data = self.get_visitor_data(request)
         
@@ -44,6 +106,8 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
         # Si es primera visita, marcar
         if 'first_visit' not in visitor_data:
             visitor_data['first_visit'] = datetime.now().isoformat()
+        if 'visitor_id' not in visitor_data:
+            visitor_data['visitor_id'] = uuid.uuid4().hex
         
         # Guardar en el request para uso en views
         request.visitor_data = visitor_data
@@ -104,10 +168,14 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
         try:
             from apps.usuarios.models import VisitorLog
             
-            # Obtener session ID
-            if not request.session.session_key:
-                request.session.create()
-            session_id = request.session.session_key
+            # Con sesión se usa su clave; sin sesión, el id de la cookie (no se crea
+            # una sesión en la base de datos solo para registrar la visita)
+            if settings.SESSION_COOKIE_NAME in request.COOKIES and request.session.session_key:
+                session_id = request.session.session_key
+                user = request.user if request.user.is_authenticated else None
+            else:
+                session_id = visitor_data['visitor_id']
+                user = None
             
             # Detectar tipo de dispositivo básico
             user_agent = visitor_data.get('user_agent', '').lower()
@@ -118,16 +186,22 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
             else:
                 device_type = 'desktop'
             
-            # Crear registro
-            VisitorLog.objects.create(
+            # Una IP inválida o un campo largo harían fallar todo el lote
+            ip_address = visitor_data.get('ip')
+            try:
+                validate_ipv46_address(ip_address)
+            except ValidationError:
+                ip_address = None
+            
+            registrar_visita(VisitorLog(
                 session_id=session_id,
-                user=request.user if request.user.is_authenticated else None,
-                ip_address=visitor_data.get('ip'),
+                user=user,
+                ip_address=ip_address,
                 user_agent=visitor_data.get('user_agent', ''),
-                page_url=request.path,
-                referrer=request.META.get('HTTP_REFERER', ''),
+                page_url=request.path[:500],
+                referrer=request.META.get('HTTP_REFERER', '')[:500],
                 device_type=device_type,
-            )
+            ))
         except Exception as e:
             # No bloquear la petición si falla el registro
             pass
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0008_perfilusuario_direccion_comercial_perfilusuario_giro_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='perfilusuario',
+            name='api_token',
+            field=models.CharField(blank=True, help_text='Código de vinculación de 6 dígitos para chatbot (un solo uso)', max_length=6, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='TokenChatbotRevocado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_revocacion', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens_chatbot_revocados', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Token de Chatbot Revocado',
+                'verbose_name_plural': 'Tokens de Chatbot Revocados',
+                'ordering': ['-fecha_revocacion'],
+            },
+        ),
+    ]
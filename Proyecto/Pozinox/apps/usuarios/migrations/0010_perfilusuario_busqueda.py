@@ -0,0 +1,107 @@
+# Documento de búsqueda de clientes e índice según el motor (pg_trgm / FTS5)
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Copias de busqueda.py al escribir esta migración: las migraciones no importan
+# el código actual, que puede cambiar después
+TABLA_FTS = 'usuarios_perfil_fts'
+CAMPOS_USUARIO = ('username', 'first_name', 'last_name', 'email')
+
+
+def normalizar_texto(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def normalizar_rut(rut):
+    return re.sub(r'[^0-9k]', '', (rut or '').lower())
+
+
+def documento_busqueda(user, perfil):
+    partes = [getattr(user, campo) for campo in CAMPOS_USUARIO]
+    partes.append(perfil.razon_social)
+    partes.append(normalizar_rut(perfil.rut))
+    return normalizar_texto(' '.join(p for p in partes if p))
+
+
+_TRIGGERS_FTS = {
+    f'{TABLA_FTS}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON usuarios_perfilusuario BEGIN
+            INSERT INTO {TABLA_FTS}(rowid, busqueda) VALUES (new.id, new.busqueda);
+        END""",
+    f'{TABLA_FTS}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON usuarios_perfilusuario BEGIN
+            INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, busqueda) VALUES ('delete', old.id, old.busqueda);
+        END""",
+    f'{TABLA_FTS}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE OF busqueda ON usuarios_perfilusuario BEGIN
+            INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, busqueda) VALUES ('delete', old.id, old.busqueda);
+            INSERT INTO {TABLA_FTS}(rowid, busqueda) VALUES (new.id, new.busqueda);
+        END""",
+}
+
+
+def poblar_busqueda(apps, schema_editor):
+    """Calcula el documento de búsqueda de los perfiles existentes por lotes"""
+    PerfilUsuario = apps.get_model('usuarios', 'PerfilUsuario')
+    lote = []
+    for perfil in PerfilUsuario.objects.select_related('user').iterator(chunk_size=2000):
+        perfil.busqueda = documento_busqueda(perfil.user, perfil)
+        lote.append(perfil)
+        if len(lote) >= 2000:
+            PerfilUsuario.objects.bulk_update(lote, ['busqueda'])
+            lote = []
+    if lote:
+        PerfilUsuario.objects.bulk_update(lote, ['busqueda'])
+
+
+def crear_indice_busqueda(apps, schema_editor):
+    """pg_trgm en PostgreSQL; tabla FTS5 con sus triggers en SQLite"""
+    conexion = schema_editor.connection
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'postgresql':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS usuarios_perfil_busqueda_trgm '
+                'ON usuarios_perfilusuario USING gin (busqueda gin_trgm_ops)'
+            )
+        elif conexion.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5("
+                f"busqueda, content='usuarios_perfilusuario', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            for sql in _TRIGGERS_FTS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+
+
+def eliminar_indice_busqueda(apps, schema_editor):
+    conexion = schema_editor.connection
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS usuarios_perfil_busqueda_trgm')
+        elif conexion.vendor == 'sqlite':
+            for nombre in _TRIGGERS_FTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {nombre}')
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLA_FTS}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0009_tokenchatbotrevocado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='busqueda',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(poblar_busqueda, migrations.RunPython.noop),
+        migrations.RunPython(crear_indice_busqueda, eliminar_indice_busqueda),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:10
+
+import re
+
+from django.db import migrations, models
+
+
+def clave_rut(rut):
+    """Copia de busqueda.clave_rut al escribir esta migración: '12.345.678-k' -> '12345678K'"""
+    return re.sub(r'[^0-9k]', '', (rut or '').lower()).upper() or None
+
+
+def poblar_rut_normalizado(apps, schema_editor):
+    """
+    Calcula rut_normalizado de los perfiles existentes. Si un RUT se repite
+    solo lo conserva el perfil más antiguo, para poder crear el índice único
+    (el filtro "RUT repetido" del admin y el comando ruts_repetidos
+    muestran los perfiles que quedaron sin él).
+    """
+    PerfilUsuario = apps.get_model('usuarios', 'PerfilUsuario')
+    vistos = set()
+    lote = []
+    for perfil in PerfilUsuario.objects.exclude(rut='').only('id', 'rut').order_by('id').iterator(chunk_size=2000):
+        normalizado = clave_rut(perfil.rut)
+        if normalizado in vistos:
+            continue
+        vistos.add(normalizado)
+        perfil.rut_normalizado = normalizado
+        lote.append(perfil)
+        if len(lote) >= 2000:
+            PerfilUsuario.objects.bulk_update(lote, ['rut_normalizado'])
+            lote = []
+    if lote:
+        PerfilUsuario.objects.bulk_update(lote, ['rut_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0010_perfilusuario_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='rut_normalizado',
+            field=models.CharField(blank=True, editable=False, help_text='RUT solo con dígitos y K (se calcula al guardar)', max_length=10, null=True),
+        ),
+        migrations.RunPython(poblar_rut_normalizado, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='perfilusuario',
+            name='rut_normalizado',
+            field=models.CharField(blank=True, editable=False, help_text='RUT solo con dígitos y K (se calcula al guardar)', max_length=10, null=True, unique=True),
+        ),
+        # auth_user.email no tiene índice y se consulta en registro y disponibilidad
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS usuarios_auth_user_email_idx ON auth_user (email)',
+            'DROP INDEX IF EXISTS usuarios_auth_user_email_idx',
+        ),
+    ]
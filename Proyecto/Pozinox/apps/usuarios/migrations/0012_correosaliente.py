@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0011_perfilusuario_rut_normalizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorreoSaliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asunto', models.CharField(max_length=255)),
+                ('remitente', models.CharField(max_length=255)),
+                ('destinatarios', models.JSONField(default=list)),
+                ('cuerpo_texto', models.TextField(blank=True)),
+                ('cuerpo_html', models.TextField(blank=True)),
+                ('adjuntos', models.JSONField(blank=True, default=list, help_text='Lista de {nombre, mimetype, contenido (base64)}')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviado', 'Enviado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_envio', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Correo Saliente',
+                'verbose_name_plural': 'Correos Salientes',
+                'ordering': ['-fecha_creacion'],
+                'indexes': [models.Index(fields=['estado', 'proximo_intento'], name='usuarios_correo_cola_idx')],
+            },
+        ),
+    ]
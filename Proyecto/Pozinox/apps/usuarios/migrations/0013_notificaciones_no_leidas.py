@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def poblar_contador(apps, schema_editor):
+    """Cuenta las notificaciones sin leer existentes de cada perfil"""
+    PerfilUsuario = apps.get_model('usuarios', 'PerfilUsuario')
+    Notificacion = apps.get_model('usuarios', 'Notificacion')
+    no_leidas = Notificacion.objects.filter(
+        usuario_id=OuterRef('user_id'), leida=False
+    ).values('usuario_id').annotate(total=Count('id')).values('total')
+    con_pendientes = Notificacion.objects.filter(leida=False).values('usuario_id')
+    PerfilUsuario.objects.filter(user_id__in=con_pendientes).update(
+        notificaciones_no_leidas=Coalesce(Subquery(no_leidas), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0012_correosaliente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='notificaciones_no_leidas',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Contador desnormalizado (ver notificaciones.py)'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'leida', '-fecha_creacion'], name='usuarios_notif_usuario_idx'),
+        ),
+        migrations.RunPython(poblar_contador, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 import uuid
 from datetime import timedelta
 
+from .busqueda import documento_busqueda, clave_rut, CAMPOS_USUARIO
+from . import disponibilidad
+
 
 class PerfilUsuario(models.Model):
     """Perfil extendido para usuarios del sistema Pozinox"""
@@ -34,6 +37,7 @@ class PerfilUsuario(models.Model):
     
     # Campos para Persona Natural
     rut = models.CharField(max_length=12, blank=True, help_text='RUT de persona natural o empresa')
+    rut_normalizado = models.CharField(max_length=10, null=True, blank=True, unique=True, editable=False, help_text='RUT solo con dígitos y K (se calcula al guardar)')
     
     # Campos para Empresa
     razon_social = models.CharField(max_length=200, blank=True, help_text='Razón social de la empresa')
@@ -46,6 +50,7 @@ class PerfilUsuario(models.Model):
     
     # Configuraciones del usuario
     notificaciones_email = models.BooleanField(default=True)
+    notificaciones_no_leidas = models.PositiveIntegerField(default=0, editable=False, help_text='Contador desnormalizado (ver notificaciones.py)')
     tema_oscuro = models.BooleanField(default=False)
     
     # Verificación de email
@@ -53,9 +58,12 @@ class PerfilUsuario(models.Model):
     fecha_verificacion_email = models.DateTimeField(null=True, blank=True)
     
     # Token API para chatbot
-    api_token = models.CharField(max_length=6, blank=True, null=True, unique=True, help_text="Token de 6 dígitos para chatbot")
+    api_token = models.CharField(max_length=6, blank=True, null=True, unique=True, help_text="Código de vinculación de 6 dígitos para chatbot (un solo uso)")
     token_created = models.DateTimeField(null=True, blank=True)
     
+    # Documento de búsqueda desnormalizado (ver busqueda.py)
+    busqueda = models.TextField(blank=True, default='', editable=False)
+    
     # Metadatos
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
@@ -68,6 +76,35 @@ class PerfilUsuario(models.Model):
     def __str__(self):
         return f"{self.user.get_full_name()} ({self.get_tipo_usuario_display()})"
     
+    # RUT y tipo con que se cargó el perfil (None si es nuevo o se difirieron con only/defer)
+    _rut_guardado = None
+    _tipo_guardado = None
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        perfil = super().from_db(db, field_names, values)
+        perfil._rut_guardado = perfil.__dict__.get('rut')
+        perfil._tipo_guardado = perfil.__dict__.get('tipo_usuario')
+        return perfil
+    
+    def save(self, *args, **kwargs):
+        # Mantener el documento de búsqueda al guardar cambios en el RUT o razón social
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'rut', 'razon_social'} & set(update_fields):
+            self.busqueda = documento_busqueda(self.user, self)
+            campos = {'busqueda'}
+            # rut_normalizado solo se recalcula si cambió el RUT: los perfiles con un RUT
+            # repetido (filtro "RUT repetido" del admin) lo tienen en NULL y un guardado
+            # completo no debe fallar
+            if self._state.adding or self.rut != self._rut_guardado:
+                self.rut_normalizado = clave_rut(self.rut)
+                campos.add('rut_normalizado')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | campos
+        super().save(*args, **kwargs)
+        self._rut_guardado = self.rut
+        self._tipo_guardado = self.tipo_usuario
+    
     def get_tipo_usuario_display_real(self):
         """Obtener el tipo de usuario real considerando si es superusuario"""
         if self.user.is_superuser:
@@ -81,27 +118,42 @@ class PerfilUsuario(models.Model):
         return self.tipo_usuario
     
     def generate_api_token(self):
-        """Generar nuevo token de API (6 dígitos)"""
-        import random
-        from django.utils import timezone
+        """
+        Generar código de vinculación del chatbot (6 dígitos).
+        El código es de un solo uso y vence en CODIGO_VINCULACION_MINUTOS;
+        el chatbot lo canjea por un token firmado (ver tokens_chatbot.py).
+        """
+        import secrets
+        from django.db import IntegrityError, transaction
         
-        # Generar token de 6 dígitos
-        token = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-        
-        # Asegurar que sea único
-        while PerfilUsuario.objects.filter(api_token=token).exists():
-            token = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-        
-        self.api_token = token
-        self.token_created = timezone.now()
-        self.save()
-        return token
+        # La columna es única: si el código ya existe se genera otro
+        for _ in range(10):
+            self.api_token = f'{secrets.randbelow(10 ** 6):06d}'
+            self.token_created = timezone.now()
+            try:
+                with transaction.atomic():
+                    self.save(update_fields=['api_token', 'token_created'])
+                return self.api_token
+            except IntegrityError:
+                continue
+        raise RuntimeError('No se pudo generar un código de vinculación único')
+    
+    @property
+    def codigo_vinculacion_vigente(self):
+        """True si hay un código de vinculación sin canjear y no vencido"""
+        from .tokens_chatbot import CODIGO_VINCULACION_MINUTOS
+        return bool(
+            self.api_token and self.token_created and
+            self.token_created + timedelta(minutes=CODIGO_VINCULACION_MINUTOS) > timezone.now()
+        )
     
     def revoke_api_token(self):
-        """Revocar token de API"""
+        """Revocar código de vinculación y tokens firmados emitidos al usuario"""
+        from .tokens_chatbot import revocar_tokens
         self.api_token = None
         self.token_created = None
-        self.save()
+        self.save(update_fields=['api_token', 'token_created'])
+        revocar_tokens(self.user_id)
 
 
 class ConfiguracionSistema(models.Model):
@@ -202,16 +254,16 @@ class Notificacion(models.Model):
         verbose_name = 'Notificación'
         verbose_name_plural = 'Notificaciones'
         ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['usuario', 'leida', '-fecha_creacion'], name='usuarios_notif_usuario_idx'),
+        ]
     
     def __str__(self):
         return f"{self.usuario.username} - {self.titulo}"
     
     def marcar_como_leida(self):
-        if not self.leida:
-            from django.utils import timezone
-            self.leida = True
-            self.fecha_leida = timezone.now()
-            self.save()
+        from .notificaciones import marcar_leida
+        return marcar_leida(self)
 
 
 # Señales para crear automáticamente el perfil cuando se crea un usuario
@@ -238,6 +290,65 @@ def save_user_profile(sender, instance, **kwargs):
             instance.perfil.save()
 
 
+@receiver(post_save, sender=User)
+def registrar_disponibilidad_usuario(sender, instance, **kwargs):
+    # Filtros de disponibilidad de este proceso (ver disponibilidad.py)
+    disponibilidad.registrar('username', instance.username)
+    disponibilidad.registrar('email', instance.email)
+
+
+@receiver(post_save, sender=PerfilUsuario)
+def registrar_disponibilidad_rut(sender, instance, **kwargs):
+    disponibilidad.registrar('rut', instance.rut_normalizado)
+
+
+@receiver(post_save, sender=User)
+def actualizar_busqueda_perfil(sender, instance, created, update_fields=None, **kwargs):
+    # El login guarda solo last_login: no afecta al documento de búsqueda
+    if created or (update_fields is not None and not set(CAMPOS_USUARIO) & set(update_fields)):
+        return
+    perfil = getattr(instance, 'perfil', None)
+    if perfil is None:
+        return
+    documento = documento_busqueda(instance, perfil)
+    if documento != perfil.busqueda:
+        perfil.busqueda = documento
+        PerfilUsuario.objects.filter(pk=perfil.pk).update(busqueda=documento)
+
+
+# Los tokens del chatbot llevan el rol y se validan sin consultar la base de
+# datos: si el usuario se desactiva o cambia de rol, se revocan (ver tokens_chatbot.py)
+CAMPOS_TOKEN_USUARIO = ('is_active', 'is_superuser')
+
+
+@receiver(post_init, sender=User)
+def recordar_estado_token(sender, instance, **kwargs):
+    instance._estado_token = tuple(instance.__dict__.get(campo) for campo in CAMPOS_TOKEN_USUARIO)
+
+
+@receiver(post_save, sender=User)
+def revocar_tokens_usuario(sender, instance, created, update_fields=None, **kwargs):
+    if created or None in instance._estado_token or (
+        update_fields is not None and not set(CAMPOS_TOKEN_USUARIO) & set(update_fields)
+    ):
+        return
+    estado = tuple(getattr(instance, campo) for campo in CAMPOS_TOKEN_USUARIO)
+    if estado != instance._estado_token:
+        from .tokens_chatbot import revocar_tokens
+        revocar_tokens(instance.pk)
+        instance._estado_token = estado
+
+
+@receiver(post_save, sender=PerfilUsuario)
+def revocar_tokens_rol(sender, instance, created, update_fields=None, **kwargs):
+    # Se ejecuta dentro de save(), antes de actualizar _tipo_guardado
+    if created or instance._tipo_guardado is None or (update_fields is not None and 'tipo_usuario' not in update_fields):
+        return
+    if instance.tipo_usuario != instance._tipo_guardado:
+        from .tokens_chatbot import revocar_tokens
+        revocar_tokens(instance.user_id)
+
+
 class EmailVerificationToken(models.Model):
     """Código de verificación de correo electrónico"""
     email = models.EmailField()  # Email temporal (antes de crear usuario)
@@ -285,6 +396,63 @@ class EmailVerificationToken(models.Model):
         return False
 
 
+class TokenChatbotRevocado(models.Model):
+    """
+    Lista de revocación de tokens del chatbot: invalida los tokens firmados
+    del usuario emitidos antes de fecha_revocacion. Las entradas más antiguas
+    que la vigencia de los tokens se pueden eliminar.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tokens_chatbot_revocados')
+    fecha_revocacion = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'Token de Chatbot Revocado'
+        verbose_name_plural = 'Tokens de Chatbot Revocados'
+        ordering = ['-fecha_revocacion']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.fecha_revocacion:%d/%m/%Y %H:%M}"
+
+
+class CorreoSaliente(models.Model):
+    """
+    Bandeja de salida de correos. Se escribe en la misma transacción que el
+    cambio que origina el correo y el comando enviar_correos la despacha
+    (ver correo.py).
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('enviado', 'Enviado'),
+        ('fallido', 'Fallido'),
+    ]
+    
+    asunto = models.CharField(max_length=255)
+    remitente = models.CharField(max_length=255)
+    destinatarios = models.JSONField(default=list)
+    cuerpo_texto = models.TextField(blank=True)
+    cuerpo_html = models.TextField(blank=True)
+    adjuntos = models.JSONField(default=list, blank=True, help_text='Lista de {nombre, mimetype, contenido (base64)}')
+    
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = 'Correo Saliente'
+        verbose_name_plural = 'Correos Salientes'
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='usuarios_correo_cola_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.asunto} -> {', '.join(self.destinatarios)} ({self.get_estado_display()})"
+
+
 class PasswordResetToken(models.Model):
     """Token para recuperación de contraseña"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='password_reset_tokens')
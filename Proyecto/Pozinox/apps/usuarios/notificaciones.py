@@ -0,0 +1,113 @@
+"""
+Envío de notificaciones y contador de no leídas.
+
+``notificar`` crea la notificación para todos los destinatarios con un solo
+bulk_create e incrementa en la misma transacción el contador desnormalizado
+PerfilUsuario.notificaciones_no_leidas con un UPDATE ... SET n = n + 1.
+Marcar como leída (una o todas) es un UPDATE condicionado a ``leida=False``
+que descuenta del contador solo las filas que realmente cambiaron, así dos
+peticiones simultáneas no descuentan dos veces.
+
+``no_leidas`` lee el contador del perfil, que PerfilModelBackend carga junto
+con el usuario: no hace consultas adicionales.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Notificacion, PerfilUsuario
+
+TAMANO_LOTE = 500
+
+
+def _ids_usuarios(usuarios):
+    """Acepta un usuario, un id, un queryset de User o una lista de usuarios/ids"""
+    if usuarios is None or isinstance(usuarios, (User, int)):
+        usuarios = [usuarios]
+    if hasattr(usuarios, 'values_list'):
+        return list(usuarios.values_list('pk', flat=True))
+    ids = [u.pk if isinstance(u, User) else u for u in usuarios]
+    return [user_id for user_id in dict.fromkeys(ids) if user_id is not None]
+
+
+def notificar(usuarios, titulo, mensaje, tipo='info', modelo_relacionado='', objeto_id=None):
+    """Crea la misma notificación para cada destinatario. Retorna cuántas se crearon"""
+    ids = _ids_usuarios(usuarios)
+    if not ids:
+        return 0
+
+    with transaction.atomic():
+        Notificacion.objects.bulk_create(
+            [
+                Notificacion(
+                    usuario_id=user_id, tipo=tipo, titulo=titulo, mensaje=mensaje,
+                    modelo_relacionado=modelo_relacionado, objeto_id=objeto_id,
+                )
+                for user_id in ids
+            ],
+            batch_size=TAMANO_LOTE,
+        )
+        PerfilUsuario.objects.filter(user_id__in=ids).update(
+            notificaciones_no_leidas=F('notificaciones_no_leidas') + 1
+        )
+    return len(ids)
+
+
+def _descontar(user_id, cantidad):
+    PerfilUsuario.objects.filter(user_id=user_id).update(
+        notificaciones_no_leidas=Greatest(F('notificaciones_no_leidas') - cantidad, Value(0))
+    )
+
+
+def marcar_leida(notificacion):
+    """Marca una notificación como leída. Retorna True si estaba sin leer"""
+    ahora = timezone.now()
+    with transaction.atomic():
+        cambiadas = Notificacion.objects.filter(pk=notificacion.pk, leida=False).update(
+            leida=True, fecha_leida=ahora
+        )
+        if cambiadas:
+            _descontar(notificacion.usuario_id, cambiadas)
+    if cambiadas:
+        notificacion.leida = True
+        notificacion.fecha_leida = ahora
+    return bool(cambiadas)
+
+
+def marcar_todas_leidas(user):
+    """Marca como leídas todas las notificaciones del usuario con un solo UPDATE"""
+    with transaction.atomic():
+        cambiadas = Notificacion.objects.filter(usuario=user, leida=False).update(
+            leida=True, fecha_leida=timezone.now()
+        )
+        if cambiadas:
+            _descontar(user.pk, cambiadas)
+    return cambiadas
+
+
+def no_leidas(user):
+    """Cantidad de notificaciones sin leer del usuario"""
+    if not user.is_authenticated:
+        return 0
+    try:
+        return user.perfil.notificaciones_no_leidas
+    except PerfilUsuario.DoesNotExist:
+        return 0
+
+
+def recalcular_contadores(user_ids=None):
+    """
+    Recalcula el contador desde Notificacion (p. ej. tras editar notificaciones
+    desde el admin). Sin ``user_ids`` recalcula todos los perfiles.
+    """
+    no_leidas_por_usuario = Notificacion.objects.filter(
+        usuario_id=OuterRef('user_id'), leida=False
+    ).values('usuario_id').annotate(total=Count('id')).values('total')
+    perfiles = PerfilUsuario.objects.all()
+    if user_ids is not None:
+        perfiles = perfiles.filter(user_id__in=user_ids)
+    return perfiles.update(
+        notificaciones_no_leidas=Coalesce(Subquery(no_leidas_por_usuario), 0)
+    )
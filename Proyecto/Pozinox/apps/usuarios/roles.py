@@ -0,0 +1,67 @@
+"""
+Rol del usuario resuelto una sola vez por petición.
+
+El middleware RolMiddleware deja en ``request.rol`` un objeto inmutable con el
+tipo de usuario real (los superusuarios cuentan como administradores) y los
+permisos derivados, para no repetir en cada vista la consulta a ``perfil``.
+"""
+from django.utils.functional import SimpleLazyObject
+
+
+TIPOS_STAFF = ('trabajador', 'administrador')
+
+
+class Rol:
+    """Rol resuelto de un usuario (inmutable)"""
+    __slots__ = ('tipo', 'autenticado', 'es_superusuario', 'es_admin', 'es_staff')
+
+    def __init__(self, tipo=None, autenticado=False, es_superusuario=False):
+        object.__setattr__(self, 'tipo', tipo)
+        object.__setattr__(self, 'autenticado', autenticado)
+        object.__setattr__(self, 'es_superusuario', es_superusuario)
+        object.__setattr__(self, 'es_admin', es_superusuario or tipo == 'administrador')
+        object.__setattr__(self, 'es_staff', es_superusuario or tipo in TIPOS_STAFF)
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError('El rol es de solo lectura')
+
+    def __delattr__(self, nombre):
+        raise AttributeError('El rol es de solo lectura')
+
+    def __repr__(self):
+        return f'<Rol {self.tipo or "anónimo"}>'
+
+
+ROL_ANONIMO = Rol()
+
+
+def obtener_rol(user):
+    """
+    Resuelve el rol del usuario y lo guarda en la instancia, de modo que
+    llamadas posteriores en la misma petición no consultan la base de datos.
+    Con PerfilModelBackend el perfil ya viene cargado vía select_related.
+    """
+    if user is None or not user.is_authenticated:
+        return ROL_ANONIMO
+
+    rol = getattr(user, '_rol_resuelto', None)
+    if rol is None:
+        if user.is_superuser:
+            tipo = 'administrador'
+        else:
+            # hasattr captura RelatedObjectDoesNotExist si el usuario no tiene perfil
+            tipo = user.perfil.tipo_usuario if hasattr(user, 'perfil') else None
+        rol = Rol(tipo=tipo, autenticado=True, es_superusuario=user.is_superuser)
+        user._rol_resuelto = rol
+    return rol
+
+
+class RolMiddleware:
+    """Agrega request.rol (se resuelve la primera vez que se usa)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.rol = SimpleLazyObject(lambda: obtener_rol(request.user))
+        return self.get_response(request)
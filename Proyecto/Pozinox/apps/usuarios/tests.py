@@ -1,2 +1,322 @@
-from django.test import TestCase
+import socketserver
+import threading
+import time
+from io import StringIO
 
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import middleware, notificaciones, tokens_chatbot
+from .busqueda import perfiles_con_rut_repetido
+from .correo import encolar_correo, enviar_pendientes
+from .models import CorreoSaliente, Notificacion, PerfilUsuario, VisitorLog
+from .roles import obtener_rol
+
+
+TABLA_PERFIL = 'usuarios_perfilusuario'
+
+
+def consultas_a_perfil(contexto):
+    """Consultas cuya tabla principal (FROM) es la de perfiles"""
+    return [
+        consulta['sql'] for consulta in contexto.captured_queries
+        if f'FROM "{TABLA_PERFIL}"' in consulta['sql']
+    ]
+
+
+class RolPorPeticionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trabajador = User.objects.create_user('trabajador', 'trabajador@test.cl', 'clave-segura-123')
+        cls.trabajador.perfil.tipo_usuario = 'trabajador'
+        cls.trabajador.perfil.save()
+        cls.cliente = User.objects.create_user('cliente', 'cliente@test.cl', 'clave-segura-123')
+
+    def test_vista_staff_consulta_perfil_a_lo_mas_una_vez(self):
+        self.client.force_login(self.trabajador, backend='apps.usuarios.backends.PerfilModelBackend')
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get(reverse('gestionar_estados_preparacion'))
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(consultas_a_perfil(contexto)), 1)
+
+    def test_sesiones_con_model_backend_siguen_validas(self):
+        self.client.force_login(self.trabajador, backend='django.contrib.auth.backends.ModelBackend')
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get(reverse('gestionar_estados_preparacion'))
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(consultas_a_perfil(contexto)), 1)
+
+    def test_rol_se_resuelve_una_vez(self):
+        usuario = User.objects.get(pk=self.trabajador.pk)
+        with self.assertNumQueries(1):
+            rol = obtener_rol(usuario)
+        with self.assertNumQueries(0):
+            self.assertIs(obtener_rol(usuario), rol)
+        self.assertTrue(rol.es_staff)
+        self.assertFalse(rol.es_admin)
+        with self.assertRaises(AttributeError):
+            rol.es_admin = True
+
+    def test_cliente_sin_permisos(self):
+        self.client.force_login(self.cliente)
+        response = self.client.get(reverse('gestionar_facturacion'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        response = self.client.get(reverse('api_buscar_clientes'), {'q': 'ab'})
+        self.assertEqual(response.status_code, 403)
+
+
+class RutNormalizadoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.original = User.objects.create_user('original', 'original@test.cl', 'clave-segura-123')
+        cls.original.perfil.rut = '12.345.678-5'
+        cls.original.perfil.save()
+        # Perfil con RUT repetido que la migración 0011 dejó sin rut_normalizado
+        cls.repetido = User.objects.create_user('repetido', 'repetido@test.cl', 'clave-segura-123')
+        PerfilUsuario.objects.filter(user=cls.repetido).update(rut='12345678-5')
+
+    def test_guardado_completo_con_rut_repetido(self):
+        perfil = PerfilUsuario.objects.get(user=self.repetido)
+        perfil.telefono = '+56 9 1234 5678'
+        perfil.save()
+        perfil.refresh_from_db()
+        self.assertIsNone(perfil.rut_normalizado)
+
+        self.client.force_login(self.repetido)
+        response = self.client.post(reverse('editar_perfil'), {
+            'first_name': 'Rut', 'last_name': 'Repetido', 'email': 'repetido@test.cl', 'comuna': 'Ñuñoa',
+        })
+        self.assertRedirects(response, reverse('perfil'), fetch_redirect_response=False)
+
+    def test_repetidos_en_el_admin_y_el_comando(self):
+        self.assertEqual(
+            list(perfiles_con_rut_repetido(PerfilUsuario.objects.all()).values_list('user__username', flat=True)),
+            ['repetido'],
+        )
+        salida = StringIO()
+        call_command('ruts_repetidos', stdout=salida)
+        self.assertIn('repetido', salida.getvalue())
+        self.assertIn('ya registrado por original', salida.getvalue())
+
+        admin = User.objects.create_superuser('admin-rut', 'admin-rut@test.cl', 'clave-segura-123')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:usuarios_perfilusuario_changelist'), {'rut_repetido': 'si'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_cambiar_rut_lo_normaliza(self):
+        perfil = PerfilUsuario.objects.get(user=self.repetido)
+        perfil.rut = '11.111.111-1'
+        perfil.save()
+        perfil.refresh_from_db()
+        self.assertEqual(perfil.rut_normalizado, '111111111')
+        self.assertEqual(PerfilUsuario.objects.get(user=self.original).rut_normalizado, '123456785')
+
+
+class TokenChatbotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.trabajador = User.objects.create_user('bot-trabajador', 'bot@test.cl', 'clave-segura-123')
+        PerfilUsuario.objects.filter(user=cls.trabajador).update(tipo_usuario='trabajador')
+
+    def setUp(self):
+        # La lista de revocación en memoria no se revierte con la transacción de cada prueba
+        tokens_chatbot._denylist.update(version=None, revisado=float('-inf'), revocados={})
+
+    def test_cambio_de_rol_revoca_el_token(self):
+        token = tokens_chatbot.emitir_token(User.objects.get(pk=self.trabajador.pk))
+        perfil = PerfilUsuario.objects.get(user=self.trabajador)
+        perfil.telefono = '+56 9 1111 2222'
+        perfil.save()
+        self.assertEqual(tokens_chatbot.validar_token(token)['rol'], 'trabajador')
+
+        perfil.tipo_usuario = 'cliente'
+        perfil.save()
+        with self.assertRaises(tokens_chatbot.TokenInvalido):
+            tokens_chatbot.validar_token(token)
+
+    def test_usuario_desactivado_revoca_el_token(self):
+        token = tokens_chatbot.emitir_token(User.objects.get(pk=self.trabajador.pk))
+        usuario = User.objects.get(pk=self.trabajador.pk)
+        usuario.save(update_fields=['last_login'])
+        self.assertEqual(tokens_chatbot.validar_token(token)['uid'], usuario.pk)
+
+        usuario.is_active = False
+        usuario.save()
+        with self.assertRaises(tokens_chatbot.TokenInvalido):
+            tokens_chatbot.validar_token(token)
+
+    def test_validar_no_consulta_la_base(self):
+        token = tokens_chatbot.emitir_token(User.objects.get(pk=self.trabajador.pk))
+        tokens_chatbot.validar_token(token)
+        with self.assertNumQueries(0):
+            tokens_chatbot.validar_token(token)
+
+
+class _ManejadorSMTP(socketserver.StreamRequestHandler):
+    """Servidor SMTP mínimo para pruebas: acepta todo y guarda los mensajes"""
+
+    def responder(self, linea):
+        self.wfile.write(linea.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.conexiones += 1
+        self.responder('220 localhost')
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea[:4].upper()
+            if comando == b'DATA':
+                self.responder('354 fin con <CRLF>.<CRLF>')
+                datos = []
+                for linea in iter(self.rfile.readline, b''):
+                    if linea == b'.\r\n':
+                        break
+                    datos.append(linea)
+                self.server.mensajes.append(b''.join(datos))
+                self.responder('250 OK')
+            elif comando == b'QUIT':
+                self.responder('221 chao')
+                return
+            else:
+                self.responder('250 OK')
+
+
+class ServidorSMTPLocal(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _ManejadorSMTP)
+        self.conexiones = 0
+        self.mensajes = []
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+    EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+    CORREOS_ASINCRONOS=True, CORREOS_POR_MINUTO=0,
+)
+class BandejaSalidaTests(TestCase):
+
+    def test_lote_por_una_sola_conexion(self):
+        with ServidorSMTPLocal() as servidor, self.settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=servidor.server_address[1]):
+            with transaction.atomic():
+                for i in range(3):
+                    encolar_correo(f'Prueba {i}', ['cliente@test.cl'], texto='Hola', html='<p>Hola</p>')
+                encolar_correo('Con adjunto', 'cliente@test.cl', texto='PDF', adjuntos=[('doc.pdf', b'%PDF-1.4', 'application/pdf')])
+
+            self.assertEqual(enviar_pendientes(), (4, 0))
+
+        self.assertEqual(servidor.conexiones, 1)
+        self.assertEqual(len(servidor.mensajes), 4)
+        self.assertIn(b'doc.pdf', servidor.mensajes[-1])
+        self.assertFalse(CorreoSaliente.objects.exclude(estado='enviado').exists())
+
+    def test_rollback_no_deja_correo(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                encolar_correo('No debe salir', ['cliente@test.cl'], texto='x')
+                raise ValueError
+        self.assertFalse(CorreoSaliente.objects.exists())
+
+    def test_servidor_caido_pospone_sin_gastar_intentos(self):
+        encolar_correo('Pendiente', ['cliente@test.cl'], texto='x')
+        with self.settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=1, EMAIL_TIMEOUT=1):
+            self.assertEqual(enviar_pendientes(), (0, 0))
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual((correo.estado, correo.intentos), ('pendiente', 0))
+
+
+class VisitasTests(TestCase):
+
+    def setUp(self):
+        middleware._visitas.clear()
+        # Sin esto, si la suite tarda más de VISITAS_INTERVALO el lote se vacía antes
+        middleware._ultimo_vaciado[0] = time.monotonic()
+
+    @override_settings(VISITAS_LOTE=3)
+    def test_lote_se_inserta_desde_las_peticiones(self):
+        for _ in range(2):
+            self.client.get('/no-existe/')
+        self.assertFalse(VisitorLog.objects.exists())
+        self.client.get('/no-existe/')
+        self.assertEqual(VisitorLog.objects.count(), 3)
+
+    def test_sin_lote_en_las_pruebas(self):
+        self.client.get('/no-existe/')
+        self.assertEqual(VisitorLog.objects.count(), 1)
+        self.assertEqual(middleware._visitas, [])
+
+
+class NotificacionesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = User.objects.create_user('ana', 'ana@test.cl', 'clave-segura-123')
+        cls.beto = User.objects.create_user('beto', 'beto@test.cl', 'clave-segura-123')
+
+    def contador(self, user):
+        return PerfilUsuario.objects.get(user=user).notificaciones_no_leidas
+
+    def test_notificar(self):
+        # Destinatarios repetidos (usuario e id) reciben una sola notificación
+        self.assertEqual(notificaciones.notificar([self.ana, self.ana.pk, self.beto], 'Hola', 'Mensaje'), 2)
+        self.assertEqual(notificaciones.notificar(User.objects.filter(pk=self.ana.pk), 'Otra', 'Mensaje'), 1)
+        self.assertEqual(notificaciones.notificar([], 'Nadie', 'Mensaje'), 0)
+
+        self.assertEqual(Notificacion.objects.filter(usuario=self.ana).count(), 2)
+        self.assertEqual((self.contador(self.ana), self.contador(self.beto)), (2, 1))
+
+        # El contador se lee del perfil cargado con el usuario, sin consultas
+        ana = User.objects.select_related('perfil').get(pk=self.ana.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(notificaciones.no_leidas(ana), 2)
+
+    def test_marcar_leida_no_descuenta_dos_veces(self):
+        notificaciones.notificar([self.ana], 'Primera', 'Mensaje')
+        notificaciones.notificar([self.ana], 'Segunda', 'Mensaje')
+        # Dos peticiones con la misma notificación cargada antes de marcarla
+        primera = Notificacion.objects.get(titulo='Primera')
+        copia = Notificacion.objects.get(pk=primera.pk)
+
+        self.assertTrue(notificaciones.marcar_leida(primera))
+        self.assertTrue(primera.leida)
+        self.assertFalse(notificaciones.marcar_leida(copia))
+        self.assertEqual(self.contador(self.ana), 1)
+
+    def test_marcar_todas_leidas(self):
+        for titulo in ('Uno', 'Dos', 'Tres'):
+            notificaciones.notificar([self.ana, self.beto], titulo, 'Mensaje')
+        notificaciones.marcar_leida(Notificacion.objects.filter(usuario=self.ana).first())
+
+        self.assertEqual(notificaciones.marcar_todas_leidas(self.ana), 2)
+        self.assertEqual(notificaciones.marcar_todas_leidas(self.ana), 0)
+        self.assertEqual((self.contador(self.ana), self.contador(self.beto)), (0, 3))
+
+    def test_vista_responde_el_contador_actualizado(self):
+        notificaciones.notificar([self.ana], 'Uno', 'Mensaje')
+        notificaciones.notificar([self.ana], 'Dos', 'Mensaje')
+        notificacion = Notificacion.objects.filter(usuario=self.ana).first()
+        self.client.force_login(self.ana, backend='apps.usuarios.backends.PerfilModelBackend')
+        url = reverse('marcar_notificaciones_leidas')
+
+        respuesta = self.client.post(url, {'notificacion_id': notificacion.pk}, headers={'x-requested-with': 'XMLHttpRequest'})
+        self.assertEqual(respuesta.json()['no_leidas'], 1)
+        respuesta = self.client.post(url, headers={'x-requested-with': 'XMLHttpRequest'})
+        self.assertEqual(respuesta.json()['no_leidas'], 0)
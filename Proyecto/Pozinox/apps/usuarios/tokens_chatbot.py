@@ -0,0 +1,137 @@
+"""
+Tokens firmados para el chatbot.
+
+El usuario genera en su perfil un código de 6 dígitos (vinculación) que el
+chatbot canjea una sola vez por un token firmado con HMAC (django.core.signing)
+que lleva el id, nombre de usuario y tipo de usuario. Validar ese token no
+consulta la base de datos: basta con verificar la firma y la vigencia.
+
+Como el token lleva el rol, desactivar al usuario o cambiar su rol (o su
+marca de superusuario) revoca sus tokens: lo hacen las señales post_save de
+User y PerfilUsuario (ver models.py). Un cambio hecho con queryset.update()
+no pasa por esas señales.
+
+La revocación usa TokenChatbotRevocado como lista de revocación. Cada proceso
+la mantiene en memoria y solo la recarga cuando cambia su versión (el id más
+alto de la tabla), lo que se comprueba como máximo cada DENYLIST_TTL segundos.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.core import signing
+from django.db.models import Max
+from django.utils import timezone
+
+from .roles import obtener_rol
+
+
+SALT = 'pozinox.chatbot'
+VIGENCIA_TOKEN_DIAS = 30
+CODIGO_VINCULACION_MINUTOS = 10
+DENYLIST_TTL = 30  # segundos entre comprobaciones de versión
+
+_lock = threading.Lock()
+_denylist = {'version': None, 'revisado': float('-inf'), 'revocados': {}}
+
+
+class TokenInvalido(Exception):
+    """Token con firma inválida, vencido o revocado"""
+
+
+def emitir_token(user):
+    """Token firmado con los datos que el chatbot necesita del usuario"""
+    datos = {
+        'uid': user.pk,
+        'usr': user.username,
+        'rol': obtener_rol(user).tipo,
+        'iat': int(time.time()),
+    }
+    return signing.dumps(datos, salt=SALT, compress=True)
+
+
+def validar_token(token):
+    """
+    Retorna los datos del token o lanza TokenInvalido.
+    Solo consulta la base de datos al refrescar la lista de revocación.
+    """
+    try:
+        datos = signing.loads(token, salt=SALT, max_age=timedelta(days=VIGENCIA_TOKEN_DIAS))
+    except signing.SignatureExpired:
+        raise TokenInvalido('Token expirado')
+    except signing.BadSignature:
+        raise TokenInvalido('Token inválido')
+
+    revocado_en = _revocados().get(datos['uid'])
+    if revocado_en is not None and datos['iat'] <= revocado_en:
+        raise TokenInvalido('Token revocado')
+    return datos
+
+
+def canjear_codigo(codigo):
+    """
+    Canjea un código de vinculación vigente por un token firmado.
+    El código queda consumido. Retorna (perfil, token) o lanza TokenInvalido.
+    """
+    from .models import PerfilUsuario
+
+    limite = timezone.now() - timedelta(minutes=CODIGO_VINCULACION_MINUTOS)
+    perfil = PerfilUsuario.objects.select_related('user').filter(
+        api_token=codigo, token_created__gte=limite
+    ).first()
+    if perfil is None:
+        raise TokenInvalido('Código inválido o expirado')
+
+    # Consumir el código solo si nadie lo canjeó antes
+    consumido = PerfilUsuario.objects.filter(pk=perfil.pk, api_token=codigo).update(
+        api_token=None, token_created=None
+    )
+    if not consumido:
+        raise TokenInvalido('Código inválido o expirado')
+    return perfil, emitir_token(perfil.user)
+
+
+def revocar_tokens(user_id):
+    """Invalida todos los tokens del usuario emitidos hasta ahora"""
+    from .models import TokenChatbotRevocado
+
+    limpiar_revocaciones()
+    entrada = TokenChatbotRevocado.objects.create(user_id=user_id)
+    # Los tokens se emiten con segundos enteros: uno emitido en este mismo
+    # segundo también queda revocado
+    with _lock:
+        _denylist['revocados'][user_id] = int(entrada.fecha_revocacion.timestamp())
+        _denylist['revisado'] = float('-inf')
+
+
+def limpiar_revocaciones():
+    """Elimina entradas más antiguas que la vigencia de los tokens"""
+    from .models import TokenChatbotRevocado
+
+    limite = timezone.now() - timedelta(days=VIGENCIA_TOKEN_DIAS)
+    return TokenChatbotRevocado.objects.filter(fecha_revocacion__lt=limite).delete()[0]
+
+
+def _revocados():
+    """Diccionario user_id -> timestamp de la última revocación vigente"""
+    ahora = time.monotonic()
+    if ahora - _denylist['revisado'] < DENYLIST_TTL:
+        return _denylist['revocados']
+
+    from .models import TokenChatbotRevocado
+
+    with _lock:
+        if ahora - _denylist['revisado'] < DENYLIST_TTL:
+            return _denylist['revocados']
+        version = TokenChatbotRevocado.objects.aggregate(version=Max('id'))['version']
+        if version != _denylist['version']:
+            limite = timezone.now() - timedelta(days=VIGENCIA_TOKEN_DIAS)
+            filas = TokenChatbotRevocado.objects.filter(
+                fecha_revocacion__gte=limite
+            ).values('user_id').annotate(ultima=Max('fecha_revocacion'))
+            _denylist['revocados'] = {
+                fila['user_id']: int(fila['ultima'].timestamp()) for fila in filas
+            }
+            _denylist['version'] = version
+        _denylist['revisado'] = ahora
+    return _denylist['revocados']
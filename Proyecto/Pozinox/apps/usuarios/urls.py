@@ -8,6 +8,8 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('perfil/', views.perfil_view, name='perfil'),
     path('perfil/editar/', views.editar_perfil_view, name='editar_perfil'),
+    path('notificaciones/', views.notificaciones_view, name='notificaciones'),
+    path('notificaciones/marcar-leidas/', views.marcar_notificaciones_leidas, name='marcar_notificaciones_leidas'),
     
     # Recuperación de contraseña
     path('password-reset/', views.password_reset_request, name='password_reset_request'),
@@ -4,14 +4,20 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.views.decorators.csrf import csrf_protect
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.utils import timezone
 from django.conf import settings
 from django.http import JsonResponse
 from django.urls import reverse
-from .models import PerfilUsuario, EmailVerificationToken, PasswordResetToken
+from .models import PerfilUsuario, EmailVerificationToken, PasswordResetToken, Notificacion
+from apps.exportacion import exportar_queryset, formato_solicitado
+from .decorators import staff_required
+from . import tokens_chatbot
+from .busqueda import buscar_clientes, clave_rut
+from . import disponibilidad
+from . import notificaciones
+from .correo import encolar_correo
 from .forms import LoginForm, RegistroForm, UsuarioForm, PasswordResetRequestForm, PasswordResetForm, PerfilEditForm, CrearCompradorForm
 
 
@@ -152,6 +158,37 @@ def editar_perfil_view(request):
     return render(request, 'usuarios/editar_perfil.html', {'form': form})
 
 
+@login_required
+def notificaciones_view(request):
+    """Notificaciones del usuario, las más recientes primero"""
+    from django.core.paginator import Paginator
+    paginator = Paginator(request.user.notificaciones.all(), 20)
+    context = {
+        'notificaciones': paginator.get_page(request.GET.get('page')),
+    }
+    return render(request, 'usuarios/notificaciones.html', context)
+
+
+@login_required
+def marcar_notificaciones_leidas(request):
+    """Marca como leída una notificación (notificacion_id) o todas las del usuario"""
+    if request.method != 'POST':
+        return redirect('notificaciones')
+
+    notificacion_id = request.POST.get('notificacion_id')
+    if notificacion_id:
+        notificacion = get_object_or_404(Notificacion, pk=notificacion_id, usuario=request.user)
+        notificaciones.marcar_leida(notificacion)
+    else:
+        notificaciones.marcar_todas_leidas(request.user)
+
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        # El perfil se cargó antes del UPDATE del contador
+        request.user.perfil.refresh_from_db(fields=['notificaciones_no_leidas'])
+        return JsonResponse({'success': True, 'no_leidas': notificaciones.no_leidas(request.user)})
+    return redirect('notificaciones')
+
+
 # Decorador para verificar si es superusuario
 def es_superusuario(user):
     return user.is_superuser
@@ -195,6 +232,22 @@ def lista_usuarios_admin(request):
             Q(email__icontains=busqueda)
         )
     
+    formato = formato_solicitado(request)
+    if formato:
+        tipos_usuario = dict(PerfilUsuario.TIPO_USUARIO)
+        return exportar_queryset(usuarios, [
+            ('username', 'Usuario'),
+            ('first_name', 'Nombre'),
+            ('last_name', 'Apellido'),
+            ('email', 'Email'),
+            ('perfil__rut', 'RUT'),
+            ('perfil__tipo_usuario', 'Tipo de Usuario', lambda v: tipos_usuario.get(v, v)),
+            ('perfil__telefono', 'Teléfono'),
+            ('is_active', 'Activo'),
+            ('date_joined', 'Fecha de Registro'),
+            ('last_login', 'Último Acceso'),
+        ], 'usuarios', formato)
+    
     # Paginación
     paginator = Paginator(usuarios, 20)
     page_number = request.GET.get('page')
@@ -308,13 +361,11 @@ Equipo Pozinox
     
     # Enviar email
     try:
-        send_mail(
-            subject='Tu código de verificación - Pozinox',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[email],
-            html_message=html_message,
-            fail_silently=False,
+        encolar_correo(
+            asunto='Tu código de verificación - Pozinox',
+            destinatarios=[email],
+            texto=plain_message,
+            html=html_message,
         )
         return True
     except Exception as e:
@@ -369,13 +420,11 @@ Equipo Pozinox
     
     # Enviar email
     try:
-        send_mail(
-            subject='¡Bienvenido a Pozinox! - Tu cuenta ha sido creada',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+        encolar_correo(
+            asunto='¡Bienvenido a Pozinox! - Tu cuenta ha sido creada',
+            destinatarios=[user.email],
+            texto=plain_message,
+            html=html_message,
         )
         return True
     except Exception as e:
@@ -469,8 +518,8 @@ def verificar_disponibilidad_username(request):
         if not username:
             return JsonResponse({'disponible': True, 'message': ''})
         
-        # Verificar si el username ya existe
-        if User.objects.filter(username=username).exists():
+        # Verificar si el username ya existe (el filtro de Bloom descarta sin consultar)
+        if disponibilidad.podria_existir('username', username) and User.objects.filter(username=username).exists():
             return JsonResponse({
                 'disponible': False,
                 'message': 'Este nombre de usuario ya está en uso.'
@@ -487,7 +536,7 @@ def verificar_disponibilidad_username(request):
 def verificar_disponibilidad_rut(request):
     """Verificar disponibilidad de RUT via AJAX"""
     if request.method == 'GET' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        from .forms import validar_rut_chileno, formatear_rut
+        from .forms import validar_rut_chileno
         
         rut = request.GET.get('rut', '').strip()
         
@@ -502,12 +551,9 @@ def verificar_disponibilidad_rut(request):
                 'message': 'RUT inválido. Verifica el número y dígito verificador.'
             })
         
-        # Formatear el RUT
-        rut_formateado = formatear_rut(rut)
-        
-        # Verificar si el RUT ya existe
-        from .models import PerfilUsuario
-        if PerfilUsuario.objects.filter(rut=rut_formateado).exists():
+        # Verificar si el RUT ya existe (columna normalizada con índice único)
+        rut_normalizado = clave_rut(rut)
+        if disponibilidad.podria_existir('rut', rut_normalizado) and PerfilUsuario.objects.filter(rut_normalizado=rut_normalizado).exists():
             return JsonResponse({
                 'disponible': False,
                 'valido': True,
@@ -541,7 +587,7 @@ def verificar_disponibilidad_email(request):
             })
         
         # Verificar si el email ya existe
-        if User.objects.filter(email=email).exists():
+        if disponibilidad.podria_existir('email', email) and User.objects.filter(email=email).exists():
             return JsonResponse({
                 'disponible': False,
                 'message': 'Este correo ya está registrado en el sistema.'
@@ -561,7 +607,7 @@ def verificar_disponibilidad_email(request):
 
 @login_required
 def api_generate_token(request):
-    """Generar token de API para chatbot"""
+    """Generar código de vinculación para el chatbot"""
     if request.method == 'POST':
         try:
             perfil = request.user.perfil
@@ -570,6 +616,7 @@ def api_generate_token(request):
             return JsonResponse({
                 'success': True,
                 'token': token,
+                'expira_minutos': tokens_chatbot.CODIGO_VINCULACION_MINUTOS,
                 'message': 'Token generado exitosamente'
             })
         except Exception as e:
@@ -582,7 +629,12 @@ def api_generate_token(request):
 
 
 def api_validate_token(request):
-    """Validar token de API para chatbot"""
+    """
+    Validar token de API para chatbot.
+    Con el código de 6 dígitos se hace la vinculación: el código se consume y
+    la respuesta incluye el token firmado que el chatbot debe enviar desde
+    entonces. El token firmado se valida sin consultar la base de datos.
+    """
     if request.method == 'POST':
         token = request.POST.get('token')
         
@@ -593,30 +645,28 @@ def api_validate_token(request):
             })
         
         try:
-            perfil = PerfilUsuario.objects.get(api_token=token)
-            
-            # Verificar que el token no esté expirado (válido por 30 días)
-            from datetime import timedelta
-            if perfil.token_created and perfil.token_created + timedelta(days=30) > timezone.now():
-                return JsonResponse({
-                    'success': True,
-                    'valid': True,
-                    'user_id': perfil.user.id,
-                    'username': perfil.user.username,
-                    'tipo_usuario': perfil.get_tipo_usuario_real(),
-                    'message': 'Token válido'
-                })
+            if len(token) == 6 and token.isdigit():
+                perfil, token_firmado = tokens_chatbot.canjear_codigo(token)
+                datos = tokens_chatbot.validar_token(token_firmado)
+                respuesta = {'token': token_firmado, 'expira_dias': tokens_chatbot.VIGENCIA_TOKEN_DIAS}
             else:
-                return JsonResponse({
-                    'success': False,
-                    'valid': False,
-                    'message': 'Token expirado'
-                })
-        except PerfilUsuario.DoesNotExist:
+                datos = tokens_chatbot.validar_token(token)
+                respuesta = {}
+            
+            respuesta.update({
+                'success': True,
+                'valid': True,
+                'user_id': datos['uid'],
+                'username': datos['usr'],
+                'tipo_usuario': datos['rol'],
+                'message': 'Token válido'
+            })
+            return JsonResponse(respuesta)
+        except tokens_chatbot.TokenInvalido as e:
             return JsonResponse({
                 'success': False,
                 'valid': False,
-                'message': 'Token inválido'
+                'message': str(e)
             })
         except Exception as e:
             return JsonResponse({
@@ -685,13 +735,11 @@ Equipo Pozinox
     
     # Enviar email
     try:
-        send_mail(
-            subject='Recuperar contraseña - Pozinox',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+        encolar_correo(
+            asunto='Recuperar contraseña - Pozinox',
+            destinatarios=[user.email],
+            texto=plain_message,
+            html=html_message,
         )
         return True
     except Exception as e:
@@ -805,65 +853,38 @@ def password_reset_confirm(request, token):
 
 
 @login_required
+@staff_required(json=True)
 def api_buscar_clientes(request):
-    """API para buscar clientes dinámicamente"""
-    from django.db.models import Q
-    
-    # Verificar permisos
-    tiene_permiso = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
-    
-    if not tiene_permiso:
-        return JsonResponse({'error': 'No tienes permisos'}, status=403)
-    
+    """API para buscar clientes dinámicamente (índice de búsqueda, ver busqueda.py)"""
     query = request.GET.get('q', '').strip()
     
     if len(query) < 2:
         return JsonResponse({'clientes': []})
     
-    # Buscar clientes
-    clientes = User.objects.filter(
-        perfil__tipo_usuario='cliente',
-        is_active=True
-    ).filter(
-        Q(username__icontains=query) |
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query) |
-        Q(email__icontains=query) |
-        Q(perfil__rut__icontains=query)
-    ).select_related('perfil')[:10]
+    # Buscar clientes por prefijo, ordenados por relevancia
+    perfiles = buscar_clientes(query, limite=10)
     
     # Formatear resultados
     resultados = []
-    for cliente in clientes:
+    for perfil in perfiles:
+        cliente = perfil.user
         nombre_completo = cliente.get_full_name() if cliente.get_full_name() else None
         resultados.append({
             'id': cliente.id,
             'username': cliente.username,
             'nombre_completo': nombre_completo,
             'email': cliente.email,
-            'rut': cliente.perfil.rut if hasattr(cliente, 'perfil') else None,
-            'tipo_cliente': cliente.perfil.tipo_cliente if hasattr(cliente, 'perfil') else 'persona',
+            'rut': perfil.rut,
+            'tipo_cliente': perfil.tipo_cliente,
         })
     
     return JsonResponse({'clientes': resultados})
 
 
 @login_required
+@staff_required(mensaje='No tienes permisos para crear compradores.')
 def crear_comprador_view(request):
     """Vista para que trabajadores/admins creen nuevos clientes"""
-    # Verificar permisos
-    tiene_permiso = request.user.is_superuser or (
-        hasattr(request.user, 'perfil') and 
-        request.user.perfil.tipo_usuario in ['trabajador', 'administrador']
-    )
-    
-    if not tiene_permiso:
-        messages.error(request, 'No tienes permisos para crear compradores.')
-        return redirect('home')
-    
     if request.method == 'POST':
         form = CrearCompradorForm(request.POST)
         if form.is_valid():
@@ -1,16 +1,83 @@
 """
 Utilidades para integración con Supabase Storage
+
+exists() y size() listan solo la carpeta del archivo, filtrando por su nombre
+(opción ``search`` de la API) y paginando, en vez de listar la raíz del bucket.
+Los metadatos consultados se guardan en una caché en memoria del proceso por
+DURACION_CACHE_METADATOS segundos (incluida la ausencia del archivo); _save y
+delete la actualizan. _save no lista antes de subir: si el nombre ya existe la
+API responde 409 (Duplicate) y se reintenta con otro nombre.
+
+url() guarda las URLs públicas en otra caché LRU del proceso (MAX_CACHE_URLS
+nombres): armarlas pasa por botocore o por el cliente de Supabase y las
+plantillas del catálogo piden varias por producto (imagen y miniaturas).
+
+_save no carga el archivo completo en memoria: los archivos más grandes que
+FILE_UPLOAD_MAX_MEMORY_SIZE se suben desde disco (el archivo temporal del
+upload o una copia escrita por partes) y httpx envía el cuerpo por bloques.
 """
 import os, uuid, mimetypes
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
 from django.conf import settings
 from django.core.files.storage import Storage
 from django.core.files.base import ContentFile
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
 from supabase import create_client
 
 
+DURACION_CACHE_METADATOS = 300  # segundos
+MAX_CACHE_METADATOS = 10000
+TAMANO_PAGINA_LISTADO = 100
+INTENTOS_NOMBRE = 3
+DURACION_CACHE_URLS = 3600  # segundos
+MAX_CACHE_URLS = 20000
+
+
+class CacheMetadatos:
+    """Caché LRU con vencimiento: nombre -> metadatos del objeto (None = no existe) o URL"""
+    
+    AUSENTE = object()
+    
+    def __init__(self, duracion=DURACION_CACHE_METADATOS, maximo=MAX_CACHE_METADATOS):
+        self.duracion = duracion
+        self.maximo = maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def obtener(self, nombre):
+        """Metadatos guardados, None si se sabe que no existe, o CacheMetadatos.AUSENTE"""
+        with self._lock:
+            entrada = self._datos.get(nombre)
+            if entrada is None:
+                return self.AUSENTE
+            vence, metadatos = entrada
+            if vence < time.monotonic():
+                del self._datos[nombre]
+                return self.AUSENTE
+            self._datos.move_to_end(nombre)
+            return metadatos
+    
+    def guardar(self, nombre, metadatos):
+        with self._lock:
+            self._datos[nombre] = (time.monotonic() + self.duracion, metadatos)
+            self._datos.move_to_end(nombre)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+
 class SupabaseStorage(Storage):
     """Storage backend personalizado para Supabase Storage"""
     
+    # Compartidas por todas las instancias del proceso
+    cache_metadatos = CacheMetadatos()
+    cache_urls = CacheMetadatos(DURACION_CACHE_URLS, MAX_CACHE_URLS)
+    
     def __init__(self):
         if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
             raise ValueError("SUPABASE_URL y SUPABASE_KEY deben estar configurados en settings.py")
@@ -19,18 +86,72 @@ class SupabaseStorage(Storage):
     
     def _save(self, name, content):
         """Guarda un archivo en Supabase Storage"""
-        if self.exists(name):
+        # Si la caché ya sabe que el nombre está ocupado, se cambia antes de subir
+        if self.cache_metadatos.obtener(self._clave(name)) not in (CacheMetadatos.AUSENTE, None):
             name = self.get_available_name(name)
         
-        file_content = content.read() if hasattr(content, 'read') else content
+        content_type = self._guess_content_type(name)
+        
+        with self._cuerpo_subida(content) as (cuerpo, tamano):
+            # get_available_name ya agrega un sufijo aleatorio, así que no se lista
+            # antes de subir: solo si la API responde que el nombre existe se genera otro
+            for intento in range(INTENTOS_NOMBRE):
+                if hasattr(cuerpo, 'seek'):
+                    cuerpo.seek(0)
+                try:
+                    self.client.storage.from_(self.bucket_name).upload(
+                        name, cuerpo, file_options={"content-type": content_type}
+                    )
+                    break
+                except Exception as e:
+                    if not self._es_duplicado(e) or intento == INTENTOS_NOMBRE - 1:
+                        raise IOError(f"Error al subir archivo a Supabase: {str(e)}")
+                    self.cache_metadatos.guardar(self._clave(name), {})
+                    name = self.get_available_name(name)
+        self.cache_metadatos.guardar(self._clave(name), {'size': tamano, 'mimetype': content_type})
+        return name
+    
+    @staticmethod
+    @contextmanager
+    def _cuerpo_subida(content):
+        """
+        (cuerpo, tamaño) para la API de Storage. Los archivos pequeños se leen
+        a bytes; los grandes se abren desde disco (BufferedReader) para que el
+        cuerpo se envíe por bloques sin cargarlo en memoria.
+        """
+        if isinstance(content, bytes):
+            yield content, len(content)
+            return
+        tamano = getattr(content, 'size', None)
+        if tamano is not None and tamano <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            content.seek(0)
+            datos = content.read()
+            yield datos, len(datos)
+            return
+        
+        if hasattr(content, 'temporary_file_path'):
+            # TemporaryUploadedFile: Django ya escribió el upload en disco
+            with open(content.temporary_file_path(), 'rb') as cuerpo:
+                yield cuerpo, os.fstat(cuerpo.fileno()).st_size
+            return
         
+        # Otro archivo (p. ej. generado en memoria o remoto): se copia a disco por partes
+        temporal = tempfile.NamedTemporaryFile(suffix='.upload', delete=False)
         try:
-            self.client.storage.from_(self.bucket_name).upload(
-                name, file_content, file_options={"content-type": self._guess_content_type(name)}
-            )
-            return name
-        except Exception as e:
-            raise IOError(f"Error al subir archivo a Supabase: {str(e)}")
+            with temporal:
+                if hasattr(content, 'chunks'):
+                    for parte in content.chunks():
+                        temporal.write(parte)
+                else:
+                    shutil.copyfileobj(content, temporal)
+            with open(temporal.name, 'rb') as cuerpo:
+                yield cuerpo, os.fstat(cuerpo.fileno()).st_size
+        finally:
+            os.unlink(temporal.name)
+    
+    @staticmethod
+    def _es_duplicado(error):
+        return getattr(error, 'code', None) == 'Duplicate' or str(getattr(error, 'status', '')) == '409'
     
     def _open(self, name, mode='rb'):
         """Descarga un archivo desde Supabase Storage"""
@@ -45,11 +166,44 @@ class SupabaseStorage(Storage):
             self.client.storage.from_(self.bucket_name).remove([name])
         except Exception as e:
             raise IOError(f"Error al eliminar archivo de Supabase: {str(e)}")
+        self.cache_metadatos.guardar(self._clave(name), None)
+    
+    def _clave(self, name):
+        return f"{self.bucket_name}/{name.lstrip('/')}"
+    
+    def _buscar_metadatos(self, name):
+        """
+        Metadatos del objeto listando solo su carpeta y filtrando por su nombre.
+        Retorna None si no existe. Los errores de la API se propagan.
+        """
+        carpeta, archivo = os.path.split(name.lstrip('/'))
+        bucket = self.client.storage.from_(self.bucket_name)
+        offset = 0
+        while True:
+            # search filtra por prefijo del nombre: se busca la coincidencia exacta
+            pagina = bucket.list(carpeta, {
+                'limit': TAMANO_PAGINA_LISTADO, 'offset': offset, 'search': archivo,
+                'sortBy': {'column': 'name', 'order': 'asc'},
+            })
+            for item in pagina:
+                if item.get('name') == archivo:
+                    return item.get('metadata') or {}
+            if len(pagina) < TAMANO_PAGINA_LISTADO:
+                return None
+            offset += TAMANO_PAGINA_LISTADO
+    
+    def _metadatos(self, name):
+        clave = self._clave(name)
+        metadatos = self.cache_metadatos.obtener(clave)
+        if metadatos is CacheMetadatos.AUSENTE:
+            metadatos = self._buscar_metadatos(name)
+            self.cache_metadatos.guardar(clave, metadatos)
+        return metadatos
     
     def exists(self, name):
         """Verifica si un archivo existe en Supabase Storage"""
         try:
-            return any(f['name'] == name for f in self.client.storage.from_(self.bucket_name).list())
+            return self._metadatos(name) is not None
         except:
             return False
     
@@ -66,19 +220,22 @@ class SupabaseStorage(Storage):
     def size(self, name):
         """Retorna el tamaño de un archivo"""
         try:
-            for f in self.client.storage.from_(self.bucket_name).list():
-                if f['name'] == name:
-                    return f.get('metadata', {}).get('size', 0)
-            return 0
+            return (self._metadatos(name) or {}).get('size', 0)
         except:
             return 0
     
     def url(self, name):
         """Retorna la URL pública del archivo"""
+        clave = self._clave(name)
+        url = self.cache_urls.obtener(clave)
+        if url is not CacheMetadatos.AUSENTE:
+            return url
         try:
-            return self.client.storage.from_(self.bucket_name).get_public_url(name)
+            url = self.client.storage.from_(self.bucket_name).get_public_url(name)
         except Exception as e:
             return f"{settings.SUPABASE_URL}/storage/v1/object/public/{self.bucket_name}/{name}"
+        self.cache_urls.guardar(clave, url)
+        return url
     
     def get_available_name(self, name, max_length=None):
         """Genera un nombre único para el archivo"""
@@ -96,3 +253,42 @@ def usar_supabase_storage():
     """Función helper para verificar si se debe usar Supabase Storage"""
     return bool(settings.SUPABASE_URL and settings.SUPABASE_KEY)
 
+
+
+class S3StreamingStorage(S3Boto3Storage):
+    """
+    S3Boto3Storage que sube desde el archivo temporal del upload y guarda en
+    caché las URLs públicas.
+
+    upload_fileobj (lo que usa S3Boto3Storage) copia a memoria cada parte del
+    multipart antes de enviarla; upload_file con la ruta lee cada parte desde
+    disco a medida que se envía. Los uploads pequeños (en memoria) y los que
+    se comprimen con gzip siguen el camino normal.
+
+    Sin AWS_S3_CUSTOM_DOMAIN, url() arma la URL con generate_presigned_url de
+    botocore aunque no se firme. Solo se guardan las URLs sin firma
+    (AWS_QUERYSTRING_AUTH=False), que no vencen.
+    """
+    
+    cache_urls = CacheMetadatos(DURACION_CACHE_URLS, MAX_CACHE_URLS)
+    
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if self.querystring_auth or parameters or http_method:
+            return super().url(name, parameters, expire, http_method)
+        clave = f"{self.bucket_name}/{name}"
+        url = self.cache_urls.obtener(clave)
+        if url is CacheMetadatos.AUSENTE:
+            url = super().url(name)
+            self.cache_urls.guardar(clave, url)
+        return url
+    
+    def _save(self, name, content):
+        if not hasattr(content, 'temporary_file_path') or self.gzip:
+            return super()._save(name, content)
+        cleaned_name = clean_name(name)
+        name = self._normalize_name(cleaned_name)
+        params = self._get_write_parameters(name, content)
+        self.bucket.Object(name).upload_file(
+            content.temporary_file_path(), ExtraArgs=params, Config=self.transfer_config
+        )
+        return cleaned_name